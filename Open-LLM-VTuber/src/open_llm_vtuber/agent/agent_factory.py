@@ -1,17 +1,55 @@
-from typing import Type, Literal
+import importlib
+import sys
+import time
+from typing import Type, Literal, Dict, Tuple, TYPE_CHECKING
 from loguru import logger
 
 from .agents.agent_interface import AgentInterface
-from .agents.basic_memory_agent import BasicMemoryAgent
-from .agents.astr_agent import AstrAgent
-from .stateless_llm_factory import LLMFactory as StatelessLLMFactory
-from .agents.hume_ai import HumeAIAgent
-from .agents.letta_agent import LettaAgent
-
-from ..mcpp.tool_manager import ToolManager
-from ..mcpp.tool_executor import ToolExecutor
 from typing import Optional
 
+if TYPE_CHECKING:
+    from ..mcpp.tool_manager import ToolManager
+    from ..mcpp.tool_executor import ToolExecutor
+
+
+# Agent name -> (module path relative to this package, attribute name).
+# Modules are imported on first use, so a deployment only pays the import
+# cost (and the memory) of the backend selected by conversation_agent_choice.
+AGENT_REGISTRY: Dict[str, Tuple[str, str]] = {
+    "basic_memory_agent": (".agents.basic_memory_agent", "BasicMemoryAgent"),
+    "mem0_agent": (".agents.mem0_llm", "LLM"),
+    "hume_ai_agent": (".agents.hume_ai", "HumeAIAgent"),
+    "letta_agent": (".agents.letta_agent", "LettaAgent"),
+    "astr_agent": (".agents.astr_agent", "AstrAgent"),
+    "stateless_llm_factory": (".stateless_llm_factory", "LLMFactory"),
+}
+
+# Registry name -> (import time in seconds, number of newly imported modules)
+_import_costs: Dict[str, Tuple[float, int]] = {}
+
+
+def load_agent_class(name: str):
+    """Import and return the class registered under ``name``, recording its import cost."""
+    if name not in AGENT_REGISTRY:
+        raise ValueError(f"Unsupported agent type: {name}")
+    module_path, attr = AGENT_REGISTRY[name]
+    if name not in _import_costs:
+        modules_before = len(sys.modules)
+        start = time.perf_counter()
+        module = importlib.import_module(module_path, __package__)
+        _import_costs[name] = (
+            time.perf_counter() - start,
+            len(sys.modules) - modules_before,
+        )
+        elapsed, new_modules = _import_costs[name]
+        logger.info(
+            f"Loaded {name} from {module_path} in {elapsed * 1000:.1f} ms "
+            f"({new_modules} new modules)"
+        )
+    else:
+        module = importlib.import_module(module_path, __package__)
+    return getattr(module, attr)
+
 
 class AgentFactory:
     @staticmethod
@@ -57,6 +95,7 @@ class AgentFactory:
                 )
 
             # Create the stateless LLM
+            StatelessLLMFactory = load_agent_class("stateless_llm_factory")
             llm = StatelessLLMFactory.create_llm(
                 llm_provider=llm_provider, system_prompt=system_prompt, **llm_config
             )
@@ -64,11 +103,12 @@ class AgentFactory:
             tool_prompts = kwargs.get("system_config", {}).get("tool_prompts", {})
 
             # Extract MCP components/data needed by BasicMemoryAgent from kwargs
-            tool_manager: Optional[ToolManager] = kwargs.get("tool_manager")
-            tool_executor: Optional[ToolExecutor] = kwargs.get("tool_executor")
+            tool_manager: Optional["ToolManager"] = kwargs.get("tool_manager")
+            tool_executor: Optional["ToolExecutor"] = kwargs.get("tool_executor")
             mcp_prompt_string: str = kwargs.get("mcp_prompt_string", "")
 
             # Create the agent with the LLM and live2d_model
+            BasicMemoryAgent = load_agent_class("basic_memory_agent")
             return BasicMemoryAgent(
                 llm=llm,
                 system=system_prompt,
@@ -87,7 +127,7 @@ class AgentFactory:
             )
 
         elif conversation_agent_choice == "mem0_agent":
-            from .agents.mem0_llm import LLM as Mem0LLM
+            Mem0LLM = load_agent_class("mem0_agent")
 
             mem0_settings = agent_settings.get("mem0_agent", {})
             if not mem0_settings:
@@ -110,6 +150,7 @@ class AgentFactory:
 
         elif conversation_agent_choice == "hume_ai_agent":
             settings = agent_settings.get("hume_ai_agent", {})
+            HumeAIAgent = load_agent_class("hume_ai_agent")
             return HumeAIAgent(
                 api_key=settings.get("api_key"),
                 host=settings.get("host", "api.hume.ai"),
@@ -119,6 +160,7 @@ class AgentFactory:
 
         elif conversation_agent_choice == "letta_agent":
             settings = agent_settings.get("letta_agent", {})
+            LettaAgent = load_agent_class("letta_agent")
             return LettaAgent(
                 live2d_model=live2d_model,
                 id=settings.get("id"),
@@ -140,11 +182,12 @@ class AgentFactory:
             tool_prompts = kwargs.get("system_config", {}).get("tool_prompts", {})
 
             # Extract MCP components/data needed by AstrAgent from kwargs
-            tool_manager: Optional[ToolManager] = kwargs.get("tool_manager")
-            tool_executor: Optional[ToolExecutor] = kwargs.get("tool_executor")
+            tool_manager: Optional["ToolManager"] = kwargs.get("tool_manager")
+            tool_executor: Optional["ToolExecutor"] = kwargs.get("tool_executor")
             mcp_prompt_string: str = kwargs.get("mcp_prompt_string", "")
 
             # Create the agent with the LLM and live2d_model
+            AstrAgent = load_agent_class("astr_agent")
             return AstrAgent(
                 llm_url=llm_url,
                 system=system_prompt,
@@ -158,6 +201,21 @@ class AgentFactory:
                 tool_manager=tool_manager,
                 tool_executor=tool_executor,
                 mcp_prompt_string=mcp_prompt_string,
+                image_cache_dir=astr_agent_settings.get("image_cache_dir", "cache/astr_images"),
+                image_cache_max_bytes=astr_agent_settings.get(
+                    "image_cache_max_bytes", 256 * 1024 * 1024
+                ),
+                persona_id=astr_agent_settings.get("persona_id"),
+                character_name=astr_agent_settings.get("character_name") or kwargs.get("character_name"),
+                deterministic_tools=astr_agent_settings.get("deterministic_tools", []),
+                tool_cache_ttl=astr_agent_settings.get("tool_cache_ttl", 300),
+                capture_path=astr_agent_settings.get("capture_path", ""),
+                response_cache=astr_agent_settings.get("response_cache", True),
+                streaming=astr_agent_settings.get("streaming", True),
+                image_max_width=astr_agent_settings.get("image_max_width", 1024),
+                image_max_height=astr_agent_settings.get("image_max_height", 1024),
+                image_formats=astr_agent_settings.get("image_formats"),
+                max_frame_size=astr_agent_settings.get("max_frame_size", 4 * 1024 * 1024),
             )
         else:
             raise ValueError(f"Unsupported agent type: {conversation_agent_choice}")
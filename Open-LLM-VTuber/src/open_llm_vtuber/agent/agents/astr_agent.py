@@ -1,6 +1,14 @@
 import asyncio
+import base64
+import gzip
+import hashlib
 import json
+import os
+import re
+import time
+import uuid
 import websockets
+from collections import OrderedDict
 from typing import AsyncIterator, List, Dict, Any, Callable, Literal, Union, Optional
 from loguru import logger
 
@@ -55,6 +63,17 @@ def batch_input_to_dict(batch: BatchInput) -> dict:
     }
 
 
+def sender_identity(batch: BaseInput, default_id: str, default_name: str) -> tuple:
+    """
+    取输入的真实发送者 (user_id, user_name)：优先使用 metadata 中的 user_id/user_name
+    （如直播弹幕的观众），其次用首条文本的 from_name 作为昵称。
+    """
+    metadata = getattr(batch, "metadata", None) or {}
+    texts = getattr(batch, "texts", None) or []
+    name = metadata.get("user_name") or (texts[0].from_name if texts and texts[0].from_name else default_name)
+    return str(metadata.get("user_id") or default_id), name
+
+
 def parse_output_message(msg: str) -> BaseOutput:
     """
     将 WebSocket 返回的 JSON 消息解析成 BaseOutput 子类
@@ -94,37 +113,338 @@ def parse_output_message(msg: str) -> BaseOutput:
         raise ValueError(f"Unknown output type from server: {data}")
 
 
+def _input_text(batch: BaseInput) -> str:
+    """输入中全部文本按行拼接。"""
+    return "\n".join(text.content for text in getattr(batch, "texts", None) or [])
+
+
+def _normalize_turn_text(text: str) -> str:
+    """去掉表情标签和空白，用于比较群聊轮次文本。"""
+    return re.sub(r"\[[^\]]*\]|\s+", "", text)
+
+
+class ImageCache:
+    """
+    按内容哈希索引的本地磁盘 LRU 图片缓存。
+
+    与服务端的图片握手配合使用：服务端先发送 image_offer(hash)，
+    命中缓存时客户端回复 image_have，服务端不再传输图片内容。
+    """
+
+    def __init__(self, cache_dir: str = "cache/astr_images", max_bytes: int = 256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # hash -> (path, size)
+        self._total_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        """从缓存目录重建索引，按最近访问时间排序。"""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name.split(".", 1)[0], path, stat.st_size))
+        for _, image_hash, path, size in sorted(files):
+            self._entries[image_hash] = (path, size)
+            self._total_bytes += size
+        self._evict()
+
+    def get(self, image_hash: str) -> Optional[str]:
+        """返回缓存中图片的路径，并刷新其 LRU 位置；未命中返回 None。"""
+        entry = self._entries.get(image_hash)
+        if entry is None:
+            return None
+        path = entry[0]
+        if not os.path.exists(path):
+            self._entries.pop(image_hash)
+            self._total_bytes -= entry[1]
+            return None
+        self._entries.move_to_end(image_hash)
+        os.utime(path)
+        return path
+
+    def put(self, image_hash: str, data: bytes, mime_type: str = "image/jpeg") -> str:
+        """写入图片并按容量淘汰最久未使用的条目，返回图片路径。"""
+        existing = self.get(image_hash)
+        if existing:
+            return existing
+        ext = mime_type.split("/")[1] if "/" in mime_type else "jpeg"
+        path = os.path.join(self.cache_dir, f"{image_hash}.{ext}")
+        with open(path, "wb") as f:
+            f.write(data)
+        self._entries[image_hash] = (path, len(data))
+        self._total_bytes += len(data)
+        self._evict()
+        return path
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            _, (path, size) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class FrameRecorder:
+    """
+    把收发的每一帧写入 gzip 压缩的 JSONL 抓包文件，用于离线复现性能问题。
+    每行格式：{"t": 相对开始的秒数, "ts": 时间戳, "dir": "in"/"out", "conn": 连接ID, "data": 原始帧}
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = gzip.open(path, "at", encoding="utf-8")
+        self._start = time.monotonic()
+
+    def record(self, direction: str, conn: str, data: str):
+        self._file.write(json.dumps({
+            "t": round(time.monotonic() - self._start, 6),
+            "ts": time.time(),
+            "dir": direction,
+            "conn": conn,
+            "data": data,
+        }, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+class ToolCallRunner:
+    """
+    执行 AstrBot 转发过来的本地 MCP 工具调用。
+
+    每个调用独立执行，互不等待；确定性工具（相同参数总是返回相同结果）的结果按 TTL 缓存，
+    相同参数的并发调用共享同一次执行。
+    """
+
+    def __init__(
+        self,
+        tool_manager: ToolManager,
+        tool_executor: ToolExecutor,
+        deterministic_tools: Optional[List[str]] = None,
+        cache_ttl: float = 300,
+        max_entries: int = 256,
+    ):
+        self._tool_manager = tool_manager
+        self._tool_executor = tool_executor
+        self.deterministic_tools = set(deterministic_tools or [])
+        self.cache_ttl = cache_ttl
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (过期时间, 结果)
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+
+    def tool_schemas(self) -> List[Dict[str, Any]]:
+        """返回 OpenAI function 格式的工具列表，用于向服务端注册。"""
+        return self._tool_manager.get_formatted_tools("OpenAI")
+
+    async def run(self, call_id: str, name: str, arguments: Dict[str, Any]) -> tuple:
+        """执行工具调用，返回 (is_error, content)。"""
+        if name not in self.deterministic_tools:
+            return await self._execute(call_id, name, arguments)
+
+        key = (name, json.dumps(arguments, sort_keys=True, ensure_ascii=False))
+        cached = self._cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            self._cache.move_to_end(key)
+            logger.info(f"Tool {name} served from result cache")
+            return cached[1]
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._execute(call_id, name, arguments)
+            if not result[0]:
+                self._cache[key] = (time.monotonic() + self.cache_ttl, result)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _execute(self, call_id: str, name: str, arguments: Dict[str, Any]) -> tuple:
+        is_error, text_content, _, _ = await self._tool_executor.run_single_tool(
+            name, call_id, arguments
+        )
+        return is_error, text_content
+
+
+class PendingRequest:
+    """一次 chat 请求在客户端的状态：响应帧队列、已收到的文本和图片。"""
+
+    def __init__(self, request_id: str, pictures: Optional[List[str]] = None, on_complete=None):
+        self.request_id = request_id
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.text_parts: List[str] = []
+        self.completed = False
+        # 本轮回复中收到的图片（本地缓存路径），由 Agent 取走附加到输出上
+        self.pictures = pictures if pictures is not None else []
+        # 收到 MESSAGE_END 时回调，参数为完整回复文本（此时下游可能仍在播放 TTS）
+        self.on_complete = on_complete
+        # 已发送的请求帧；服务端排空时回复 MESSAGE_RETRY，重连后重新发送
+        self.payload: Optional[str] = None
+        self.retry = False
+
+    @property
+    def text(self) -> str:
+        return "".join(self.text_parts)
+
+
+# llm_url 以此开头时，其余部分为 AstrBot 监听的 Unix 套接字路径，如 ws+unix:///run/astrbot/vtb.sock
+UNIX_SCHEME = "ws+unix://"
+
+
 class WebSocketLLMClient:
-    """WebSocket 客户端，负责与远程 LLM 服务通信（长连接模式）。"""
+    """
+    WebSocket 客户端，负责与远程 LLM 服务通信（长连接模式）。
+
+    后台读取任务按 request_id 把服务端响应分发到各自请求的队列，
+    因此同一连接上可以有多个请求同时生成（例如群聊中的多个角色）。
+    """
 
-    def __init__(self, uri: str, reconnect_interval: int = 5):
+    # 按 uri 共享的客户端实例，同一进程中的多个 AstrAgent 复用一条连接
+    _shared: Dict[str, "WebSocketLLMClient"] = {}
+
+    def __init__(
+        self,
+        uri: str,
+        reconnect_interval: int = 5,
+        image_cache: Optional[ImageCache] = None,
+        response_timeout: float = 120,
+        upload_threshold: int = 256 * 1024,
+        upload_chunk_size: int = 192 * 1024,
+        max_reconnect_attempts: int = 5,
+        recorder: Optional[FrameRecorder] = None,
+        user_id: str = "815049548",
+        user_name: str = "YakumoAki",
+        ack_frames: int = 64,
+        ack_interval: float = 1.0,
+        max_frame_size: Optional[int] = 4 * 1024 * 1024,
+    ):
         self.uri = uri
+        # 输入未携带发送者信息时使用的默认身份
+        self.user_id = user_id
+        self.user_name = user_name
         self.reconnect_interval = reconnect_interval  # 重连间隔（秒）
+        # 接收单帧的上限，与适配器的 max_frame_size 一致；适配器关闭分片时服务端的帧可能远大于 websockets 默认的 1 MiB
+        self.max_frame_size = max_frame_size
+        self.response_timeout = response_timeout  # 等待单个响应帧的超时（秒）
         self.ws = None  # WebSocket 连接对象
         self.connection_status = "disconnected"  # 连接状态
-        self.lock = asyncio.Lock()  # 用于保证线程安全
+        self.lock = asyncio.Lock()  # 用于保证建立连接时的并发安全
+        self.image_cache = image_cache or ImageCache()
+        self._requests: "OrderedDict[str, PendingRequest]" = OrderedDict()
+        self._reader_task: Optional[asyncio.Task] = None
+        self._users = 0
+        # 执行服务端转发的工具调用，启用 MCP 时由 Agent 设置
+        self.tool_runner: Optional[ToolCallRunner] = None
+        # 在 hello 帧中向服务端声明的客户端能力（图片尺寸、格式），由 Agent 设置
+        self.capabilities: Optional[Dict[str, Any]] = None
+        self._tool_tasks = set()
+        # 超过 upload_threshold 字节的图片/附件改为分块上传，避免单帧过大
+        self.upload_threshold = upload_threshold
+        self.upload_chunk_size = upload_chunk_size
+        self._upload_waiters: Dict[str, asyncio.Future] = {}
+        # 续传：服务端按 client_key 识别重连前后的同一客户端，并补发 last_seq 之后的帧
+        self.client_key = uuid.uuid4().hex
+        self._last_seq = 0
+        # 每收到 ack_frames 帧、或有未确认的帧时每隔 ack_interval 秒确认一次，
+        # 只接收服务端推送（不发请求）的客户端也能让服务端及时释放重放缓冲
+        self.ack_frames = ack_frames
+        self.ack_interval = ack_interval
+        self._acked_seq = 0
+        self._ack_task: Optional[asyncio.Task] = None
+        # 服务端把大帧拆成 fragment 分片发送，按分片 id 重组
+        self._fragments: Dict[int, List[str]] = {}
+        self._closing = False
+        self._reconnect_task: Optional[asyncio.Task] = None
+        # 服务端排空时在 reconnect 帧中建议的重连等待时间
+        self._retry_after: Optional[float] = None
+        self.max_reconnect_attempts = max_reconnect_attempts
+        # 可选的抓包记录器
+        self.recorder = recorder
+
+    @classmethod
+    def shared(cls, uri: str, **kwargs) -> "WebSocketLLMClient":
+        """获取指定 uri 的共享客户端，并增加引用计数。"""
+        client = cls._shared.get(uri)
+        if client is None:
+            client = cls._shared[uri] = cls(uri, **kwargs)
+        client._users += 1
+        return client
+
+    async def release(self):
+        """释放一次共享引用，最后一个使用者释放时关闭连接。"""
+        self._users = max(self._users - 1, 0)
+        if self._users == 0:
+            if self._shared.get(self.uri) is self:
+                del self._shared[self.uri]
+            await self.disconnect()
 
     async def connect(self):
         """建立 WebSocket 连接。"""
-        if self.connection_status == "connected":
-            logger.info("WebSocket is already connected.")
-            return
+        async with self.lock:
+            if self.connection_status == "connected":
+                logger.info("WebSocket is already connected.")
+                return
 
-        try:
-            logger.info(f"Connecting to WebSocket server at {self.uri}...")
-            self.ws = await websockets.connect(self.uri)
-            self.connection_status = "connected"
-            logger.info("WebSocket connection established successfully.")
-        except Exception as e:
-            self.connection_status = "disconnected"
-            logger.error(f"Failed to connect to WebSocket server: {e}")
-            raise
+            try:
+                logger.info(f"Connecting to WebSocket server at {self.uri}...")
+                if self.uri.startswith(UNIX_SCHEME):
+                    # 与 AstrBot 同机部署时经 Unix 套接字连接，绕过 TCP 回环，协议不变
+                    self.ws = await websockets.unix_connect(
+                        self.uri[len(UNIX_SCHEME):], uri="ws://localhost/", max_size=self.max_frame_size
+                    )
+                else:
+                    self.ws = await websockets.connect(self.uri, max_size=self.max_frame_size)
+                self._fragments.clear()
+                self._closing = False
+                self.connection_status = "connected"
+                self._reader_task = asyncio.create_task(self._read_loop(self.ws))
+                # 请求服务端补发断线期间未确认的帧，resume 同时确认了 last_seq 之前的帧
+                await self._send({
+                    "type": "resume",
+                    "client_key": self.client_key,
+                    "last_seq": self._last_seq,
+                })
+                self._acked_seq = self._last_seq
+                self._ack_task = asyncio.create_task(self._ack_loop(self.ws))
+                logger.info("WebSocket connection established successfully.")
+                if self.capabilities:
+                    await self.send_hello()
+                if self.tool_runner:
+                    await self.register_tools()
+                for request in list(self._requests.values()):
+                    if request.retry:
+                        request.retry = False
+                        await self._send_raw(request.payload)
+            except Exception as e:
+                self.connection_status = "disconnected"
+                logger.error(f"Failed to connect to WebSocket server: {e}")
+                raise
 
     async def disconnect(self):
         """关闭 WebSocket 连接。"""
         if self.ws and self.connection_status == "connected":
             try:
+                self._closing = True
+                if self._ack_task is not None:
+                    self._ack_task.cancel()
+                    self._ack_task = None
                 await self.ws.close()
+                if self.recorder:
+                    self.recorder.close()
+                    self.recorder = None
                 self.connection_status = "disconnected"
                 self.ws = None
                 logger.info("WebSocket connection closed.")
@@ -136,80 +456,526 @@ class WebSocketLLMClient:
         if self.connection_status != "connected":
             await self.connect()
 
+    async def _read_loop(self, ws):
+        """后台读取服务端消息，按 request_id 分发到对应请求。"""
+        error: Exception = websockets.exceptions.ConnectionClosedOK(None, None)
+        try:
+            async for msg in ws:
+                if self.recorder:
+                    self.recorder.record("in", self.client_key, msg)
+                try:
+                    await self._dispatch(json.loads(msg))
+                except json.JSONDecodeError:
+                    logger.error(f"Invalid JSON message: {msg}")
+                except Exception as e:
+                    logger.error(f"Failed to process message: {msg}, error={e}")
+        except websockets.exceptions.WebSocketException as e:
+            error = e
+        finally:
+            if self.ws is ws:
+                self.connection_status = "disconnected"
+                self.ws = None
+                if self._ack_task is not None:
+                    self._ack_task.cancel()
+                    self._ack_task = None
+            if self._closing:
+                self._fail_requests(error)
+            elif self._reconnect_task is None or self._reconnect_task.done():
+                # 非主动断开：后台重连并续传，等待中的请求继续等待补发的帧
+                self._reconnect_task = asyncio.create_task(self._reconnect(error))
 
-    async def chat_completion(
-        self, input_data: BaseInput, system: str = "", session_id: str = "default_session"
-    ) -> AsyncIterator[BaseOutput]:
-        async with self.lock:
+    async def _reconnect(self, error: Exception):
+        for attempt in range(1, self.max_reconnect_attempts + 1):
+            delay = self.reconnect_interval
+            if self._retry_after is not None:
+                delay, self._retry_after = self._retry_after, None
+            logger.info(f"Connection lost, reconnecting in {delay} seconds (attempt {attempt})...")
+            await asyncio.sleep(delay)
+            if self._closing:
+                break
             try:
-                await self.ensure_connection()
+                await self.connect()
+                return
+            except Exception as e:
+                error = e
+        self._fail_requests(error)
 
-                # 准备并发送请求
-                payload = {
-                    "bot_id":"open_llm_vtuber_bot",
-                    "session_id": session_id,
-                    "channel_type":"FRIEND",
-                    "userid":"815049548",
-                    "username":"YakumoAki",
-                    "messages":  batch_input_to_dict(input_data),
-                }
-                payload_str = json.dumps(payload, ensure_ascii=False)
-                logger.info(f"Sending message to server: {payload_str}")
-                await self.ws.send(payload_str)
-
-                logger.info("Waiting for response from server...")
-                message_count = 0
-                max_messages = 10  # 设置最大消息数限制
-
-                async for msg in self.ws:
-                    message_count += 1
-                    logger.info(f"Received message {message_count} from server")
-                    
-                    try:
-                        data = json.loads(msg)
-                        logger.info(f"Message content: {data}")
-                        if data.get("type") == "MESSAGE_COMMIT":
-                            logger.info("MESSAGE_COMMIT to server queue, writing response")
-
-                        # 检查是否为结束消息
-                        elif data.get("type") == "MESSAGE_END":
-                            logger.info("Received end message, stopping")
-                            break
-                        elif data.get("type") == "text":
-                            yield data['content']
-                        elif data.get("type") == "message":
-                            output = data['file']
-                            
-                            logger.info(f"get image message: {output}")
-                        else:
-                            logger.info(f"get unknow message: {data}")
-                    except json.JSONDecodeError:
-                        logger.error(f"Invalid JSON message: {msg}")
-                    except Exception as e:
-                        logger.error(f"Failed to process message: {msg}, error={e}")
+    def _fail_requests(self, error: Exception):
+        """连接无法恢复时通知所有等待中的请求"""
+        for request in self._requests.values():
+            request.queue.put_nowait(error)
+
+    def _request_for(self, data: dict) -> Optional[PendingRequest]:
+        """查找响应帧所属的请求；旧版服务端不回传 request_id 时归给最早的请求。"""
+        request_id = data.get("request_id")
+        if request_id is not None:
+            return self._requests.get(request_id)
+        return next(iter(self._requests.values()), None)
+
+    async def _dispatch(self, data: dict):
+        msg_type = data.get("type")
+        if msg_type == "fragment":
+            parts = self._fragments.setdefault(data["id"], [])
+            parts.append(data["data"])
+            if len(parts) == data["count"]:
+                del self._fragments[data["id"]]
+                await self._dispatch(json.loads("".join(parts)))
+            return
+        if msg_type == "resume_ok":
+            # resume_ok 的 seq 是服务端当前序号而非帧序号，不参与去重
+            if data["seq"] - data.get("replayed", 0) < self._last_seq:
+                # 服务端已丢失之前的投递状态（例如重启），从服务端当前的序号重新开始
+                self._last_seq = data["seq"] - data.get("replayed", 0)
+                self._acked_seq = min(self._acked_seq, self._last_seq)
+            if data.get("gap"):
+                logger.warning("Server replay buffer overflowed, some frames were lost during reconnect")
+            logger.info(f"Session resumed, {data.get('replayed', 0)} frames replayed")
+            return
+        seq = data.get("seq")
+        if seq is not None:
+            # 续传补发可能与已收到的帧重叠，按序号去重
+            if seq <= self._last_seq:
+                return
+            self._last_seq = seq
+            if seq - self._acked_seq >= self.ack_frames:
+                await self._ack()
+        request = self._request_for(data)
+
+        # 图片握手在读取任务中立即回复，不受下游 TTS 消费速度影响
+        if msg_type == "image_offer":
+            path = await self._answer_image_offer(data)
+            if path and request:
+                request.pictures.append(path)
+            return
+        if msg_type == "image":
+            path = self._store_image(data)
+            if request:
+                request.pictures.append(path)
+            return
+        if msg_type == "MESSAGE_COMMIT":
+            logger.info("MESSAGE_COMMIT to server queue, writing response")
+            return
+        if msg_type == "MESSAGE_RETRY":
+            # 服务端正在排空，未处理该请求
+            if request:
+                request.retry = True
+            return
+        if msg_type == "reconnect":
+            # 服务端即将关闭连接；排空超时未完成的请求无法续传，直接报错
+            self._retry_after = data.get("retry_after")
+            for request_id in data.get("abandoned", []):
+                abandoned = self._requests.pop(request_id, None)
+                if abandoned is not None:
+                    abandoned.queue.put_nowait(ConnectionError("Server restarted before the reply finished"))
+            logger.info("Server is draining, will reconnect")
+            return
+        if msg_type in ("upload_ack", "upload_done"):
+            waiter = self._upload_waiters.get(data.get("upload_id"))
+            if waiter is not None and not waiter.done():
+                waiter.set_result(data)
+            return
+        if msg_type == "tool_calls":
+            # 每个调用单独起任务，完成一个就回传一个结果
+            for call in data.get("calls", []):
+                task = asyncio.create_task(self._run_tool_call(call))
+                self._tool_tasks.add(task)
+                task.add_done_callback(self._tool_tasks.discard)
+            return
+
+        if request is None:
+            logger.info(f"Dropping message for unknown request: {data}")
+            return
+        if msg_type == "text":
+            request.text_parts.append(data["content"])
+        elif msg_type == "message":
+            for item in data.get("message_chain", []):
+                if item.get("type") == "plain":
+                    request.text_parts.append(item.get("text", ""))
+        request.queue.put_nowait(data)
+        if msg_type == "MESSAGE_END" and (data.get("merged_into") or data.get("dropped")):
+            # 服务端把本条消息合并进了其它请求，或在弹幕高峰中未被选中，本请求没有回复
+            logger.info(
+                f"Request {request.request_id} "
+                + (f"merged into {data['merged_into']}" if data.get("merged_into") else "dropped by server batching")
+            )
+        if msg_type == "MESSAGE_END":
+            self._requests.pop(request.request_id, None)
+            request.completed = True
+            if request.on_complete:
+                request.on_complete(request.text)
+            # 确认已收到的帧，服务端据此释放重放缓冲
+            await self._ack()
+
+    async def _ack(self):
+        """确认 last_seq 及之前的帧。"""
+        if self._last_seq > self._acked_seq and self.ws is not None:
+            self._acked_seq = self._last_seq
+            await self._send({"type": "ack", "seq": self._last_seq})
+
+    async def _ack_loop(self, ws):
+        """连接存续期间定时确认，两次确认之间收到的帧不足 ack_frames 时也不会一直占用服务端缓冲。"""
+        while self.ws is ws:
+            await asyncio.sleep(self.ack_interval)
+            try:
+                await self._ack()
+            except websockets.exceptions.ConnectionClosed:
+                return
+
+    async def _send(self, frame: dict):
+        """序列化并发送一帧。"""
+        await self._send_raw(json.dumps(frame, ensure_ascii=False))
+
+    async def _send_raw(self, text: str):
+        if self.recorder:
+            self.recorder.record("out", self.client_key, text)
+        await self.ws.send(text)
+
+    async def send_hello(self):
+        """向服务端声明客户端能力，服务端据此缩放、转码发来的图片。"""
+        await self._send({"type": "hello", "capabilities": self.capabilities})
+        logger.info(f"Declared client capabilities: {self.capabilities}")
 
-                    # 防止无限接收
-                    if message_count >= max_messages:
-                        logger.warning(f"Reached max message limit ({max_messages}), stopping")
-                        break
+    async def register_tools(self):
+        """向服务端上报本地可用的 MCP 工具。"""
+        tools = self.tool_runner.tool_schemas()
+        await self._send({"type": "tools_register", "tools": tools})
+        logger.info(f"Registered {len(tools)} MCP tools with server")
 
+    async def _run_tool_call(self, call: dict):
+        """执行单个工具调用并把结果发回服务端。"""
+        call_id = call["call_id"]
+        if self.tool_runner is None:
+            is_error, content = True, "MCP is not enabled on this client"
+        else:
+            try:
+                is_error, content = await self.tool_runner.run(
+                    call_id, call["name"], call.get("arguments") or {}
+                )
+            except Exception as e:
+                logger.error(f"Tool {call['name']} failed: {e}")
+                is_error, content = True, str(e)
+        try:
+            await self._send({
+                "type": "tool_result",
+                "call_id": call_id,
+                "is_error": is_error,
+                "content": content,
+            })
+        except Exception as e:
+            logger.error(f"Failed to send tool result for {call_id}: {e}")
+
+    async def _upload_request(self, frame: dict) -> dict:
+        """发送 upload_begin/upload_end 并等待服务端回复。"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._upload_waiters[frame["upload_id"]] = waiter
+        try:
+            await self._send(frame)
+            return await asyncio.wait_for(waiter, self.response_timeout)
+        finally:
+            self._upload_waiters.pop(frame["upload_id"], None)
+
+    async def upload(self, data: bytes, name: str, mime_type: str, max_attempts: int = 3) -> str:
+        """
+        分块上传文件，返回 upload_id（文件内容的 sha256）。
+        连接断开或服务端报告文件不完整时，从服务端已接收的位置继续上传。
+        """
+        upload_id = hashlib.sha256(data).hexdigest()
+        for attempt in range(1, max_attempts + 1):
+            try:
+                await self.ensure_connection()
+                ack = await self._upload_request({
+                    "type": "upload_begin",
+                    "upload_id": upload_id,
+                    "name": name,
+                    "mime_type": mime_type,
+                    "size": len(data),
+                    "chunk_size": self.upload_chunk_size,
+                })
+                if ack.get("error"):
+                    raise ValueError(ack["error"])
+                offset = ack["received"]
+                while offset < len(data):
+                    chunk = data[offset:offset + self.upload_chunk_size]
+                    await self._send({
+                        "type": "upload_chunk",
+                        "upload_id": upload_id,
+                        "index": offset // self.upload_chunk_size,
+                        "offset": offset,
+                        "sha256": hashlib.sha256(chunk).hexdigest(),
+                        "data": base64.b64encode(chunk).decode("ascii"),
+                    })
+                    offset += len(chunk)
+                result = await self._upload_request({"type": "upload_end", "upload_id": upload_id})
+                if result.get("type") == "upload_done":
+                    logger.info(f"Uploaded {name} ({len(data)} bytes) as {upload_id[:12]}")
+                    return upload_id
+                logger.warning(f"Upload {name} incomplete ({result.get('error')}), resuming")
             except websockets.exceptions.WebSocketException as e:
-                logger.error(f"WebSocket connection error: {e}")
-                self.connection_status = "disconnected"
-                # 尝试重连
-                logger.info(f"Trying to reconnect in {self.reconnect_interval} seconds...")
+                logger.warning(f"Upload {name} interrupted (attempt {attempt}): {e}")
                 await asyncio.sleep(self.reconnect_interval)
-                try:
-                    await self.connect()
-                    logger.info("Reconnected successfully.")
-                except Exception as re_e:
-                    logger.error(f"Failed to reconnect: {re_e}")
-                raise
-            except Exception as e:
-                logger.error(f"Unexpected error in chat_completion: {e}")
-                raise
-        
+        raise RuntimeError(f"Failed to upload {name} after {max_attempts} attempts")
 
+    async def _prepare_messages(self, input_data: BaseInput) -> dict:
+        """把输入转换为 dict，过大的图片和附件先分块上传，消息中只携带 upload_id。"""
+        messages = batch_input_to_dict(input_data)
+        for kind in ("images", "files"):
+            for index, item in enumerate(messages[kind]):
+                encoded = item.get("data") or ""
+                if len(encoded) <= self.upload_threshold:
+                    continue
+                if encoded.startswith("data:"):
+                    encoded = encoded.split(",", 1)[1]
+                name = item.get("name") or f"{kind[:-1]}_{index}"
+                item["upload_id"] = await self.upload(
+                    base64.b64decode(encoded), name, item.get("mime_type") or "application/octet-stream"
+                )
+                del item["data"]
+        return messages
+
+    async def open_session(
+        self, session_id: str, persona_id: Optional[str] = None, response_cache: bool = True
+    ):
+        """通知服务端预热会话上下文（对话、人格、模型提供商）。"""
+        await self.ensure_connection()
+        frame = {"type": "session_open", "session_id": session_id}
+        if persona_id:
+            frame["persona_id"] = persona_id
+        if not response_cache:
+            # 本会话不使用服务端的重复提问回复缓存
+            frame["response_cache"] = False
+        await self._send(frame)
+        logger.info(f"Requested session preload for {session_id}")
+
+    async def close_session(self, session_id: str):
+        """通知服务端释放会话上下文。"""
+        if self.connection_status != "connected":
+            return
+        try:
+            await self._send({"type": "session_close", "session_id": session_id})
+            logger.info(f"Released session {session_id}")
+        except Exception as e:
+            logger.warning(f"Failed to release session {session_id}: {e}")
+
+    async def _answer_image_offer(self, data: dict) -> Optional[str]:
+        """根据本地缓存回复服务端的图片握手，命中时返回缓存路径。"""
+        path = self.image_cache.get(data["hash"])
+        reply = "image_have" if path else "image_need"
+        await self._send({"type": reply, "hash": data["hash"]})
+        if path:
+            logger.info(f"Image {data['hash'][:12]} served from local cache")
+        return path
+
+    def _store_image(self, data: dict) -> str:
+        """解码服务端发送的 base64 图片并写入本地缓存，返回缓存路径。"""
+        header, encoded = data["data_url"].split(",", 1)
+        mime_type = header[len("data:"):].split(";", 1)[0]
+        image_data = base64.b64decode(encoded)
+        image_hash = data.get("hash") or hashlib.sha256(image_data).hexdigest()
+        return self.image_cache.put(image_hash, image_data, mime_type)
+
+    async def send_request(
+        self,
+        input_data: BaseInput,
+        session_id: str = "default_session",
+        pictures: Optional[List[str]] = None,
+        on_complete=None,
+        stream: Optional[bool] = None,
+        speculative: bool = False,
+    ) -> PendingRequest:
+        """
+        发送 chat 请求并返回其状态对象，响应由 iter_response 读取。
+        stream 不为 None 时要求 AstrBot 对本请求开启/关闭流式回复。
+        speculative 为 True 时（群聊预取）服务端在 commit_speculative 之前不把这一轮写入对话历史。
+        """
+        messages = await self._prepare_messages(input_data)
+        await self.ensure_connection()
+        request = PendingRequest(uuid.uuid4().hex, pictures, on_complete)
+        self._requests[request.request_id] = request
+
+        # 准备并发送请求
+        user_id, user_name = sender_identity(input_data, self.user_id, self.user_name)
+        payload = {
+            "bot_id":"open_llm_vtuber_bot",
+            "request_id": request.request_id,
+            "session_id": session_id,
+            "channel_type":"FRIEND",
+            "userid": user_id,
+            "username": user_name,
+            "messages": messages,
+        }
+        # 弹幕合并时优先保留的消息（如醒目留言），由输入的 metadata 给出
+        priority = (getattr(input_data, "metadata", None) or {}).get("priority")
+        if priority:
+            payload["priority"] = priority
+        if stream is not None:
+            payload["stream"] = stream
+        if speculative:
+            payload["speculative"] = True
+        payload_str = request.payload = json.dumps(payload, ensure_ascii=False)
+        logger.info(f"Sending message to server: {payload_str}")
+        try:
+            await self._send_raw(payload_str)
+        except Exception:
+            self._requests.pop(request.request_id, None)
+            raise
+        return request
+
+    async def commit_speculative(self, request: PendingRequest):
+        """采用预取请求的回复，服务端在回复完整后将这一轮写入对话历史。"""
+        await self._send({"type": "speculative_commit", "request_id": request.request_id})
+
+    def discard(self, request: PendingRequest):
+        """放弃一个请求，之后收到的响应帧将被丢弃。"""
+        self._requests.pop(request.request_id, None)
+
+    async def iter_response(self, request: PendingRequest) -> AsyncIterator[str]:
+        """按顺序读取请求的响应文本，直到 MESSAGE_END。"""
+        logger.info("Waiting for response from server...")
+        data = None
+        try:
+            while True:
+                if data is None:
+                    data = await asyncio.wait_for(request.queue.get(), self.response_timeout)
+                if isinstance(data, Exception):
+                    raise data
+                logger.debug(f"Message content: {data}")
+                msg_type = data.get("type")
+                # 检查是否为结束消息
+                if msg_type == "MESSAGE_END":
+                    logger.info("Received end message, stopping")
+                    break
+                elif msg_type == "text":
+                    # 流式回复的增量在下游（分句、TTS）处理期间可能积压，合并已到达的连续增量一次产出
+                    parts = [data["content"]]
+                    data = None
+                    while not request.queue.empty():
+                        following = request.queue.get_nowait()
+                        if isinstance(following, dict) and following.get("type") == "text":
+                            parts.append(following["content"])
+                        else:
+                            data = following
+                            break
+                    text = "".join(parts)
+                    if text:
+                        yield text
+                    continue
+                elif msg_type == "message":
+                    for item in data.get("message_chain", []):
+                        if item.get("type") == "plain":
+                            yield item.get("text", "")
+                        elif item.get("type") == "image":
+                            path = self.image_cache.get(item.get("hash", ""))
+                            if path:
+                                request.pictures.append(path)
+                            else:
+                                logger.info(f"get uncached image message: {item}")
+                else:
+                    logger.info(f"get unknow message: {data}")
+                data = None
+        finally:
+            self.discard(request)
+
+    async def chat_completion(
+        self,
+        input_data: BaseInput,
+        system: str = "",
+        session_id: str = "default_session",
+        pictures: Optional[List[str]] = None,
+        on_complete=None,
+        request: Optional[PendingRequest] = None,
+        stream: Optional[bool] = None,
+    ) -> AsyncIterator[str]:
+        """发送请求（或沿用已发出的 request）并流式返回回复文本。"""
+        try:
+            if request is None:
+                request = await self.send_request(input_data, session_id, pictures, on_complete, stream)
+            async for text in self.iter_response(request):
+                yield text
+        except websockets.exceptions.WebSocketException as e:
+            await self._handle_connection_error(e)
+            raise
+        except Exception as e:
+            logger.error(f"Unexpected error in chat_completion: {e}")
+            raise
+
+    async def _handle_connection_error(self, e: Exception):
+        logger.error(f"WebSocket connection error: {e}")
+        self.connection_status = "disconnected"
+        # 尝试重连
+        logger.info(f"Trying to reconnect in {self.reconnect_interval} seconds...")
+        await asyncio.sleep(self.reconnect_interval)
+        try:
+            await self.connect()
+            logger.info("Reconnected successfully.")
+        except Exception as re_e:
+            logger.error(f"Failed to reconnect: {re_e}")
+
+
+class GroupCoordinator:
+    """
+    协调同一个群聊中共用一条连接的多个 AstrAgent 参与者。
+
+    Open-LLM-VTuber 按加入顺序轮流发言，每位发言者的输入是其上次发言之后群里的全部消息。
+    当前发言者的回复生成完成（收到 MESSAGE_END）时，其 TTS 往往还在播放，此时即用下一位
+    发言者届时会收到的输入（其上次发言后其他角色的发言）向服务端发出请求，下一位被调用 chat
+    时输入与之完全一致（期间没有人类插话）才采用已在生成的回复，缩短轮次间隔。
+    协调器按 (llm_url, 人类名称, 参与者) 区分群聊，最后一位成员离开时移除。
+    """
+
+    _instances: Dict[tuple, "GroupCoordinator"] = {}
+
+    def __init__(self, key: tuple, human_name: str):
+        self.key = key
+        self.human_name = human_name
+        self.members: List["AstrAgent"] = []
+        # 成员 -> 其上次发言后其他成员的发言 [(发言者, 文本)]
+        self._pending: Dict["AstrAgent", List[tuple]] = {}
+
+    @classmethod
+    def for_group(cls, uri: str, human_name: str, participants: List[str]) -> "GroupCoordinator":
+        key = (uri, human_name, frozenset(participants))
+        if key not in cls._instances:
+            cls._instances[key] = cls(key, human_name)
+        return cls._instances[key]
+
+    def join(self, agent: "AstrAgent"):
+        if agent not in self.members:
+            self.members.append(agent)
+            self._pending[agent] = []
+
+    def leave(self, agent: "AstrAgent"):
+        if agent in self.members:
+            self.members.remove(agent)
+            del self._pending[agent]
+        if not self.members and self._instances.get(self.key) is self:
+            del self._instances[self.key]
+
+    def pending_input(self, agent: "AstrAgent") -> str:
+        """该成员下一轮将收到的其他角色发言，格式与 Open-LLM-VTuber 的群聊输入一致。"""
+        return "\n".join(f"{name}: {text}" for name, text in self._pending.get(agent, []))
+
+    def pending_speakers(self, agent: "AstrAgent") -> List[str]:
+        return [name for name, _ in self._pending.get(agent, [])]
+
+    def on_turn_started(self, agent: "AstrAgent"):
+        """成员开始发言，其输入已包含之前的全部发言。"""
+        if agent in self._pending:
+            self._pending[agent] = []
+
+    def next_after(self, agent: "AstrAgent") -> Optional["AstrAgent"]:
+        """按轮询顺序返回下一位发言者。"""
+        if len(self.members) < 2 or agent not in self.members:
+            return None
+        return self.members[(self.members.index(agent) + 1) % len(self.members)]
+
+    def on_turn_generated(self, agent: "AstrAgent", text: str):
+        """当前发言者回复生成完毕，为下一位发言者预先发出请求。"""
+        for member in self.members:
+            if member is not agent:
+                self._pending[member].append((agent.speaker_name, text))
+        speaker = self.next_after(agent)
+        if speaker is not None:
+            speaker.prefetch_turn(self.pending_input(speaker), self.human_name)
 
 
 class AstrAgent(AgentInterface):
@@ -230,6 +996,19 @@ class AstrAgent(AgentInterface):
         tool_executor: Optional[ToolExecutor] = None,
         mcp_prompt_string: str = "",
         reconnect_interval: int = 5,
+        image_cache_dir: str = "cache/astr_images",
+        image_cache_max_bytes: int = 256 * 1024 * 1024,
+        persona_id: Optional[str] = None,
+        character_name: Optional[str] = None,
+        deterministic_tools: Optional[List[str]] = None,
+        tool_cache_ttl: float = 300,
+        capture_path: str = "",
+        response_cache: bool = True,
+        streaming: Optional[bool] = True,
+        image_max_width: int = 1024,
+        image_max_height: int = 1024,
+        image_formats: Optional[List[str]] = None,
+        max_frame_size: Optional[int] = 4 * 1024 * 1024,
     ):
         """初始化 Agent 与 LLM 配置。"""
         super().__init__()
@@ -246,9 +1025,43 @@ class AstrAgent(AgentInterface):
         self._tool_executor = tool_executor
         self._mcp_prompt_string = mcp_prompt_string
         self._reconnect_interval = reconnect_interval
+        self._background_tasks = set()
+        # AstrBot 中使用的人格，群聊时每个角色对应各自的人格
+        self._persona_id = persona_id
+        # 群聊中本角色的名字，需与 Open-LLM-VTuber 群聊输入中使用的角色名一致
+        self._character_name = character_name
+        # 是否允许服务端对本角色的会话使用重复提问回复缓存
+        self._response_cache = response_cache
+        # 要求 AstrBot 流式回复，首个分句到达即可开始合成语音；None 时沿用 AstrBot 的设置
+        self._streaming = streaming
+        self._pending_pictures: List[str] = []
+        # 前端展示图片的最大尺寸与支持的格式，服务端按此缩放、转码后再发送
+        self._capabilities = {
+            "image": {
+                "max_width": image_max_width,
+                "max_height": image_max_height,
+                "formats": image_formats or ["webp", "png", "jpeg", "gif"],
+            }
+        }
+
+        # 群聊协调器，以及为本角色预先发出的请求 (依据的上一轮文本, 请求任务)
+        self._group: Optional[GroupCoordinator] = None
+        self._prefetch = None
 
-        # 设置 LLM 客户端
-        self._llm = WebSocketLLMClient(uri=llm_url, reconnect_interval=reconnect_interval)
+        # 设置 LLM 客户端，同一 llm_url 的多个 Agent 共用一条连接
+        self._llm = WebSocketLLMClient.shared(
+            llm_url,
+            reconnect_interval=reconnect_interval,
+            image_cache=ImageCache(image_cache_dir, image_cache_max_bytes),
+            max_frame_size=max_frame_size,
+        )
+        if capture_path and self._llm.recorder is None:
+            self._llm.recorder = FrameRecorder(capture_path)
+        self._tool_runner = None
+        if use_mcpp and tool_manager and tool_executor:
+            self._tool_runner = ToolCallRunner(
+                tool_manager, tool_executor, deterministic_tools, tool_cache_ttl
+            )
         
         # self._system_prompt = system
         self._system_prompt = ''
@@ -258,11 +1071,22 @@ class AstrAgent(AgentInterface):
     async def start(self):
         """启动 Agent，建立 WebSocket 连接。"""
         await self._llm.connect()
+        # 在连接建立后才设置，之后重连时由 connect 自动重新声明
+        self._llm.capabilities = self._capabilities
+        await self._llm.send_hello()
+        if self._tool_runner:
+            # 在连接建立后才设置，避免 connect 中重复注册；之后重连时由 connect 自动重新注册
+            self._llm.tool_runner = self._tool_runner
+            await self._llm.register_tools()
         logger.info("AstrAgent started and WebSocket connection established.")
 
     async def stop(self):
         """停止 Agent，关闭 WebSocket 连接。"""
-        await self._llm.disconnect()
+        self.end_group_conversation()
+        history_uid = getattr(self, "_history_uid", None)
+        if history_uid:
+            await self._llm.close_session(history_uid)
+        await self._llm.release()
         logger.info("AstrAgent stopped and WebSocket connection closed.")
 
     async def chat(self, input_data: BaseInput) -> AsyncIterator[BaseOutput]:
@@ -276,12 +1100,22 @@ class AstrAgent(AgentInterface):
             AsyncIterator[BaseOutput] - Agent 输出流
         """
         self.reset_interrupt()
+        self._pending_pictures = []
 
         try:
             # 创建带装饰器的聊天函数
             chat_func = self._create_chat_function()
             async for output in chat_func(input_data):
-                yield output
+                yield self._attach_pictures(output)
+            # 只有图片没有文字的回复，单独输出一次
+            if self._pending_pictures:
+                yield self._attach_pictures(
+                    SentenceOutput(
+                        display_text=DisplayText(text="", name="AI"),
+                        tts_text="",
+                        actions=Actions(),
+                    )
+                )
         except Exception as e:
             logger.error(f"Chat error: {e}")
             # 创建错误响应
@@ -292,6 +1126,13 @@ class AstrAgent(AgentInterface):
             )
             yield error_output
 
+    def _attach_pictures(self, output: BaseOutput) -> BaseOutput:
+        """把服务端发送的图片附加到输出的 actions.pictures 上。"""
+        if self._pending_pictures and getattr(output, "actions", None) is not None:
+            output.actions.pictures = (output.actions.pictures or []) + self._pending_pictures
+            self._pending_pictures.clear()
+        return output
+
     def handle_interrupt(self, heard_response: str) -> None:
         """
         处理用户中断。
@@ -301,6 +1142,7 @@ class AstrAgent(AgentInterface):
         """
         logger.warning(f"Agent: Interrupted after response={heard_response}")
         self._interrupt_handled = True
+        self._drop_prefetch()
 
     def set_memory_from_history(self, conf_uid: str, history_uid: str) -> None:
         """
@@ -313,9 +1155,32 @@ class AstrAgent(AgentInterface):
         logger.info(
             f"AstrAgent: set_memory_from_history called with conf_uid={conf_uid}, history_uid={history_uid}"
         )
+        previous_uid = getattr(self, "_history_uid", None)
         # 存储 history_uid 供后续使用
         self._history_uid = history_uid
-        # AstrAgent 暂不支持记忆功能
+        # 记忆由 AstrBot 按 session_id 维护，这里提前让服务端预热该会话，缩短首条回复耗时
+        if previous_uid != history_uid:
+            self._run_in_background(self._switch_session(previous_uid, history_uid))
+
+    async def _switch_session(self, previous_uid: Optional[str], history_uid: str):
+        """释放上一个会话并预热新会话。"""
+        try:
+            if previous_uid:
+                await self._llm.close_session(previous_uid)
+            await self._llm.open_session(history_uid, self._persona_id, self._response_cache)
+        except Exception as e:
+            logger.warning(f"Failed to preload session {history_uid}: {e}")
+
+    def _run_in_background(self, coro) -> None:
+        """在当前事件循环中调度协程；没有运行中的事件循环时直接丢弃。"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            coro.close()
+            return
+        task = loop.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
 
     def reset_interrupt(self) -> None:
         """重置中断标志。"""
@@ -336,7 +1201,17 @@ class AstrAgent(AgentInterface):
             # 通过 WebSocket 发送请求并接收响应
             # 使用存储的 history_uid 作为 session_id
             session_id = getattr(self, '_history_uid', 'default_session')
-            async for output in self._llm.chat_completion(input_data, self._system_prompt, session_id):
+            self._check_group(input_data)
+            request = await self._take_prefetch(input_data)
+            async for output in self._llm.chat_completion(
+                input_data,
+                self._system_prompt,
+                session_id,
+                pictures=self._pending_pictures,
+                on_complete=self._on_turn_generated if self._group else None,
+                request=request,
+                stream=self._streaming,
+            ):
                 if self._interrupt_handled:
                     logger.info("Chat interrupted by user.")
                     break
@@ -344,15 +1219,121 @@ class AstrAgent(AgentInterface):
 
         return chat_function
 
+    @property
+    def speaker_name(self) -> str:
+        """群聊中本角色的名字。"""
+        return self._character_name or self._persona_id or "AI"
+
     def start_group_conversation(
         self, human_name: str, ai_participants: List[str]
     ) -> None:
         """
         开始群聊。
 
+        多个角色共用同一条连接，各自的回复可以同时生成：
+        当前角色生成完毕后即为下一位角色发出请求，与当前角色的 TTS 播放并行。
+
         Args:
             human_name: str - 人类名称
             ai_participants: List[str] - AI 参与者列表
         """
         logger.info(f"Starting group conversation with {human_name} and {ai_participants}")
-        # 暂不实现群聊功能
+        self.end_group_conversation()
+        self._group = GroupCoordinator.for_group(
+            self._llm.uri, human_name, list(ai_participants) + [self.speaker_name]
+        )
+        self._group.join(self)
+        # 群聊开始时为本角色预热会话与人格
+        history_uid = getattr(self, "_history_uid", None)
+        if history_uid:
+            self._run_in_background(
+                self._llm.open_session(history_uid, self._persona_id, self._response_cache)
+            )
+
+    def end_group_conversation(self) -> None:
+        """退出群聊：离开协调器并丢弃预取，之后的回复不再为其他角色预取。"""
+        if self._group:
+            self._group.leave(self)
+            self._group = None
+        self._drop_prefetch()
+
+    def _check_group(self, input_data: BaseInput) -> None:
+        """
+        群聊的输入包含其他角色的发言（"名字: 内容"）；其他角色发言后本角色收到的输入中
+        没有任何一位的发言时，说明群聊已结束、回到单人对话，退出群聊。
+        """
+        if not self._group:
+            return
+        content = _normalize_turn_text(_input_text(input_data))
+        speakers = self._group.pending_speakers(self)
+        if speakers and not any(_normalize_turn_text(f"{name}:") in content for name in speakers):
+            logger.info(f"{self.speaker_name} left the group conversation")
+            self.end_group_conversation()
+            return
+        self._group.on_turn_started(self)
+
+    def _on_turn_generated(self, text: str) -> None:
+        if self._group:
+            self._group.on_turn_generated(self, text)
+
+    def prefetch_turn(self, context: str, human_name: str) -> None:
+        """用本角色下一轮将收到的输入（其上次发言后其他角色的发言），预先为本角色发出请求。"""
+        self._drop_prefetch()
+        # 只有表情标签等内容的输入无法与实际输入区分，不预取
+        if not _normalize_turn_text(context):
+            return
+        input_data = BatchInput(
+            texts=[TextData(source=TextSource.INPUT, content=context, from_name=human_name)]
+        )
+        session_id = getattr(self, "_history_uid", "default_session")
+        # 预取的回复被采用之前不再继续为后面的角色预取，避免无人消费时连锁生成
+        task = asyncio.ensure_future(
+            self._llm.send_request(input_data, session_id, stream=self._streaming, speculative=True)
+        )
+        self._prefetch = (context, task)
+        logger.info(f"Prefetching group turn for {self.speaker_name}")
+
+    def _drop_prefetch(self) -> None:
+        """丢弃尚未使用的预取请求。"""
+        prefetch, self._prefetch = self._prefetch, None
+        if prefetch is None:
+            return
+        task = prefetch[1]
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled() and task.exception() is None:
+            self._llm.discard(task.result())
+
+    async def _take_prefetch(self, input_data: BaseInput) -> Optional[PendingRequest]:
+        """
+        如果本轮输入与预取时使用的输入完全一致（期间没有人类插话），返回预取的请求；
+        否则丢弃预取，返回 None 走正常请求。
+        """
+        if self._prefetch is None:
+            return None
+        basis, task = self._prefetch
+        if _normalize_turn_text(_input_text(input_data)) != _normalize_turn_text(basis):
+            logger.info("Input diverged from prefetched group turn, discarding prefetch")
+            self._drop_prefetch()
+            return None
+        self._prefetch = None
+        try:
+            request = await task
+        except Exception as e:
+            logger.warning(f"Prefetched request failed: {e}")
+            return None
+        try:
+            await self._llm.commit_speculative(request)
+        except Exception as e:
+            # 未确认的预取回复不会写入服务端历史，改走正常请求
+            logger.warning(f"Failed to commit prefetched turn: {e}")
+            self._llm.discard(request)
+            return None
+        self._pending_pictures.extend(request.pictures)
+        request.pictures = self._pending_pictures
+        if request.completed:
+            self._on_turn_generated(request.text)
+        else:
+            request.on_complete = self._on_turn_generated
+        logger.info(f"Using prefetched group turn for {self.speaker_name}")
+        return request
@@ -0,0 +1,144 @@
+"""
+在没有安装 AstrBot 的环境中运行回放和基准测试时，提供 vtb_adapter 用到的最小 astrbot 接口。
+已安装 AstrBot 时 install() 不做任何事。
+"""
+import enum
+import logging
+import os
+import sys
+import types
+
+# 插件根目录，保证可以直接 import vtb_adapter
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _module(name: str, **attrs) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+class MessageType(enum.Enum):
+    FRIEND_MESSAGE = 'FriendMessage'
+    GROUP_MESSAGE = 'GroupMessage'
+
+
+class AstrBotMessage:
+    pass
+
+
+class MessageMember:
+    def __init__(self, user_id: str, nickname: str = None):
+        self.user_id = user_id
+        self.nickname = nickname
+
+
+class PlatformMetadata:
+    def __init__(self, name: str, description: str, id: str = None):
+        self.name = name
+        self.description = description
+        self.id = id
+
+
+class Platform:
+    def __init__(self, event_queue):
+        self._event_queue = event_queue
+
+    def commit_event(self, event):
+        self._event_queue.put_nowait(event)
+
+    async def send_by_session(self, session, message_chain):
+        pass
+
+
+class MessageChain:
+    def __init__(self, chain: list = None):
+        self.chain = chain or []
+
+
+class AstrMessageEvent:
+    def __init__(self, message_str, message_obj, platform_meta, session_id):
+        self.message_str = message_str
+        self.message_obj = message_obj
+        self.platform_meta = platform_meta
+        self.session_id = session_id
+
+    async def send(self, message):
+        pass
+
+    async def send_streaming(self, generator, use_fallback: bool = False):
+        pass
+
+    def set_extra(self, key, value):
+        self.__dict__.setdefault('_extras', {})[key] = value
+
+    def get_extra(self, key=None):
+        extras = self.__dict__.get('_extras', {})
+        return extras if key is None else extras.get(key)
+
+
+class MessageSesion:
+    def __init__(self, platform_name, message_type, session_id):
+        self.platform_name = platform_name
+        self.message_type = message_type
+        self.session_id = session_id
+
+    def __str__(self):
+        return f'{self.platform_name}:{self.message_type.value}:{self.session_id}'
+
+
+class Plain:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class Image:
+    def __init__(self, file: str):
+        self.file = file
+
+
+class Record:
+    def __init__(self, file: str = None):
+        self.file = file
+
+
+class File:
+    def __init__(self, name: str, file: str = ''):
+        self.name = name
+        self.file = file
+
+
+class ProviderRequest:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+async def download_image_by_url(url: str) -> str:
+    return url
+
+
+def install():
+    """把插件根目录加入 sys.path，并在缺少 AstrBot 时注册桩模块"""
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    try:
+        import astrbot.api.platform  # noqa: F401
+        return
+    except ImportError:
+        pass
+
+    _module('astrbot', logger=logging.getLogger('astrbot'))
+    _module('astrbot.api')
+    _module('astrbot.api.platform', Platform=Platform, AstrBotMessage=AstrBotMessage, MessageMember=MessageMember,
+            PlatformMetadata=PlatformMetadata, MessageType=MessageType,
+            register_platform_adapter=lambda *args, **kwargs: (lambda cls: cls))
+    _module('astrbot.api.event', AstrMessageEvent=AstrMessageEvent, MessageChain=MessageChain,
+            filter=types.SimpleNamespace(on_llm_request=lambda *a, **k: (lambda f: f)))
+    _module('astrbot.api.message_components', Plain=Plain, Image=Image, Record=Record, File=File)
+    _module('astrbot.api.provider', ProviderRequest=ProviderRequest)
+    _module('astrbot.core')
+    _module('astrbot.core.platform')
+    _module('astrbot.core.platform.astr_message_event', MessageSesion=MessageSesion, AstrMessageEvent=AstrMessageEvent)
+    _module('astrbot.core.utils')
+    _module('astrbot.core.utils.io', download_image_by_url=download_image_by_url)
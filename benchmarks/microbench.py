@@ -0,0 +1,261 @@
+"""
+热点路径微基准：逐条消息都会执行的函数的单次调用耗时，并与保存的基线比较。
+
+适配器侧（AstrBot 由 astrbot_stub 代替）：
+    convert_message.text / convert_message.image   收到的聊天帧转换为 AstrBotMessage
+    send_by_session.chain                          主动消息的消息链组装与发送
+    send_image.need / send_image.have              图片握手后发送完整图片 / 客户端已缓存
+客户端侧（本仓库的 astr_agent.py；未安装 Open-LLM-VTuber 时其输入输出类型由 olv_stub 代替）：
+    batch_input_to_dict                            请求序列化
+    parse_output_message                           回复帧解析
+
+WebSocket 连接由不做 I/O 的桩代替，只测 Python 侧的开销。
+
+用法：
+    python benchmarks/microbench.py [--filter send_image] [--save FILE] [--compare FILE] [--threshold 0.25]
+
+--compare 默认使用 benchmarks/microbench_baseline.json；任一基准比基线慢超过 threshold（比例）时
+以退出码 1 结束。基线与机器相关，更换测试机器后先用 --save 重新生成。
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import types
+
+import astrbot_stub
+import olv_stub
+
+astrbot_stub.install()
+olv_stub.install()
+
+from astrbot.api.event import MessageChain  # noqa: E402
+from astrbot.api.message_components import Image, Plain  # noqa: E402
+from astrbot.api.platform import MessageType  # noqa: E402
+from astrbot.core.platform.astr_message_event import MessageSesion  # noqa: E402
+from vtb_adapter.server import MessageServer  # noqa: E402
+from vtb_adapter.vtb_adapter import VtbPlatformAdapter  # noqa: E402
+from open_llm_vtuber.agent.agents.astr_agent import batch_input_to_dict, parse_output_message  # noqa: E402
+from open_llm_vtuber.agent.input_types import BatchInput, ImageData, ImageSource, TextData, TextSource  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'microbench_baseline.json')
+
+TEXT = '今天的直播就到这里啦，谢谢大家的陪伴！下次想听什么歌可以在评论区告诉我哦。'
+# 约 100 KB 的图片内容（基准不解码图片，内容无需有效）
+IMAGE_BYTES = os.urandom(100 * 1024)
+
+BENCHMARKS = {}
+
+
+def bench(name: str):
+    """注册基准。被装饰的协程完成准备工作，返回每次调用执行的函数（普通函数或协程函数）"""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+class NullWebSocket:
+    """不做 I/O 的 WebSocket 桩；收到 image_offer 时按 reply（image_have / image_need）立即回复"""
+
+    def __init__(self, server: MessageServer, reply: str = 'image_need'):
+        self.server = server
+        self.reply = reply
+        self.remote_address = ('127.0.0.1', 0)
+        self.protocol = types.SimpleNamespace(max_message_size=None)
+        self.transport = None
+
+    async def send(self, text: str):
+        if text.startswith('{"type": "image_offer"'):
+            data = json.loads(text)
+            self.server.resolve_image_offer(str(self.remote_address), {'type': self.reply, 'hash': data['hash']})
+
+
+async def connected_server(reply: str = 'image_need'):
+    server = MessageServer()
+    connection = await server.register(NullWebSocket(server, reply))
+    return server, connection.client_id
+
+
+def chat_payload(images: int = 0) -> dict:
+    data_url = 'data:image/png;base64,' + base64.b64encode(IMAGE_BYTES).decode()
+    return {
+        'userid': '815049548',
+        'username': 'YakumoAki',
+        'request_id': 'bench',
+        'session_id': 'bench-session',
+        'client_id': 'bench',
+        'messages': {
+            'texts': [{'source': 'input', 'content': TEXT, 'from_name': 'YakumoAki'}],
+            'images': [{'source': 'camera', 'data': data_url, 'mime_type': 'image/png'}] * images,
+            'files': [],
+        },
+        'metadata': {},
+    }
+
+
+@bench('convert_message.text')
+async def bench_convert_text():
+    adapter = VtbPlatformAdapter({}, {}, asyncio.Queue())
+    payload = chat_payload()
+    return lambda: adapter.convert_message(payload)
+
+
+@bench('convert_message.image')
+async def bench_convert_image():
+    adapter = VtbPlatformAdapter({}, {}, asyncio.Queue())
+    payload = chat_payload(images=1)
+    return lambda: adapter.convert_message(payload)
+
+
+@bench('send_by_session.chain')
+async def bench_send_by_session():
+    adapter = VtbPlatformAdapter({}, {}, asyncio.Queue())
+    adapter.server, _ = await connected_server()
+    session = MessageSesion('open_llm_vtb', MessageType.FRIEND_MESSAGE, 'bench-session')
+    chain = MessageChain([Plain(part) for part in TEXT.split('，')] + [Image(file='https://example.com/a.png')])
+    return lambda: adapter.send_by_session(session, chain)
+
+
+async def _send_image(reply: str):
+    server, client_id = await connected_server(reply)
+    image_path = os.path.abspath('bench.png')
+    with open(image_path, 'wb') as f:
+        f.write(IMAGE_BYTES)
+    return lambda: server.send_image(client_id, image_path, 'bench')
+
+
+@bench('send_image.need')
+async def bench_send_image_need():
+    return await _send_image('image_need')
+
+
+@bench('send_image.have')
+async def bench_send_image_have():
+    return await _send_image('image_have')
+
+
+@bench('batch_input_to_dict')
+async def bench_batch_input_to_dict():
+    data_url = 'data:image/png;base64,' + base64.b64encode(IMAGE_BYTES).decode()
+    batch = BatchInput(
+        texts=[TextData(source=TextSource.INPUT, content=TEXT, from_name='YakumoAki')],
+        images=[ImageData(source=ImageSource.CAMERA, data=data_url, mime_type='image/png')],
+    )
+    return lambda: batch_input_to_dict(batch)
+
+
+@bench('parse_output_message')
+async def bench_parse_output_message():
+    message = json.dumps({
+        'type': 'sentence',
+        'display_text': {'text': TEXT, 'name': 'Mao', 'avatar': 'mao.png'},
+        'tts_text': TEXT,
+        'actions': {'expressions': ['joy'], 'pictures': [], 'sounds': []},
+    }, ensure_ascii=False)
+    return lambda: parse_output_message(message)
+
+
+async def measure(fn, min_time: float, repeat: int) -> dict:
+    """
+    与 timeit 相同的做法：循环次数翻倍直到一轮超过 min_time 秒，再重复 repeat 轮，
+    取单次调用耗时的最小值（受干扰最少）和中位数，单位微秒
+    """
+    async def run(number: int) -> float:
+        started = time.perf_counter()
+        for _ in range(number):
+            result = fn()
+            if asyncio.iscoroutine(result):
+                await result
+        return time.perf_counter() - started
+
+    number = 1
+    while await run(number) < min_time:
+        number *= 2
+    gc.collect()
+    gc.disable()
+    try:
+        times = [await run(number) / number for _ in range(repeat)]
+    finally:
+        gc.enable()
+    return {'us': min(times) * 1e6, 'median_us': statistics.median(times) * 1e6, 'loops': number}
+
+
+async def run_all(names: list, min_time: float, repeat: int) -> dict:
+    results = {}
+    for name in names:
+        setup = BENCHMARKS[name]
+        # 适配器和服务端每次调用都会 print 日志，测量期间丢弃
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            fn = await setup()
+            results[name] = await measure(fn, min_time, repeat)
+        print(f'{name:<24} {results[name]["us"]:>10.2f} us  (median {results[name]["median_us"]:.2f})')
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """打印与基线的对比，返回慢于基线超过 threshold 的基准"""
+    regressions = []
+    print(f'\n{"benchmark":<24} {"baseline us":>12} {"now us":>10} {"change":>8}')
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f'{name:<24} {"-":>12} {result["us"]:>10.2f} {"new":>8}')
+            continue
+        change = result['us'] / base['us'] - 1
+        mark = ''
+        if change > threshold:
+            mark = '  REGRESSION'
+            regressions.append(name)
+        print(f'{name:<24} {base["us"]:>12.2f} {result["us"]:>10.2f} {change:>+8.1%}{mark}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='适配器与客户端热点路径微基准')
+    parser.add_argument('--filter', default='', help='只运行名称包含该字符串的基准')
+    parser.add_argument('--min-time', type=float, default=0.2, help='每轮最短秒数')
+    parser.add_argument('--repeat', type=int, default=5, help='重复轮数')
+    parser.add_argument('--save', help='把结果保存为基线 JSON')
+    parser.add_argument('--compare', nargs='?', const=DEFAULT_BASELINE, help='与基线 JSON 比较（默认 %(const)s）')
+    parser.add_argument('--threshold', type=float, default=0.25, help='判定为退化的变慢比例')
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if args.filter in name]
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    save_path = os.path.abspath(args.save) if args.save else None
+
+    # convert_message 和 send_image 会写临时文件，在临时目录中运行
+    workdir = tempfile.mkdtemp(prefix='vtb_microbench_')
+    os.chdir(workdir)
+    try:
+        results = asyncio.run(run_all(names, args.min_time, args.repeat))
+    finally:
+        os.chdir(os.path.dirname(workdir))
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if save_path:
+        with open(save_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'python': sys.version.split()[0],
+                'machine': platform.machine(),
+                'results': results,
+            }, f, indent=2)
+    if baseline is not None and compare(results, baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
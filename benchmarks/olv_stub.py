@@ -0,0 +1,133 @@
+"""
+在没有 Open-LLM-VTuber 环境时，提供 astr_agent.py 导入的最小 open_llm_vtuber 接口，
+使客户端侧基准直接导入本仓库的 Open-LLM-VTuber/src/.../astr_agent.py 运行。
+输入输出类型与 Open-LLM-VTuber 的字段一致；其余模块只提供导入所需的名字。
+已安装 Open-LLM-VTuber 时 install() 不做任何事。
+"""
+import enum
+import logging
+import os
+import sys
+import types
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from astrbot_stub import ROOT, _module
+
+AGENTS_DIR = os.path.join(ROOT, 'Open-LLM-VTuber', 'src', 'open_llm_vtuber', 'agent', 'agents')
+
+
+class TextSource(enum.Enum):
+    INPUT = 'input'
+    CLIPBOARD = 'clipboard'
+
+
+class ImageSource(enum.Enum):
+    CAMERA = 'camera'
+    SCREEN = 'screen'
+    CLIPBOARD = 'clipboard'
+    UPLOAD = 'upload'
+
+
+@dataclass
+class TextData:
+    source: TextSource
+    content: str
+    from_name: Optional[str] = None
+
+
+@dataclass
+class ImageData:
+    source: ImageSource
+    data: str
+    mime_type: str
+
+
+@dataclass
+class FileData:
+    name: str
+    data: str
+    mime_type: str
+
+
+class BaseInput:
+    pass
+
+
+@dataclass
+class BatchInput(BaseInput):
+    texts: List[TextData]
+    images: Optional[List[ImageData]] = None
+    files: Optional[List[FileData]] = None
+    metadata: Optional[Dict[str, Any]] = None
+
+
+@dataclass
+class Actions:
+    expressions: Optional[list] = None
+    pictures: Optional[List[str]] = None
+    sounds: Optional[list] = None
+
+
+@dataclass
+class DisplayText:
+    text: str
+    name: Optional[str] = 'AI'
+    avatar: Optional[str] = None
+
+
+class BaseOutput:
+    pass
+
+
+@dataclass
+class SentenceOutput(BaseOutput):
+    display_text: DisplayText
+    tts_text: str
+    actions: Actions
+
+
+@dataclass
+class AudioOutput(BaseOutput):
+    audio_path: str
+    display_text: DisplayText
+    transcript: str
+    actions: Actions
+
+
+def _passthrough(*args, **kwargs):
+    """transformers 中的装饰器工厂；基准不调用 chat，原样返回被装饰的函数"""
+    return lambda func: func
+
+
+def _package(name: str, path: str = None) -> types.ModuleType:
+    return _module(name, __path__=[path] if path else [])
+
+
+def install():
+    """在缺少 Open-LLM-VTuber 时注册桩模块，astr_agent 本身从本仓库导入"""
+    try:
+        import open_llm_vtuber.agent.agents.astr_agent  # noqa: F401
+        return
+    except ImportError:
+        pass
+    try:
+        import loguru  # noqa: F401
+    except ImportError:
+        _module('loguru', logger=logging.getLogger('open_llm_vtuber'))
+
+    _package('open_llm_vtuber')
+    _package('open_llm_vtuber.agent')
+    _package('open_llm_vtuber.agent.agents', AGENTS_DIR)
+    _module('open_llm_vtuber.agent.input_types', TextSource=TextSource, ImageSource=ImageSource, TextData=TextData,
+            ImageData=ImageData, FileData=FileData, BaseInput=BaseInput, BatchInput=BatchInput)
+    _module('open_llm_vtuber.agent.output_types', Actions=Actions, DisplayText=DisplayText, BaseOutput=BaseOutput,
+            SentenceOutput=SentenceOutput, AudioOutput=AudioOutput)
+    _module('open_llm_vtuber.agent.agents.agent_interface', AgentInterface=object)
+    _module('open_llm_vtuber.agent.transformers', sentence_divider=_passthrough, actions_extractor=_passthrough,
+            tts_filter=_passthrough, display_processor=_passthrough)
+    _package('open_llm_vtuber.config_manager')
+    sys.modules['open_llm_vtuber.config_manager'].TTSPreprocessorConfig = object
+    _package('open_llm_vtuber.mcpp')
+    _module('open_llm_vtuber.mcpp.tool_manager', ToolManager=object)
+    _module('open_llm_vtuber.mcpp.tool_executor', ToolExecutor=object)
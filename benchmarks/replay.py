@@ -0,0 +1,219 @@
+"""
+抓包回放工具：把 FrameRecorder 录制的会话重新驱动到当前代码版本的适配器上，报告每轮延迟。
+
+AstrBot 的事件队列由桩代替：收到事件后按抓包中该请求的回复帧（text / MESSAGE_END）
+原样发回，默认保持原始间隔（复现 LLM 生成耗时），--fast 时不等待（只测适配器自身开销）。
+
+用法：
+    python benchmarks/replay.py capture.jsonl.gz [--fast] [--save report.json] [--compare old.json]
+
+--save 保存本次结果，--compare 与另一个代码版本保存的结果逐轮对比。
+"""
+import argparse
+import asyncio
+import json
+import socket
+import statistics
+import time
+
+import astrbot_stub
+
+astrbot_stub.install()
+
+import websockets  # noqa: E402
+
+from vtb_adapter.recorder import load_capture  # noqa: E402
+from vtb_adapter.vtb_adapter import VtbPlatformAdapter  # noqa: E402
+
+
+class FragmentAssembler:
+    """按 id/index/count 重组服务端拆分的 fragment 分片（同一连接内分片 id 唯一）"""
+
+    def __init__(self):
+        # (连接, 分片 id) -> 各分片的数据
+        self._parts = {}
+
+    def feed(self, data: dict, conn=None):
+        """非分片帧原样返回；分片收齐时返回重组后的帧，否则返回 None"""
+        if data.get('type') != 'fragment':
+            return data
+        parts = self._parts.setdefault((conn, data['id']), [None] * data['count'])
+        parts[data['index']] = data['data']
+        if None in parts:
+            return None
+        del self._parts[(conn, data['id'])]
+        return json.loads(''.join(parts))
+
+
+def extract_turns(records: list) -> list:
+    """
+    从抓包中提取对话轮次：请求帧、发送时间、抓包时的延迟以及服务端的回复脚本。
+    同时支持服务端抓包（请求为 in）和客户端抓包（请求为 out）。
+    """
+    frames = []
+    assembler = FragmentAssembler()
+    for record in records:
+        try:
+            data = assembler.feed(json.loads(record['data']), (record['dir'], record.get('conn')))
+        except json.JSONDecodeError:
+            continue
+        # 分片重组后的帧以最后一片的时间计
+        if data is not None:
+            frames.append((record, data))
+    requests = [(r, d) for r, d in frames if 'messages' in d]
+    if not requests:
+        return []
+    request_dir = requests[0][0]['dir']
+
+    turns = []
+    for index, (record, data) in enumerate(requests):
+        request_id = data.get('request_id')
+        next_t = requests[index + 1][0]['t'] if index + 1 < len(requests) else float('inf')
+        script = []
+        for reply_record, reply in frames:
+            if reply_record['dir'] == request_dir or reply_record['t'] < record['t']:
+                continue
+            if request_id is not None and reply.get('request_id') != request_id:
+                continue
+            if request_id is None and reply_record['t'] >= next_t:
+                break
+            if reply.get('type') in ('text', 'MESSAGE_END'):
+                script.append((reply_record['t'] - record['t'], reply))
+                if reply['type'] == 'MESSAGE_END':
+                    break
+        first_text = next((delay for delay, reply in script if reply['type'] == 'text'), None)
+        end = next((delay for delay, reply in script if reply['type'] == 'MESSAGE_END'), None)
+        turns.append({
+            't': record['t'],
+            'request': data,
+            'script': script,
+            'captured': {'first_text': first_text, 'total': end},
+        })
+    return turns
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def fake_astrbot(queue: asyncio.Queue, scripts: dict, fast: bool):
+    """桩 AstrBot：按抓包脚本回放回复帧"""
+    async def play(event):
+        script = scripts.get(event.request_id, [])
+        started = time.monotonic()
+        for delay, reply in script:
+            if not fast:
+                await asyncio.sleep(max(delay - (time.monotonic() - started), 0))
+            if reply['type'] == 'text':
+                await event.server.send_text(event.client_id, reply['content'], event.request_id)
+            else:
+                await event.server.send_end(event.client_id, event.request_id)
+
+    while True:
+        event = await queue.get()
+        asyncio.create_task(play(event))
+
+
+async def replay(turns: list, fast: bool) -> list:
+    port = free_port()
+    queue = asyncio.Queue()
+    adapter = VtbPlatformAdapter({'server_host': '127.0.0.1', 'server_port': port}, {}, queue)
+    server_task = asyncio.create_task(adapter.run())
+    for index, turn in enumerate(turns):
+        # 旧抓包没有 request_id 时补上，便于桩 AstrBot 找到对应脚本
+        turn['request'].setdefault('request_id', f'replay-{index}')
+        turn['request'].pop('seq', None)
+    scripts = {turn['request']['request_id']: turn['script'] for turn in turns}
+    bot_task = asyncio.create_task(fake_astrbot(queue, scripts, fast))
+
+    for _ in range(50):
+        try:
+            ws = await websockets.connect(f'ws://127.0.0.1:{port}')
+            break
+        except OSError:
+            await asyncio.sleep(0.1)
+
+    results = []
+    assembler = FragmentAssembler()
+    previous_t = turns[0]['t'] if turns else 0
+    for turn in turns:
+        if not fast:
+            # 保持用户两次发言之间的间隔
+            last_total = (results[-1]['total'] or 0) if results else 0
+            await asyncio.sleep(max(turn['t'] - previous_t - last_total, 0))
+        previous_t = turn['t']
+        request_id = turn['request']['request_id']
+        sent = time.monotonic()
+        await ws.send(json.dumps(turn['request'], ensure_ascii=False))
+        first_text = total = None
+        while total is None:
+            try:
+                data = assembler.feed(json.loads(await asyncio.wait_for(ws.recv(), 30)))
+            except asyncio.TimeoutError:
+                break
+            if data is None:
+                continue
+            if data.get('type') == 'image_offer':
+                await ws.send(json.dumps({'type': 'image_need', 'hash': data['hash']}))
+            if data.get('request_id') != request_id:
+                continue
+            if data.get('type') == 'text' and first_text is None:
+                first_text = time.monotonic() - sent
+            elif data.get('type') == 'MESSAGE_END':
+                total = time.monotonic() - sent
+        results.append({'first_text': first_text, 'total': total, 'captured': turn['captured']})
+
+    await ws.close()
+    bot_task.cancel()
+    server_task.cancel()
+    return results
+
+
+def _ms(value) -> str:
+    return '-' if value is None else f'{value * 1000:8.1f}'
+
+
+def report(results: list, baseline: list = None, baseline_label: str = 'captured'):
+    """打印逐轮延迟，以及与基线（抓包原始值或另一版本的结果）的差值"""
+    print(f'{"turn":>4} {"first_text":>10} {"total":>10} | {baseline_label + " first":>16} {"total":>10} | {"delta total":>12}')
+    deltas = []
+    for index, result in enumerate(results):
+        base = (baseline[index] if baseline and index < len(baseline) else result['captured'])
+        delta = None
+        if result['total'] is not None and base.get('total') is not None:
+            delta = result['total'] - base['total']
+            deltas.append(delta)
+        print(f'{index:>4} {_ms(result["first_text"]):>10} {_ms(result["total"]):>10} | '
+              f'{_ms(base.get("first_text")):>16} {_ms(base.get("total")):>10} | {_ms(delta):>12}')
+    if deltas:
+        print(f'delta total ms: mean {statistics.mean(deltas) * 1000:.1f}, '
+              f'median {statistics.median(deltas) * 1000:.1f}, max {max(deltas) * 1000:.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='回放 VTB 适配器抓包并报告每轮延迟')
+    parser.add_argument('capture', help='FrameRecorder 录制的 .jsonl.gz 文件')
+    parser.add_argument('--fast', action='store_true', help='不保留原始时间间隔，尽快回放')
+    parser.add_argument('--save', help='把本次结果保存为 JSON')
+    parser.add_argument('--compare', help='与另一版本保存的 JSON 结果对比')
+    args = parser.parse_args()
+
+    turns = extract_turns(load_capture(args.capture))
+    if not turns:
+        print('抓包中没有找到对话请求')
+        return
+    results = asyncio.run(replay(turns, args.fast))
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            report(results, json.load(f), 'baseline')
+    else:
+        report(results)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
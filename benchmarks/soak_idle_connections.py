@@ -0,0 +1,147 @@
+"""
+空闲连接浸泡测试：在子进程中启动 MessageServer，打开大量空闲 WebSocket 连接并保持一段时间，
+报告服务端进程的 RSS（总量与每连接增量）和事件循环延迟。
+
+用法：
+    python benchmarks/soak_idle_connections.py [--connections 10000] [--hold 30] [--no-compression]
+
+服务端与客户端分属两个进程，RSS 只统计服务端。连接数较多时需要足够大的文件描述符上限，
+脚本会尝试把 RLIMIT_NOFILE 提高到硬上限。
+"""
+import argparse
+import asyncio
+import builtins
+import json
+import resource
+import statistics
+import sys
+import time
+
+import astrbot_stub
+
+astrbot_stub.install()
+
+import websockets  # noqa: E402
+
+from replay import free_port  # noqa: E402
+from vtb_adapter.server import MessageServer  # noqa: E402
+
+
+def raise_nofile_limit() -> int:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def read_rss(pid: int) -> int:
+    """读取进程的常驻内存（字节）"""
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+async def serve(port: int, compression: bool, interval: float):
+    """子进程：运行服务端，并每秒在 stdout 输出一行事件循环延迟统计"""
+    # 每个连接都会 print 一行日志，浸泡测试中关闭
+    builtins.print = lambda *args, **kwargs: None
+    server = MessageServer(host='127.0.0.1', port=port, compression=compression)
+    asyncio.create_task(server.start())
+    loop = asyncio.get_running_loop()
+    lags = []
+    window_start = loop.time()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(loop.time() - expected)
+        if loop.time() - window_start >= 1.0:
+            lags.sort()
+            sys.stdout.write(json.dumps({
+                'connections': len(server.connections),
+                'lag_p50': lags[len(lags) // 2],
+                'lag_p99': lags[min(int(len(lags) * 0.99), len(lags) - 1)],
+                'lag_max': lags[-1],
+            }) + '\n')
+            sys.stdout.flush()
+            lags = []
+            window_start = loop.time()
+
+
+async def soak(connections: int, hold: float, batch: int, compression: bool):
+    port = free_port()
+    child = await asyncio.create_subprocess_exec(
+        sys.executable, __file__, '--serve', str(port), *([] if compression else ['--no-compression']),
+        stdout=asyncio.subprocess.PIPE
+    )
+    samples = []
+
+    async def collect():
+        async for line in child.stdout:
+            samples.append((time.monotonic(), json.loads(line)))
+
+    collector = asyncio.create_task(collect())
+    clients = []
+    try:
+        for _ in range(100):
+            try:
+                clients.append(await websockets.connect(f'ws://127.0.0.1:{port}'))
+                break
+            except OSError:
+                await asyncio.sleep(0.1)
+        await asyncio.sleep(1.5)
+        baseline_rss = read_rss(child.pid)
+
+        started = time.monotonic()
+        while len(clients) < connections:
+            size = min(batch, connections - len(clients))
+            clients.extend(await asyncio.gather(*(
+                websockets.connect(f'ws://127.0.0.1:{port}', ping_interval=None) for _ in range(size)
+            )))
+        connect_time = time.monotonic() - started
+
+        hold_start = time.monotonic()
+        await asyncio.sleep(hold)
+        loaded_rss = read_rss(child.pid)
+    finally:
+        await asyncio.gather(*(client.close() for client in clients), return_exceptions=True)
+        child.terminate()
+        await child.wait()
+        collector.cancel()
+
+    # 跳过建连风暴刚结束时的第一个窗口，只统计空闲保持期间
+    held = [sample for t, sample in samples if t >= hold_start + 1.5]
+    per_connection = (loaded_rss - baseline_rss) / max(len(clients), 1)
+    print(f'connections:        {len(clients)} (server saw {max((s["connections"] for s in held), default="?")})')
+    print(f'connect time:       {connect_time:.1f} s')
+    print(f'RSS baseline:       {baseline_rss / 2 ** 20:.1f} MiB')
+    print(f'RSS with clients:   {loaded_rss / 2 ** 20:.1f} MiB')
+    print(f'RSS per connection: {per_connection / 1024:.1f} KiB')
+    if held:
+        print(f'loop lag p50:       {statistics.median(s["lag_p50"] for s in held) * 1000:.2f} ms')
+        print(f'loop lag p99:       {max(s["lag_p99"] for s in held) * 1000:.2f} ms')
+        print(f'loop lag max:       {max(s["lag_max"] for s in held) * 1000:.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MessageServer 空闲连接浸泡测试')
+    parser.add_argument('--connections', type=int, default=10000, help='空闲连接数')
+    parser.add_argument('--hold', type=float, default=30.0, help='连接建立后保持的秒数')
+    parser.add_argument('--batch', type=int, default=200, help='每批并发建立的连接数')
+    parser.add_argument('--no-compression', action='store_true', help='服务端关闭 permessage-deflate')
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    limit = raise_nofile_limit()
+    if args.serve:
+        asyncio.run(serve(args.serve, not args.no_compression, 0.01))
+        return
+    if limit < args.connections + 64:
+        print(f'文件描述符上限 {limit} 不足以打开 {args.connections} 个连接，请先调高 ulimit -n')
+        return
+    asyncio.run(soak(args.connections, args.hold, args.batch, not args.no_compression))
+
+
+if __name__ == '__main__':
+    main()
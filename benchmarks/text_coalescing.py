@@ -0,0 +1,127 @@
+"""
+文本帧合并基准：比较关闭与开启 text_coalesce_window 时每轮回复的 text 帧数、服务端 CPU 时间和首句延迟。
+
+桩 AstrBot 以两种方式回复同一段文本：
+    chain   一次 send，消息链由许多短 Plain 组件组成（如插件逐段拼接的回复）
+    stream  send_streaming，按 token 大小的增量逐段产出，增量间隔 --delta-interval 秒
+
+用法：
+    python benchmarks/text_coalescing.py [--turns 200] [--window 0.05] [--delta-interval 0.002]
+
+客户端与服务端在同一进程中，CPU 时间包含两端，开启合并后两端处理的帧都会减少。
+"""
+import argparse
+import asyncio
+import json
+import re
+import statistics
+import time
+
+import astrbot_stub
+
+astrbot_stub.install()
+
+import websockets  # noqa: E402
+
+from astrbot.api.event import MessageChain  # noqa: E402
+from astrbot.api.message_components import Plain  # noqa: E402
+from replay import free_port  # noqa: E402
+from vtb_adapter.vtb_adapter import VtbPlatformAdapter  # noqa: E402
+
+REPLY = ('今天的直播就到这里啦，谢谢大家的陪伴！下次想听什么歌可以在评论区告诉我哦。'
+         'By the way, the new model will be ready next week, so stay tuned. '
+         '晚安，做个好梦～')
+# 近似 LLM 的 token：英文按单词，中文按 1-2 个字
+TOKENS = re.findall(r'\s*[A-Za-z]+[,.]?\s?|[^\sA-Za-z]{1,2}', REPLY)
+SENTENCE_END = re.compile(r'[。！？!?～\n]|\.(?:\s|$)')
+
+
+async def fake_astrbot(queue: asyncio.Queue, mode: str, delta_interval: float):
+    async def play(event):
+        if mode == 'chain':
+            await event.send(MessageChain([Plain(token) for token in TOKENS]))
+            return
+
+        async def deltas():
+            for token in TOKENS:
+                yield MessageChain([Plain(token)])
+                if delta_interval:
+                    await asyncio.sleep(delta_interval)
+
+        await event.send_streaming(deltas())
+
+    while True:
+        event = await queue.get()
+        asyncio.create_task(play(event))
+
+
+async def run(mode: str, window: float, turns: int, delta_interval: float) -> dict:
+    port = free_port()
+    queue = asyncio.Queue()
+    adapter = VtbPlatformAdapter({'server_host': '127.0.0.1', 'server_port': port,
+                                  'text_coalesce_window': window}, {}, queue)
+    server_task = asyncio.create_task(adapter.run())
+    bot_task = asyncio.create_task(fake_astrbot(queue, mode, delta_interval))
+    for _ in range(50):
+        try:
+            ws = await websockets.connect(f'ws://127.0.0.1:{port}')
+            break
+        except OSError:
+            await asyncio.sleep(0.1)
+
+    frames, first_sentence, totals = [], [], []
+    cpu_started = time.process_time()
+    for index in range(turns):
+        request_id = f'bench-{index}'
+        sent = time.monotonic()
+        await ws.send(json.dumps({
+            'userid': 'bench', 'username': 'bench', 'request_id': request_id,
+            'messages': {'texts': [{'content': 'hi'}], 'images': []},
+        }))
+        count, text, sentence_at = 0, '', None
+        while True:
+            data = json.loads(await asyncio.wait_for(ws.recv(), 30))
+            if data.get('request_id') != request_id:
+                continue
+            if data.get('type') == 'text':
+                count += 1
+                text += data['content']
+                if sentence_at is None and SENTENCE_END.search(text):
+                    sentence_at = time.monotonic() - sent
+            elif data.get('type') == 'MESSAGE_END':
+                totals.append(time.monotonic() - sent)
+                break
+        assert text == REPLY, text
+        frames.append(count)
+        first_sentence.append(sentence_at)
+    cpu = time.process_time() - cpu_started
+
+    await ws.close()
+    bot_task.cancel()
+    server_task.cancel()
+    return {
+        'frames': statistics.mean(frames),
+        'cpu_ms': cpu / turns * 1000,
+        'first_sentence_ms': statistics.median(first_sentence) * 1000,
+        'total_ms': statistics.median(totals) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='text 帧合并基准')
+    parser.add_argument('--turns', type=int, default=200, help='每种配置的回复轮数')
+    parser.add_argument('--window', type=float, default=0.05, help='开启合并时的 text_coalesce_window')
+    parser.add_argument('--delta-interval', type=float, default=0.002, help='stream 模式下增量之间的间隔秒数')
+    args = parser.parse_args()
+
+    print(f'reply: {len(REPLY)} chars, {len(TOKENS)} segments')
+    print(f'{"mode":<7} {"window":>7} | {"frames/reply":>12} {"cpu ms/reply":>12} {"1st sentence ms":>15} {"total ms":>9}')
+    for mode in ('chain', 'stream'):
+        for window in (0, args.window):
+            result = asyncio.run(run(mode, window, args.turns, args.delta_interval))
+            print(f'{mode:<7} {window:>7} | {result["frames"]:>12.1f} {result["cpu_ms"]:>12.2f} '
+                  f'{result["first_sentence_ms"]:>15.1f} {result["total_ms"]:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
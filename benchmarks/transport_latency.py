@@ -0,0 +1,106 @@
+"""
+传输层延迟基准：比较 MessageServer 经 TCP 回环与经 Unix 套接字的往返延迟和吞吐。
+
+服务端在子进程中运行（与真实部署一样两端各占一个事件循环），不挂接适配器，
+每收到一帧回复一个 MESSAGE_COMMIT。客户端逐帧发送并等待回复，统计往返时间。
+
+用法：
+    python benchmarks/transport_latency.py [--frames 5000] [--sizes 200,65536] [--no-compression]
+"""
+import argparse
+import asyncio
+import builtins
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import astrbot_stub
+
+astrbot_stub.install()
+
+import websockets  # noqa: E402
+
+from replay import free_port  # noqa: E402
+from vtb_adapter.server import MessageServer  # noqa: E402
+
+
+async def serve(address: str, compression: bool):
+    """子进程：address 为端口号或 Unix 套接字路径"""
+    builtins.print = lambda *args, **kwargs: None
+    if address.isdigit():
+        server = MessageServer(host='127.0.0.1', port=int(address), compression=compression)
+    else:
+        server = MessageServer(socket_path=address, compression=compression)
+    await server.start()
+
+
+async def connect(address: str):
+    for _ in range(100):
+        try:
+            if address.isdigit():
+                return await websockets.connect(f'ws://127.0.0.1:{address}', max_size=None)
+            return await websockets.unix_connect(address, uri='ws://localhost/', max_size=None)
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f'无法连接 {address}')
+
+
+async def measure(address: str, compression: bool, frames: int, size: int) -> dict:
+    child = await asyncio.create_subprocess_exec(
+        sys.executable, __file__, '--serve', address, *([] if compression else ['--no-compression']),
+    )
+    try:
+        ws = await connect(address)
+        # 内容带随机性，避免压缩把大帧压得过小
+        frame = json.dumps({'type': 'bench', 'content': os.urandom(size // 2).hex()})
+        for _ in range(min(frames // 10, 200)):
+            await ws.send(frame)
+            await ws.recv()
+        rtts = []
+        started = time.perf_counter()
+        for _ in range(frames):
+            sent = time.perf_counter()
+            await ws.send(frame)
+            await ws.recv()
+            rtts.append(time.perf_counter() - sent)
+        elapsed = time.perf_counter() - started
+        await ws.close()
+    finally:
+        child.terminate()
+        await child.wait()
+    rtts.sort()
+    return {
+        'p50_us': statistics.median(rtts) * 1e6,
+        'p99_us': rtts[min(int(len(rtts) * 0.99), len(rtts) - 1)] * 1e6,
+        'frames_per_s': frames / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TCP 回环与 Unix 套接字的往返延迟对比')
+    parser.add_argument('--frames', type=int, default=5000, help='每种配置的往返次数')
+    parser.add_argument('--sizes', default='200,65536', help='请求帧大小（字节），逗号分隔')
+    parser.add_argument('--no-compression', action='store_true', help='关闭 permessage-deflate')
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    compression = not args.no_compression
+
+    if args.serve:
+        asyncio.run(serve(args.serve, compression))
+        return
+
+    socket_path = os.path.join(tempfile.mkdtemp(), 'vtb.sock')
+    print(f'compression: {compression}')
+    print(f'{"transport":<9} {"size":>7} | {"p50 us":>8} {"p99 us":>8} {"frames/s":>9}')
+    for size in (int(s) for s in args.sizes.split(',')):
+        for name, address in (('tcp', str(free_port())), ('unix', socket_path)):
+            result = asyncio.run(measure(address, compression, args.frames, size))
+            print(f'{name:<9} {size:>7} | {result["p50_us"]:>8.1f} {result["p99_us"]:>8.1f} '
+                  f'{result["frames_per_s"]:>9.0f}')
+
+
+if __name__ == '__main__':
+    main()
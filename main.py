@@ -6,6 +6,8 @@ from astrbot.api.provider import ProviderRequest
 class VtbAdapterPlugin(Star):
     def __init__(self, context: Context):
         from .vtb_adapter.vtb_adapter import VtbPlatformAdapter # noqa 
+        # 供适配器在 session_open 时预热会话上下文
+        VtbPlatformAdapter.star_context = context
         @filter.on_llm_request()
         async def my_custom_hook_1(self, event: AstrMessageEvent, req: ProviderRequest): # 请注意有三个参数
             print(req) # 打印请求的文本
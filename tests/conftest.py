@@ -0,0 +1,13 @@
+import os
+import sys
+
+# 插件根目录，保证可以直接 import vtb_adapter；未安装 AstrBot / Open-LLM-VTuber 时使用基准测试的桩模块
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import astrbot_stub  # noqa: E402
+import olv_stub  # noqa: E402
+
+astrbot_stub.install()
+olv_stub.install()
@@ -0,0 +1,69 @@
+from astrbot.api.message_components import Image, Plain
+from astrbot.api.platform import AstrBotMessage, MessageMember
+
+from vtb_adapter.batcher import ChatBatcher
+
+
+def make_message(name: str, text: str, priority: int = None, extra: list = None) -> AstrBotMessage:
+    message = AstrBotMessage()
+    message.type = 'FriendMessage'
+    message.self_id = 'vtb_bot'
+    message.session_id = 'room'
+    message.message_id = f'msg-{name}'
+    message.sender = MessageMember(user_id=f'u_{name}', nickname=name)
+    message.message = [Plain(text=text)] + (extra or [])
+    message.message_str = text
+    message.raw_message = {'client_id': 'c1', 'request_id': f'req-{name}', 'priority': priority}
+    return message
+
+
+def names(messages: list) -> list:
+    return [message.sender.nickname for message in messages]
+
+
+def test_select_keeps_everything_within_max_size():
+    batcher = ChatBatcher(None, lambda: None, max_size=3)
+    batch = [make_message(name, 'hi') for name in 'abc']
+    assert batcher.select(batch) == batch
+
+
+def test_select_prefers_priority_then_questions_and_keeps_arrival_order():
+    batcher = ChatBatcher(None, lambda: None, max_size=3)
+    batch = [
+        make_message('a', 'hello'),
+        make_message('b', 'what game?'),
+        make_message('c', 'superchat', priority=100),
+        make_message('d', 'lol'),
+        make_message('e', '你几岁？'),
+        make_message('f', 'gg'),
+    ]
+    for _ in range(20):
+        assert names(batcher.select(batch)) == ['b', 'c', 'e']
+
+
+def test_select_samples_among_equal_rank():
+    batcher = ChatBatcher(None, lambda: None, max_size=2)
+    batch = [make_message(name, 'hi') for name in 'abcdef']
+    seen = set()
+    for _ in range(200):
+        selected = names(batcher.select(batch))
+        assert len(selected) == 2 and selected == sorted(selected)
+        seen.update(selected)
+    assert seen == set('abcdef')
+
+
+def test_merge_attributes_each_line_and_replies_to_the_last_message():
+    image = Image(file='/tmp/cat.png')
+    merged = ChatBatcher.merge([
+        make_message('alice', 'hi'),
+        make_message('bob', 'look', extra=[image]),
+        make_message('erin', 'what game?'),
+    ])
+    assert merged.message_str == 'alice: hi\nbob: look\nerin: what game?'
+    assert [c.text for c in merged.message if isinstance(c, Plain)] == ['alice: hi\n', 'bob: look\n', 'erin: what game?\n']
+    # 图片等非文本组件保留在其发送者的那一行之后
+    assert merged.message[2] is image
+    assert merged.sender.user_id == 'u_erin'
+    assert merged.message_id == 'msg-erin'
+    assert merged.raw_message['request_id'] == 'req-erin'
+    assert merged.raw_message['batched'] == ['req-alice', 'req-bob', 'req-erin']
@@ -0,0 +1,90 @@
+import json
+
+from vtb_adapter.delivery import DeliverySession
+
+
+def stamp_frames(session: DeliverySession, count: int) -> list:
+    return [session.stamp({'type': 'text', 'content': f'frame {i}'}) for i in range(count)]
+
+
+def seqs(texts: list) -> list:
+    return [json.loads(text)['seq'] for text in texts]
+
+
+def test_stamp_assigns_increasing_seq_and_buffers():
+    session = DeliverySession()
+    texts = stamp_frames(session, 3)
+    assert seqs(texts) == [1, 2, 3]
+    assert session.seq == 3
+    assert [seq for seq, _ in session.buffer] == [1, 2, 3]
+    assert session.buffer_bytes == sum(len(text) for text in texts)
+
+
+def test_stamp_evicts_oldest_frames_over_limits():
+    session = DeliverySession(max_frames=2)
+    stamp_frames(session, 5)
+    assert [seq for seq, _ in session.buffer] == [4, 5]
+
+    session = DeliverySession(max_bytes=1)
+    text = session.stamp({'type': 'text', 'content': 'x'})
+    # 单帧超过字节上限时也不会保留
+    assert not session.buffer
+    assert session.buffer_bytes == 0
+    assert json.loads(text)['seq'] == 1
+
+
+def test_ack_releases_confirmed_frames():
+    session = DeliverySession()
+    texts = stamp_frames(session, 4)
+    session.ack(2)
+    assert [seq for seq, _ in session.buffer] == [3, 4]
+    assert session.buffer_bytes == len(texts[2]) + len(texts[3])
+
+
+def test_duplicate_and_stale_acks_are_noops():
+    session = DeliverySession()
+    stamp_frames(session, 4)
+    session.ack(3)
+    session.ack(3)
+    session.ack(1)
+    assert [seq for seq, _ in session.buffer] == [4]
+    session.ack(10)
+    assert not session.buffer
+    assert session.buffer_bytes == 0
+
+
+def test_replay_after_returns_unacknowledged_frames_in_order():
+    session = DeliverySession()
+    texts = stamp_frames(session, 5)
+    assert session.replay_after(2) == texts[2:]
+    # 补发的帧同时视为已确认之前的帧
+    assert [seq for seq, _ in session.buffer] == [3, 4, 5]
+
+
+def test_replay_after_repeated_resume_returns_same_frames():
+    # 客户端补发未完成就再次断开，用同一个 last_seq 重连时得到相同的帧
+    session = DeliverySession()
+    texts = stamp_frames(session, 3)
+    assert session.replay_after(1) == texts[1:]
+    assert session.replay_after(1) == texts[1:]
+
+
+def test_replay_after_up_to_date_client_is_empty():
+    session = DeliverySession()
+    stamp_frames(session, 3)
+    assert session.replay_after(3) == []
+
+
+def test_replay_after_reports_gap_when_buffer_overflowed():
+    session = DeliverySession(max_frames=2)
+    stamp_frames(session, 5)
+    assert session.replay_after(1) is None
+    # 缓冲区恰好保留了 last_seq 之后的第一帧时没有缺口
+    assert seqs(session.replay_after(3)) == [4, 5]
+
+
+def test_replay_after_fresh_session_for_client_ahead_of_server():
+    # 服务端重启后投递状态丢失，客户端的 last_seq 大于服务端序号：没有可补发的帧，也不是缺口
+    session = DeliverySession()
+    assert session.replay_after(7) == []
+    assert seqs([session.stamp({'type': 'text'})]) == [1]
@@ -0,0 +1,105 @@
+import asyncio
+
+from open_llm_vtuber.agent.agents.astr_agent import AstrAgent, GroupCoordinator, PendingRequest
+from open_llm_vtuber.agent.input_types import BatchInput, TextData, TextSource
+
+class FakeLLM:
+    """记录预取请求，不做 I/O；每个测试使用不同的 uri，群聊协调器互不影响"""
+
+    def __init__(self, uri: str):
+        self.uri = uri
+        self.sent = []
+        self.committed = []
+
+    async def send_request(self, input_data, session_id, stream=None, speculative=False):
+        self.sent.append(input_data.texts[0].content)
+        return PendingRequest(f'prefetch-{len(self.sent)}')
+
+    async def commit_speculative(self, request):
+        self.committed.append(request.request_id)
+
+    def discard(self, request):
+        pass
+
+    async def open_session(self, *args):
+        pass
+
+
+def make_agent(tmp_path, name: str, llm: FakeLLM) -> AstrAgent:
+    agent = AstrAgent(llm.uri, '', None, image_cache_dir=str(tmp_path / name), character_name=name)
+    agent._llm = llm
+    return agent
+
+
+def group_input(*lines) -> BatchInput:
+    return BatchInput(texts=[TextData(source=TextSource.INPUT, content='\n'.join(lines), from_name='Human')])
+
+
+def test_groups_on_the_same_url_are_separate(tmp_path):
+    llm = FakeLLM(str(tmp_path))
+    alice, bob, carol, dave = (make_agent(tmp_path, name, llm) for name in ('Alice', 'Bob', 'Carol', 'Dave'))
+    alice.start_group_conversation('Human', ['Bob'])
+    bob.start_group_conversation('Human', ['Alice'])
+    carol.start_group_conversation('Human', ['Dave'])
+    dave.start_group_conversation('Human', ['Carol'])
+    assert alice._group is bob._group
+    assert carol._group is dave._group and carol._group is not alice._group
+    assert alice._group.next_after(alice) is bob
+
+    group = alice._group
+    alice.end_group_conversation()
+    bob.end_group_conversation()
+    assert alice._group is None and group.key not in GroupCoordinator._instances
+
+
+def test_prefetch_used_only_when_input_matches_exactly(tmp_path):
+    async def run():
+        llm = FakeLLM(str(tmp_path))
+        alice, bob = make_agent(tmp_path, 'Alice', llm), make_agent(tmp_path, 'Bob', llm)
+        alice.start_group_conversation('Human', ['Bob'])
+        bob.start_group_conversation('Human', ['Alice'])
+
+        alice._on_turn_generated('Nice to meet you [joy]')
+        await asyncio.sleep(0)
+        assert llm.sent == ['Alice: Nice to meet you [joy]']
+        # 期间人类插话：实际输入多出人类的发言，不采用预取
+        bob._check_group(group_input('Human: what should we play?', 'Alice: Nice to meet you [joy]'))
+        assert await bob._take_prefetch(group_input('Human: what should we play?', 'Alice: Nice to meet you [joy]')) is None
+
+        alice._on_turn_generated('Shall we sing?')
+        await asyncio.sleep(0)
+        bob._check_group(group_input('Alice: Shall we sing?'))
+        request = await bob._take_prefetch(group_input('Alice: Shall we sing?'))
+        assert request is not None and llm.committed == [request.request_id]
+
+    asyncio.run(run())
+
+
+def test_no_prefetch_for_tag_only_turns(tmp_path):
+    async def run():
+        llm = FakeLLM(str(tmp_path))
+        alice, bob = make_agent(tmp_path, 'Alice', llm), make_agent(tmp_path, 'Bob', llm)
+        alice.start_group_conversation('Human', ['Bob'])
+        bob.start_group_conversation('Human', ['Alice'])
+        # 归一化后为空的输入与任何输入都无法区分
+        bob.prefetch_turn('[joy]', 'Human')
+        await asyncio.sleep(0)
+        assert llm.sent == [] and bob._prefetch is None
+
+    asyncio.run(run())
+
+
+def test_leaves_group_when_input_no_longer_has_group_turns(tmp_path):
+    async def run():
+        llm = FakeLLM(str(tmp_path))
+        alice, bob = make_agent(tmp_path, 'Alice', llm), make_agent(tmp_path, 'Bob', llm)
+        alice.start_group_conversation('Human', ['Bob'])
+        bob.start_group_conversation('Human', ['Alice'])
+        alice._on_turn_generated('Bye everyone')
+        await asyncio.sleep(0)
+        # 群聊结束后 Bob 回到单人对话
+        bob._check_group(group_input('hello bob, just us now'))
+        assert bob._group is None and bob._prefetch is None
+        assert alice._group.next_after(alice) is None
+
+    asyncio.run(run())
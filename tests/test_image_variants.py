@@ -0,0 +1,20 @@
+from vtb_adapter.image_variants import capability_profile
+
+
+def test_capability_profile_normalizes_declared_limits():
+    profile = capability_profile({'image': {'max_width': '640', 'max_height': 480, 'formats': ['WebP', 'png', 'bmp']}})
+    assert profile == (640, 480, ('webp', 'png'))
+
+
+def test_capability_profile_without_limits():
+    assert capability_profile(None) is None
+    assert capability_profile({}) is None
+    assert capability_profile({'image': {}}) is None
+
+
+def test_capability_profile_ignores_malformed_values():
+    assert capability_profile({'image': {'max_width': 'wide', 'max_height': [1], 'formats': ['png', 3, None]}}) == \
+        (0, 0, ('png',))
+    assert capability_profile({'image': {'max_width': -5, 'formats': 'png'}}) is None
+    assert capability_profile({'image': 'small'}) is None
+    assert capability_profile(['image']) is None
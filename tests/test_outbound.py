@@ -0,0 +1,34 @@
+import asyncio
+import types
+
+from vtb_adapter.outbound import OutboundScheduler
+
+
+class FakeServer:
+    """只记录 close() 时编号进续传缓冲区的帧"""
+
+    def __init__(self):
+        self.deliveries = {'client': object()}
+        self.stamped = []
+
+    def encode_frame(self, client_id: str, payload: dict) -> str:
+        self.stamped.append(payload['content'])
+        return ''
+
+
+def test_close_stamps_pending_frames_in_send_order():
+    async def run():
+        server = FakeServer()
+        scheduler = OutboundScheduler(server, types.SimpleNamespace(client_id='client'))
+        # 堆数组中的顺序为 [text 1, image, text 2]，与出队顺序不同
+        futures = [
+            scheduler.put({'type': 'image', 'content': 'image'}, 'r1'),
+            scheduler.put({'type': 'text', 'content': 'text 1'}, 'r2'),
+            scheduler.put({'type': 'text', 'content': 'text 2'}, 'r3'),
+            scheduler.put({'type': 'MESSAGE_END', 'content': 'end'}, 'r3'),
+        ]
+        scheduler.close()
+        assert all(future.done() for future in futures)
+        return server.stamped
+
+    assert asyncio.run(run()) == ['text 1', 'text 2', 'end', 'image']
@@ -0,0 +1,81 @@
+import types
+
+from vtb_adapter import response_cache
+from vtb_adapter.response_cache import ResponseCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def make_cache(monkeypatch, **kwargs):
+    clock = FakeClock()
+    monkeypatch.setattr(response_cache, 'time', types.SimpleNamespace(monotonic=clock.monotonic))
+    return ResponseCache(**kwargs), clock
+
+
+def frames(text: str) -> list:
+    return [{'type': 'text', 'content': text}]
+
+
+def test_exact_hit_ignores_case_and_punctuation(monkeypatch):
+    cache, _ = make_cache(monkeypatch)
+    cache.store('mio', '你好！', frames('[joy] 你好呀'))
+    assert cache.lookup('mio', '你好~') == frames('[joy] 你好呀')
+    assert cache.lookup('mio', 'Hello?') is None
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'hit_rate': 0.5, 'entries': 1}
+
+
+def test_entries_are_per_persona(monkeypatch):
+    cache, _ = make_cache(monkeypatch)
+    cache.store('mio', 'what game is this', frames('a'))
+    assert cache.lookup('shiro', 'what game is this') is None
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    cache, clock = make_cache(monkeypatch, ttl=10)
+    cache.store('mio', 'hi', frames('a'))
+    clock.now += 9.9
+    assert cache.lookup('mio', 'hi') == frames('a')
+    clock.now += 0.2
+    assert cache.lookup('mio', 'hi') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_similar_question_hits_above_threshold(monkeypatch):
+    cache, clock = make_cache(monkeypatch, ttl=10, similarity=0.9)
+    cache.store('mio', 'what game are you playing today', frames('a'))
+    assert cache.lookup('mio', 'what game are you playing today?!') == frames('a')
+    assert cache.lookup('mio', 'what game are u playing today') == frames('a')
+    assert cache.lookup('mio', 'what are you eating today') is None
+    # 过期的条目不参与相似匹配
+    clock.now += 11
+    assert cache.lookup('mio', 'what game are u playing today') is None
+
+
+def test_similarity_one_disables_fuzzy_matching(monkeypatch):
+    cache, _ = make_cache(monkeypatch, similarity=1)
+    cache.store('mio', 'what game are you playing today', frames('a'))
+    assert cache.lookup('mio', 'what game are u playing today') is None
+
+
+def test_lru_eviction_keeps_recently_used(monkeypatch):
+    cache, _ = make_cache(monkeypatch, max_entries=2, similarity=1)
+    cache.store('mio', 'one', frames('1'))
+    cache.store('mio', 'two', frames('2'))
+    assert cache.lookup('mio', 'one') == frames('1')
+    cache.store('mio', 'three', frames('3'))
+    assert cache.lookup('mio', 'two') is None
+    assert cache.lookup('mio', 'one') == frames('1')
+    assert cache.lookup('mio', 'three') == frames('3')
+
+
+def test_cacheable_limits_text_length():
+    cache = ResponseCache(max_text_length=5)
+    assert cache.cacheable('hello')
+    assert not cache.cacheable('')
+    assert not cache.cacheable('hello!')
@@ -0,0 +1,84 @@
+import asyncio
+import types
+
+from open_llm_vtuber.agent.agents import astr_agent
+from open_llm_vtuber.agent.agents.astr_agent import ToolCallRunner
+
+
+class FakeExecutor:
+    """记录每次真实执行；结果为 '<工具名>:<参数 x>'，x 为负数时返回错误"""
+
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.calls = []
+
+    async def run_single_tool(self, name, call_id, arguments):
+        self.calls.append((name, arguments))
+        await asyncio.sleep(self.delay)
+        is_error = arguments.get('x', 0) < 0
+        return is_error, f'{name}:{arguments.get("x")}', {}, []
+
+
+def make_runner(executor, **kwargs) -> ToolCallRunner:
+    return ToolCallRunner(None, executor, deterministic_tools=['weather'], **kwargs)
+
+
+def test_deterministic_results_are_cached_until_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(astr_agent, 'time', types.SimpleNamespace(monotonic=lambda: now[0]))
+
+    async def run():
+        executor = FakeExecutor()
+        runner = make_runner(executor, cache_ttl=10)
+        assert await runner.run('1', 'weather', {'x': 1}) == (False, 'weather:1')
+        assert await runner.run('2', 'weather', {'x': 1}) == (False, 'weather:1')
+        assert len(executor.calls) == 1
+        # 参数不同不共享结果
+        await runner.run('3', 'weather', {'x': 2})
+        assert len(executor.calls) == 2
+        now[0] += 11
+        await runner.run('4', 'weather', {'x': 1})
+        assert len(executor.calls) == 3
+    asyncio.run(run())
+
+
+def test_errors_and_nondeterministic_tools_are_not_cached():
+    async def run():
+        executor = FakeExecutor()
+        runner = make_runner(executor)
+        assert await runner.run('1', 'weather', {'x': -1}) == (True, 'weather:-1')
+        await runner.run('2', 'weather', {'x': -1})
+        await runner.run('3', 'roll_dice', {'x': 1})
+        await runner.run('4', 'roll_dice', {'x': 1})
+        assert len(executor.calls) == 4
+    asyncio.run(run())
+
+
+def test_concurrent_identical_calls_share_one_execution():
+    async def run():
+        executor = FakeExecutor(delay=0.05)
+        runner = make_runner(executor)
+        results = await asyncio.gather(
+            *(runner.run(str(i), 'weather', {'x': 1}) for i in range(3)),
+            runner.run('other', 'roll_dice', {'x': 1}),
+            runner.run('other2', 'roll_dice', {'x': 1}),
+        )
+        assert results == [(False, 'weather:1')] * 3 + [(False, 'roll_dice:1')] * 2
+        assert executor.calls.count(('weather', {'x': 1})) == 1
+        assert executor.calls.count(('roll_dice', {'x': 1})) == 2
+        assert not runner._inflight
+    asyncio.run(run())
+
+
+def test_cache_is_bounded_lru():
+    async def run():
+        executor = FakeExecutor()
+        runner = make_runner(executor, max_entries=2)
+        for x in (1, 2, 1, 3):
+            await runner.run(str(x), 'weather', {'x': x})
+        assert len(executor.calls) == 3
+        await runner.run('again', 'weather', {'x': 1})
+        assert len(executor.calls) == 3
+        await runner.run('again', 'weather', {'x': 2})
+        assert len(executor.calls) == 4
+    asyncio.run(run())
@@ -0,0 +1,114 @@
+import asyncio
+import base64
+import hashlib
+import os
+
+import pytest
+
+from vtb_adapter.upload import UploadManager
+
+
+def upload_id(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def chunk_frame(data: bytes, offset: int, size: int, index: int = 0) -> dict:
+    chunk = data[offset:offset + size]
+    return {
+        'upload_id': upload_id(data),
+        'offset': offset,
+        'index': index,
+        'data': base64.b64encode(chunk).decode(),
+        'sha256': hashlib.sha256(chunk).hexdigest(),
+    }
+
+
+def begin_frame(data: bytes, **fields) -> dict:
+    return dict({'upload_id': upload_id(data), 'size': len(data), 'name': 'a.png', 'mime_type': 'image/png'}, **fields)
+
+
+def test_upload_dir_is_created_on_first_upload(tmp_path):
+    upload_dir = tmp_path / 'uploads'
+    manager = UploadManager(str(upload_dir))
+    assert not upload_dir.exists()
+    manager.begin(begin_frame(b'data'))
+    assert upload_dir.is_dir()
+
+
+def test_chunks_are_appended_in_order_and_verified(tmp_path):
+    async def run():
+        data = os.urandom(1000)
+        manager = UploadManager(str(tmp_path))
+        assert manager.begin(begin_frame(data), 'c1') == 0
+        assert manager.chunk(chunk_frame(data, 0, 400)) == 400
+        with pytest.raises(ValueError, match='偏移'):
+            manager.chunk(chunk_frame(data, 500, 100))
+        bad = chunk_frame(data, 400, 400)
+        bad['sha256'] = '0' * 64
+        with pytest.raises(ValueError, match='校验'):
+            manager.chunk(bad)
+        with pytest.raises(ValueError, match='不完整'):
+            manager.end(upload_id(data))
+        assert manager.chunk(chunk_frame(data, 400, 600)) == 1000
+        path = manager.end(upload_id(data))
+        assert path == os.path.join(str(tmp_path), upload_id(data) + '.png')
+        assert open(path, 'rb').read() == data
+        # 重复 begin/end 已完成的上传直接返回完整结果
+        assert manager.begin(begin_frame(data)) == 1000
+        assert manager.end(upload_id(data)) == path
+        assert manager.path_for(upload_id(data)) == path
+    asyncio.run(run())
+
+
+def test_corrupt_file_is_discarded(tmp_path):
+    data = os.urandom(100)
+    manager = UploadManager(str(tmp_path))
+    frame = begin_frame(data)
+    frame['upload_id'] = upload_id(b'other')
+    manager.begin(frame)
+    chunk = chunk_frame(data, 0, 100)
+    chunk['upload_id'] = frame['upload_id']
+    manager.chunk(chunk)
+    with pytest.raises(ValueError, match='文件校验失败'):
+        manager.end(frame['upload_id'])
+    assert manager.received(frame['upload_id']) == 0
+    assert not os.listdir(tmp_path)
+
+
+def test_resume_after_reconnect_and_restart(tmp_path):
+    data = os.urandom(1000)
+    manager = UploadManager(str(tmp_path))
+    manager.begin(begin_frame(data), 'c1')
+    manager.chunk(chunk_frame(data, 0, 300))
+    # 重连后客户端ID改变，begin 返回已接收的字节数并更新所有者
+    assert manager.begin(begin_frame(data), 'c2') == 300
+    manager.abandon('c1')
+    assert manager.received(upload_id(data)) == 300
+    # 服务端重启后根据磁盘上的 .part 文件恢复
+    restarted = UploadManager(str(tmp_path))
+    assert restarted.begin(begin_frame(data), 'c3') == 300
+    assert restarted.chunk(chunk_frame(data, 300, 700)) == 1000
+
+
+def test_abandon_removes_the_owners_partial_uploads(tmp_path):
+    data = os.urandom(100)
+    manager = UploadManager(str(tmp_path))
+    manager.begin(begin_frame(data), 'c1')
+    manager.chunk(chunk_frame(data, 0, 50))
+    manager.abandon('c1')
+    assert manager.received(upload_id(data)) == 0
+    assert not os.listdir(tmp_path)
+
+
+def test_limits(tmp_path):
+    manager = UploadManager(str(tmp_path), max_upload_bytes=100, max_active_uploads=2, max_active_bytes=150)
+    with pytest.raises(ValueError, match='upload_id'):
+        manager.begin({'upload_id': '../etc/passwd', 'size': 1})
+    with pytest.raises(ValueError, match='过大'):
+        manager.begin(begin_frame(os.urandom(101)))
+    manager.begin(begin_frame(os.urandom(100)))
+    with pytest.raises(ValueError, match='总大小'):
+        manager.begin(begin_frame(os.urandom(60)))
+    manager.begin(begin_frame(os.urandom(50)))
+    with pytest.raises(ValueError, match='过多'):
+        manager.begin(begin_frame(os.urandom(1)))
@@ -0,0 +1,109 @@
+import asyncio
+import random
+
+from astrbot.api.platform import AstrBotMessage, MessageMember
+from astrbot.api.message_components import Plain
+from astrbot import logger
+
+
+class ChatBatcher:
+    """
+    直播弹幕高峰时把短时间内到达的多条消息合并为一轮 LLM 请求。
+
+    同一客户端同一会话的第一条消息开启 window 秒的窗口，窗口结束时把收集到的消息
+    按 "发送者: 内容" 合并为一条消息提交给 AstrBot。超过 max_size 条时按优先级规则
+    取舍：客户端给出的 priority（如醒目留言）优先，其次是提问，其余随机抽样。
+    合并后回复发往最后一条入选消息的请求（客户端最新的一轮），其余请求收到带
+    merged_into 的 MESSAGE_END，未入选的收到带 dropped 的 MESSAGE_END。
+    """
+
+    def __init__(self, submit, server_getter, window: float = 1.5, max_size: int = 8):
+        # submit(AstrBotMessage) 把消息提交给 AstrBot
+        self._submit = submit
+        self._server_getter = server_getter
+        self.window = window
+        self.max_size = max_size
+        # (client_id, session_id) -> 窗口内收集的消息
+        self._pending = {}
+        # 窗口到期的合并提交、被挤出消息的结束通知
+        self._tasks = set()
+
+    def add(self, message: AstrBotMessage):
+        key = (message.raw_message.get('client_id'), message.session_id)
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = []
+            asyncio.get_running_loop().call_later(self.window, self._flush_later, key)
+        batch.append(message)
+        # 窗口内最多保留 max_size 的若干倍，超出时挤出优先级最低的消息中最早的一条
+        if len(batch) > self.max_size * 4:
+            victim = min(batch, key=lambda m: m.raw_message.get('priority') or 0)
+            batch.remove(victim)
+            self._spawn(self._end(victim, {'dropped': True}))
+
+    def _flush_later(self, key):
+        self._spawn(self.flush(key))
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self, key):
+        batch = self._pending.pop(key, None)
+        if not batch:
+            return
+        if len(batch) == 1:
+            await self._submit(batch[0])
+            return
+        selected = self.select(batch)
+        primary = selected[-1]
+        logger.info(f'[ChatBatcher] 合并 {len(batch)} 条消息中的 {len(selected)} 条为一轮请求')
+        await self._submit(self.merge(selected))
+        chosen = set(map(id, selected))
+        for message in batch:
+            if message is primary:
+                continue
+            if id(message) in chosen:
+                await self._end(message, {'merged_into': primary.raw_message.get('request_id')})
+            else:
+                await self._end(message, {'dropped': True})
+
+    def select(self, batch: list) -> list:
+        """超过 max_size 时按优先级规则选取消息，保持到达顺序"""
+        if len(batch) <= self.max_size:
+            return batch
+        ranked = sorted(batch, key=lambda m: (
+            -(m.raw_message.get('priority') or 0),
+            not any(mark in c.text for c in m.message if isinstance(c, Plain) for mark in ('?', '？')),
+            random.random(),
+        ))
+        chosen = set(map(id, ranked[:self.max_size]))
+        return [message for message in batch if id(message) in chosen]
+
+    @staticmethod
+    def merge(messages: list) -> AstrBotMessage:
+        """把多条消息合并为一条，文本前加上发送者昵称，保留图片等其它组件"""
+        primary = messages[-1]
+        merged = AstrBotMessage()
+        merged.type = primary.type
+        merged.self_id = primary.self_id
+        merged.session_id = primary.session_id
+        merged.message_id = primary.message_id
+        merged.sender = MessageMember(user_id=primary.sender.user_id, nickname=primary.sender.nickname)
+        merged.message = []
+        lines = []
+        for message in messages:
+            texts = [c.text for c in message.message if isinstance(c, Plain)]
+            line = f'{message.sender.nickname}: {" ".join(texts)}'
+            lines.append(line)
+            merged.message.append(Plain(text=line + '\n'))
+            merged.message.extend(c for c in message.message if not isinstance(c, Plain))
+        merged.message_str = '\n'.join(lines)
+        merged.raw_message = dict(primary.raw_message, batched=[m.raw_message.get('request_id') for m in messages])
+        return merged
+
+    async def _end(self, message: AstrBotMessage, fields: dict):
+        server = self._server_getter()
+        if server is not None:
+            await server.send_end(message.raw_message.get('client_id'), message.raw_message.get('request_id'), **fields)
@@ -0,0 +1,69 @@
+import asyncio
+import re
+
+# 句子边界：中英文句末标点、换行，以及后接空白或位于末尾的英文句点（避免拆开小数）
+_SENTENCE_END = re.compile(r'[。！？!?…\n]|\.(?:\s|$)')
+# 分句边界：中英文逗号、分号（英文逗号同样需后接空白或位于末尾，避免拆开千分位数字）
+_CLAUSE_END = re.compile(r'[，、；;]|,(?:\s|$)')
+
+
+class TextCoalescer:
+    """
+    合并同一轮回复中连续的小 text 帧。
+
+    消息链中的多个 Plain 组件、流式回复的逐 token 增量先写入缓冲区，出现句子边界、
+    缓冲超过 max_bytes 或距第一段缓冲超过 window 秒时合并为一帧发送。
+    客户端按句子切分后合成语音，句末立即发送，首句延迟不受影响；客户端开启
+    faster_first_response 时遇到第一个逗号即开始合成，因此回复的第一帧在分句边界就发送。
+    发送图片或结束消息前必须先 flush，保证帧的先后顺序。
+    """
+
+    __slots__ = ('server', 'to', 'request_id', 'window', 'max_bytes', '_parts', '_size', '_timer', '_flush_task',
+                 'frames')
+
+    def __init__(self, server, to: str, request_id: str = None, window: float = 0.05, max_bytes: int = 4096):
+        self.server = server
+        self.to = to
+        self.request_id = request_id
+        self.window = window
+        self.max_bytes = max_bytes
+        self._parts = []
+        self._size = 0
+        self._timer = None
+        # 窗口到期时发起的发送任务
+        self._flush_task = None
+        # 实际发出的 text 帧数
+        self.frames = 0
+
+    async def add(self, text: str):
+        if not text:
+            return
+        self._parts.append(text)
+        self._size += len(text.encode('utf-8'))
+        if (self.window <= 0 or self._size >= self.max_bytes or _SENTENCE_END.search(text)
+                or (self.frames == 0 and _CLAUSE_END.search(text))):
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._expire)
+
+    def _expire(self):
+        self._timer = None
+        self._flush_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        """立即发送缓冲的文本；窗口到期的发送仍在进行时先等待其完成"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        task = self._flush_task
+        if task is not None and task is not asyncio.current_task():
+            self._flush_task = None
+            await task
+        if not self._parts:
+            return
+        # 取出缓冲与入队发送之间没有 await，先取出的文本一定先入队
+        text = ''.join(self._parts)
+        self._parts = []
+        self._size = 0
+        self.frames += 1
+        await self.server.send_text(to=self.to, message=text, request_id=self.request_id)
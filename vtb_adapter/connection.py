@@ -0,0 +1,17 @@
+class ClientConnection:
+    """
+    单个客户端连接的状态。
+
+    一个 AstrBot 可能同时连接上万个观众端，这里用 __slots__ 保持每个连接的
+    Python 对象开销固定且较小，代替分散在多个 set/dict 中的引用。
+    """
+
+    __slots__ = ('client_id', 'websocket', 'outbound', 'capabilities')
+
+    def __init__(self, client_id: str, websocket):
+        self.client_id = client_id
+        self.websocket = websocket
+        # 出站调度器（OutboundScheduler），由 MessageServer 在注册连接时创建
+        self.outbound = None
+        # 客户端 hello 帧声明的图片能力配置（见 image_variants.capability_profile），未声明时为 None
+        self.capabilities = None
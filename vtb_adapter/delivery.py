@@ -0,0 +1,47 @@
+import json
+from collections import deque
+
+
+class DeliverySession:
+    """
+    单个客户端（按 client_key 区分，跨重连保持不变）的出站投递状态。
+
+    每个发往客户端的帧都带上递增的 seq 并保存在有界的重放缓冲区中，
+    客户端重连后发送 resume(last_seq)，服务端补发之后的帧；客户端 ack 后释放缓冲。
+    """
+
+    __slots__ = ('seq', 'buffer', 'buffer_bytes', 'max_frames', 'max_bytes', 'expire_handle')
+
+    def __init__(self, max_frames: int = 256, max_bytes: int = 8 * 1024 * 1024):
+        self.seq = 0
+        self.buffer = deque()  # (seq, 已序列化的帧)
+        self.buffer_bytes = 0
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        # 客户端断开后的过期定时器
+        self.expire_handle = None
+
+    def stamp(self, frame: dict) -> str:
+        """为帧分配序号并放入重放缓冲区，返回序列化后的文本"""
+        self.seq += 1
+        frame['seq'] = self.seq
+        text = json.dumps(frame)
+        self.buffer.append((self.seq, text))
+        self.buffer_bytes += len(text)
+        while len(self.buffer) > self.max_frames or self.buffer_bytes > self.max_bytes:
+            _, dropped = self.buffer.popleft()
+            self.buffer_bytes -= len(dropped)
+        return text
+
+    def ack(self, seq: int):
+        """释放客户端已确认的帧"""
+        while self.buffer and self.buffer[0][0] <= seq:
+            _, text = self.buffer.popleft()
+            self.buffer_bytes -= len(text)
+
+    def replay_after(self, seq: int):
+        """返回 seq 之后的帧；缓冲区已丢弃了部分需要的帧时返回 None"""
+        self.ack(seq)
+        if seq < self.seq and (not self.buffer or self.buffer[0][0] > seq + 1):
+            return None
+        return [text for _, text in self.buffer]
@@ -0,0 +1,139 @@
+import asyncio
+import os
+from collections import OrderedDict
+
+from astrbot import logger
+
+try:
+    from PIL import Image as PILImage, features as pil_features
+except ImportError:  # 未安装 Pillow 时始终发送原图
+    PILImage = None
+
+# 客户端声明的格式名 -> (Pillow 格式名, 扩展名)
+_FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'png': ('PNG', 'png'),
+    'jpeg': ('JPEG', 'jpg'),
+    'jpg': ('JPEG', 'jpg'),
+    'gif': ('GIF', 'gif'),
+}
+
+
+def _dimension(value) -> int:
+    """解析客户端声明的最大边长，格式不正确或非正数时视为未声明"""
+    try:
+        return max(int(value or 0), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def capability_profile(capabilities: dict):
+    """
+    把客户端 hello 帧中的图片能力归一化为可哈希的配置 (max_width, max_height, formats)。
+    未声明任何限制时返回 None，表示按原图发送；格式不正确的项忽略
+    """
+    if not isinstance(capabilities, dict):
+        return None
+    image = capabilities.get('image')
+    if not isinstance(image, dict):
+        return None
+    max_width = _dimension(image.get('max_width'))
+    max_height = _dimension(image.get('max_height'))
+    formats = image.get('formats')
+    if not isinstance(formats, (list, tuple)):
+        formats = ()
+    formats = tuple(f.lower() for f in formats if isinstance(f, str) and f.lower() in _FORMATS)
+    if not (max_width or max_height or formats):
+        return None
+    return max_width, max_height, formats
+
+
+class ImageVariants:
+    """
+    按客户端能力缩放、转码出站图片。
+
+    图片超过客户端声明的最大尺寸时等比缩小，格式不在客户端支持列表中（或需要重新编码）时
+    转为列表中 Pillow 可写出的第一种格式（如 WebP）。生成的文件以 (原图哈希, 能力配置)
+    为键缓存在磁盘上，同一配置的客户端共用；超过 max_entries 时按 LRU 删除。
+    Pillow 未安装、动图或处理失败时返回原图。
+    """
+
+    def __init__(self, cache_dir: str = 'temp_uploads/variants', max_entries: int = 256, quality: int = 85):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.quality = quality
+        # (原图哈希, 配置) -> 生成中或已生成的路径（future）
+        self._variants = OrderedDict()
+
+    async def variant_for(self, image_path: str, image_hash: str, profile) -> str:
+        """返回适合该能力配置的图片路径，无需处理时返回原图路径"""
+        if profile is None or PILImage is None:
+            return image_path
+        key = (image_hash, profile)
+        future = self._variants.get(key)
+        if future is not None and future.done() and not os.path.exists(future.result()):
+            future = None
+        if future is None:
+            # 同一图片的并发请求共用一次转换
+            future = asyncio.ensure_future(asyncio.to_thread(self._render, image_path, image_hash, profile))
+            self._variants[key] = future
+            self._evict()
+        self._variants.move_to_end(key)
+        return await asyncio.shield(future)
+
+    def _evict(self):
+        while len(self._variants) > self.max_entries:
+            _, future = self._variants.popitem(last=False)
+            if future.done() and not future.exception():
+                path = future.result()
+                if path.startswith(self.cache_dir):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    def _target_format(self, source_format: str, formats: tuple, resized: bool):
+        """
+        选择输出格式：缩放后需要重新编码时取支持列表中第一个可写出的格式（列表按偏好排序）；
+        不缩放且客户端支持原格式时保持不变
+        """
+        source = (source_format or '').lower()
+        if not formats or (source in formats and not resized):
+            return _FORMATS.get(source, (source_format, source))
+        for name in formats:
+            if name != 'webp' or pil_features.check('webp'):
+                return _FORMATS[name]
+        return None
+
+    def _render(self, image_path: str, image_hash: str, profile) -> str:
+        max_width, max_height, formats = profile
+        try:
+            with PILImage.open(image_path) as image:
+                if getattr(image, 'n_frames', 1) > 1:
+                    return image_path
+                width, height = image.size
+                scale = min(max_width / width if max_width else 1, max_height / height if max_height else 1, 1)
+                target = self._target_format(image.format, formats, scale < 1)
+                if target is None:
+                    return image_path
+                if scale == 1 and target[0] == image.format:
+                    return image_path
+                os.makedirs(self.cache_dir, exist_ok=True)
+                path = os.path.join(self.cache_dir,
+                                    f'{image_hash}-{max_width}x{max_height}.{target[1]}')
+                if os.path.exists(path):
+                    return path
+                if scale < 1:
+                    image = image.resize((max(int(width * scale), 1), max(int(height * scale), 1)),
+                                         PILImage.LANCZOS)
+                if target[0] == 'JPEG' and image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                # 先写临时文件再改名，避免并发读取到写了一半的文件
+                temp_path = path + '.tmp'
+                image.save(temp_path, target[0], quality=self.quality)
+                os.replace(temp_path, path)
+        except Exception as e:
+            logger.info(f'[ImageVariants] 处理图片失败，发送原图: {image_path}: {e}')
+            return image_path
+        logger.info(f'[ImageVariants] 已生成 {os.path.basename(path)}（{width}x{height} -> {image.size[0]}x{image.size[1]}）')
+        return path
@@ -0,0 +1,191 @@
+import asyncio
+import heapq
+import json
+import time
+from collections import deque
+
+# 出站帧的优先级类别，数值越小越先发送
+CONTROL, TEXT, AUDIO, IMAGE = range(4)
+PRIORITY_NAMES = ('control', 'text', 'audio', 'image')
+
+
+def classify(frame: dict) -> int:
+    """按帧类型划分优先级类别，未列出的类型（MESSAGE_COMMIT、MESSAGE_END、握手等）都视为控制帧"""
+    frame_type = frame.get('type')
+    if frame_type in ('text', 'message'):
+        return TEXT
+    if frame_type == 'audio':
+        return AUDIO
+    if frame_type == 'image':
+        return IMAGE
+    return CONTROL
+
+
+class OutboundStats:
+    """各优先级类别的发送延迟统计（从入队到最后一个分片写出），所有连接共享"""
+
+    def __init__(self, window: int = 1024):
+        self.counts = [0] * len(PRIORITY_NAMES)
+        self.samples = [deque(maxlen=window) for _ in PRIORITY_NAMES]
+
+    def record(self, priority: int, seconds: float):
+        self.counts[priority] += 1
+        self.samples[priority].append(seconds)
+
+    def summary(self) -> dict:
+        """返回每个类别的发送次数以及最近窗口内的 p50/p99/max 延迟（毫秒）"""
+        result = {}
+        for priority, name in enumerate(PRIORITY_NAMES):
+            samples = sorted(self.samples[priority])
+            if not samples:
+                result[name] = {'count': self.counts[priority]}
+                continue
+            result[name] = {
+                'count': self.counts[priority],
+                'p50_ms': samples[len(samples) // 2] * 1000,
+                'p99_ms': samples[min(int(len(samples) * 0.99), len(samples) - 1)] * 1000,
+                'max_ms': samples[-1] * 1000,
+            }
+        return result
+
+
+class _Outgoing:
+    __slots__ = ('priority', 'payload', 'request_id', 'future', 'queued_at', 'pieces', 'next_piece')
+
+    def __init__(self, priority: int, payload, request_id, future):
+        self.priority = priority
+        self.payload = payload  # 待编号的 dict，或已序列化的文本（续传补发）
+        self.request_id = request_id
+        self.future = future
+        self.queued_at = time.monotonic()
+        self.pieces = None
+        self.next_piece = 0
+
+
+class OutboundScheduler:
+    """
+    单个连接的出站调度器。
+
+    帧按优先级类别（控制 > 文本 > 音频 > 图片）排队，超过 fragment_size 的帧拆成
+    fragment 分片逐片发送，分片之间可以插入更高优先级的帧，避免大图片阻塞控制帧。
+    同一 request_id 的帧保持入队顺序（后入队的帧不会超过前面的帧），
+    续传序号在真正发送时才分配，因此线上的 seq 始终递增。
+    写出任务只在有待发送的帧时存在，空闲连接不占用额外的任务。
+    """
+
+    __slots__ = ('server', 'connection', 'fragment_size', '_heap', '_order', '_requests', '_task', '_current', '_fragment_id')
+
+    def __init__(self, server, connection, fragment_size: int = 64 * 1024):
+        self.server = server
+        self.connection = connection
+        self.fragment_size = fragment_size
+        self._heap = []  # (有效优先级, 入队序号, _Outgoing)
+        self._order = 0
+        # request_id -> [待发送帧数, 其中最低的有效优先级]
+        self._requests = {}
+        self._task = None
+        self._current = None  # 正在写出的帧
+        self._fragment_id = 0
+
+    def put(self, payload, request_id: str = None, priority: int = None) -> asyncio.Future:
+        """帧入队，返回在帧完整写出后完成的 future"""
+        if priority is None:
+            priority = classify(payload)
+        future = asyncio.get_running_loop().create_future()
+        item = _Outgoing(priority, payload, request_id, future)
+        effective = priority
+        if request_id is not None:
+            pending = self._requests.get(request_id)
+            if pending is None:
+                self._requests[request_id] = [1, priority]
+            else:
+                # 不能越过同一请求中更早入队的帧
+                effective = max(priority, pending[1])
+                pending[0] += 1
+                pending[1] = effective
+        self._order += 1
+        heapq.heappush(self._heap, (effective, self._order, item))
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return future
+
+    async def send(self, payload, request_id: str = None, priority: int = None):
+        await self.put(payload, request_id, priority)
+
+    def _encode(self, item: _Outgoing):
+        text = item.payload
+        if not isinstance(text, str):
+            text = self.server.encode_frame(self.connection.client_id, text)
+        if not self.fragment_size or len(text) <= self.fragment_size:
+            item.pieces = [text]
+            return
+        self._fragment_id += 1
+        count = -(-len(text) // self.fragment_size)
+        item.pieces = [json.dumps({
+            'type': 'fragment',
+            'id': self._fragment_id,
+            'index': index,
+            'count': count,
+            'data': text[index * self.fragment_size:(index + 1) * self.fragment_size]
+        }) for index in range(count)]
+
+    def _finish(self, item: _Outgoing):
+        if item.request_id is not None:
+            pending = self._requests[item.request_id]
+            pending[0] -= 1
+            if pending[0] == 0:
+                del self._requests[item.request_id]
+
+    async def _run(self):
+        try:
+            while self._heap:
+                entry = heapq.heappop(self._heap)
+                item = self._current = entry[2]
+                try:
+                    if item.pieces is None:
+                        self._encode(item)
+                    await self.server.write(self.connection, item.pieces[item.next_piece])
+                except Exception as e:
+                    self._finish(item)
+                    if not item.future.done():
+                        item.future.set_exception(e)
+                    continue
+                item.next_piece += 1
+                if item.next_piece < len(item.pieces):
+                    # 剩余分片重新入队，让期间到达的更高优先级帧先发送；
+                    # 写缓冲未满时 send 不会让出事件循环，这里主动让出一次
+                    heapq.heappush(self._heap, entry)
+                    await asyncio.sleep(0)
+                    continue
+                self._finish(item)
+                self.server.outbound_stats.record(item.priority, time.monotonic() - item.queued_at)
+                if not item.future.done():
+                    item.future.set_result(None)
+        finally:
+            self._task = None
+            self._current = None
+
+    def close(self):
+        """
+        连接断开：停止写出。尚未开始发送的帧编号后进入续传缓冲区，重连后补发；
+        不支持续传的客户端则通知发送方连接已断开
+        """
+        # 按出队顺序编号：正在发送的帧最先出队，其余按 (优先级, 入队顺序) 排序而不是堆数组顺序，
+        # 否则重连补发时 MESSAGE_END 可能排在同一回复的 text 之前
+        items = [self._current] if self._current is not None else []
+        items += [entry[2] for entry in sorted(self._heap)]
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        resumable = self.connection.client_id in self.server.deliveries
+        for item in items:
+            if item.future.done():
+                continue
+            if resumable:
+                if item.pieces is None and not isinstance(item.payload, str):
+                    self.server.encode_frame(self.connection.client_id, item.payload)
+                item.future.set_result(None)
+            else:
+                item.future.set_exception(ConnectionError('客户端已断开连接'))
+        self._heap.clear()
+        self._requests.clear()
@@ -0,0 +1,36 @@
+import gzip
+import json
+import os
+import time
+
+
+class FrameRecorder:
+    """
+    把收发的每一帧写入 gzip 压缩的 JSONL 抓包文件，用于离线复现性能问题。
+    每行格式：{"t": 相对开始的秒数, "ts": 时间戳, "dir": "in"/"out", "conn": 客户端ID, "data": 原始帧}
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+        self._start = time.monotonic()
+
+    def record(self, direction: str, conn: str, data: str):
+        self._file.write(json.dumps({
+            't': round(time.monotonic() - self._start, 6),
+            'ts': time.time(),
+            'dir': direction,
+            'conn': conn,
+            'data': data
+        }, ensure_ascii=False) + '\n')
+
+    def close(self):
+        self._file.close()
+
+
+def load_capture(path: str) -> list:
+    """读取抓包文件，返回按时间排序的记录列表"""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted(records, key=lambda r: r['t'])
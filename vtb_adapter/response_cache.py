@@ -0,0 +1,93 @@
+import difflib
+import re
+import time
+from collections import OrderedDict
+
+from astrbot import logger
+
+# 归一化时去掉的标点和空白（中英文），"你好！" 与 "你好~" 视为同一问题
+_PUNCTUATION = re.compile(r'[\s\.,!?;:~\-_"\'`()\[\]{}<>，。！？；：、～…“”‘’（）【】《》「」]+')
+
+
+class ResponseCache:
+    """
+    直播间重复提问的回复缓存。
+
+    以 (人格, 归一化后的消息文本) 为键保存一轮回复的帧（text 帧，含表情标签），
+    命中时直接按原样回放，不再调用 LLM。精确匹配未命中时，在同一人格的条目中
+    用 difflib 找相似度不低于 similarity 的问题。条目超过 ttl 秒过期，超出 max_entries 时按 LRU 淘汰。
+    """
+
+    def __init__(self, ttl: float = 600, max_entries: int = 512, similarity: float = 0.9,
+                 max_text_length: int = 200):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity = similarity
+        # 只缓存短消息，长消息几乎不会重复，相似度比较也更昂贵
+        self.max_text_length = max_text_length
+        # (persona, text) -> (过期时间, 回复帧列表)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return _PUNCTUATION.sub(' ', text.lower()).strip()
+
+    def cacheable(self, text: str) -> bool:
+        return 0 < len(text) <= self.max_text_length
+
+    def lookup(self, persona: str, text: str):
+        """返回缓存的回复帧，未命中返回 None"""
+        text = self.normalize(text)
+        now = time.monotonic()
+        key = (persona, text)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= now:
+            del self._entries[key]
+            entry = None
+        if entry is None and self.similarity < 1:
+            key = self._closest(persona, text, now)
+            entry = self._entries.get(key) if key else None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        logger.info(f'[ResponseCache] 命中 "{key[1]}"，命中率 {self.hit_rate:.1%}')
+        return entry[1]
+
+    def _closest(self, persona: str, text: str, now: float):
+        best, best_ratio = None, self.similarity
+        matcher = difflib.SequenceMatcher(None, b=text)
+        for key, (expires_at, _) in self._entries.items():
+            if key[0] != persona or expires_at <= now:
+                continue
+            # 先用长度和字符集的上界快速排除，再计算真实相似度
+            matcher.set_seq1(key[1])
+            if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = key, ratio
+        return best
+
+    def store(self, persona: str, text: str, frames: list):
+        key = (persona, self.normalize(text))
+        self._entries[key] = (time.monotonic() + self.ttl, frames)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'entries': len(self._entries),
+        }
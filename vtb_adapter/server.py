@@ -2,116 +2,631 @@ import asyncio
 import json
 import websockets
 import base64
+import hashlib
 import os
+import socket
+import uuid
+from collections import OrderedDict
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
 from astrbot.api.platform import AstrBotMessage
 from astrbot import logger
+from .connection import ClientConnection
+from .delivery import DeliverySession
+from .image_variants import ImageVariants, capability_profile
+from .outbound import CONTROL, OutboundScheduler, OutboundStats
+from .upload import UploadManager
+
+# 正在监听的服务器，按 (host, port) 索引。适配器重新加载时若监听地址不变则复用，
+# 已建立的连接和进行中的回复不受影响
+running_servers = {}
+
+
 class MessageServer:
-    def __init__(self, host: str = '0.0.0.0', port: int = 8080, adapter=None, on_received=None):
+    # 客户端发来的控制帧类型，交给 on_control 处理，不回复 MESSAGE_COMMIT
+    CONTROL_TYPES = ('session_open', 'session_close', 'tools_register', 'speculative_commit')
+    # 分块上传帧类型，由 UploadManager 处理
+    UPLOAD_TYPES = ('upload_begin', 'upload_chunk', 'upload_end')
+    # 需要重新监听才能生效的设置，热重载时忽略
+    LISTENER_SETTINGS = ('host', 'port', 'socket_path', 'max_queue', 'compression')
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 8080, adapter=None, on_received=None,
+                 image_offer_timeout: float = 3.0, on_control=None, tool_call_timeout: float = 60.0,
+                 upload_dir: str = 'temp_uploads', replay_buffer_frames: int = 256,
+                 replay_buffer_bytes: int = 8 * 1024 * 1024, resume_timeout: float = 300.0,
+                 recorder=None, max_frame_size: int = 4 * 1024 * 1024, max_queue: int = 8,
+                 write_limit_high: int = 64 * 1024, write_limit_low: int = 16 * 1024,
+                 compression: bool = True, fragment_size: int = 64 * 1024, drain_timeout: float = 30.0,
+                 socket_path: str = None, image_hash_cache_size: int = 1024, on_client_expired=None):
         self.host = host
         self.port = port
-        self.clients = set()
+        # 设置后改为监听该 Unix 套接字（与客户端同机部署时绕过 TCP 回环），不再监听 host:port
+        self.socket_path = socket_path
         self.adapter = adapter  # 保存适配器引用
         self.on_received = on_received  # 消息接收回调函数
-        # 存储客户端ID与websocket的映射关系
-        self.client_websockets = {}
-        # 存储websocket与客户端ID的映射关系
-        self.websocket_client = None
+        self.on_control = on_control  # 控制帧回调函数
+        self.on_client_expired = on_client_expired  # 客户端断开且不再续传时的回调函数
+        # 客户端ID -> ClientConnection
+        self.connections = {}
+        # 每个连接的资源上限：单帧大小、接收队列深度（帧数）、发送缓冲高/低水位（字节）
+        self.max_frame_size = max_frame_size
+        self.max_queue = max_queue
+        self.write_limit_high = write_limit_high
+        self.write_limit_low = write_limit_low
+        # permessage-deflate 的 zlib 上下文是空闲连接内存的大头，启用时使用较小的窗口和 memLevel
+        self.compression = compression
+        # 图片去重握手：等待客户端回复 have/need 的 future，键为 (client_id, hash)
+        self.image_offer_timeout = image_offer_timeout
+        self._pending_offers = {}
+        # 进行中的图片传输，键为 (client_id, hash)，值为 (发起传输的 request_id, 传输结束时完成的 future，结果为是否成功)
+        self._image_transfers = {}
+        # 图片哈希缓存：路径 -> (mtime, size, hash)，避免重复读取文件；超过上限时按 LRU 淘汰
+        self.image_hash_cache_size = image_hash_cache_size
+        self._image_hashes = OrderedDict()
+        # 工具调用：等待客户端回复 tool_result 的 future，键为 (client_id, call_id)
+        self.tool_call_timeout = tool_call_timeout
+        self._pending_tool_calls = {}
+        # 大图片和附件的分块上传
+        self.uploads = UploadManager(upload_dir)
+        # 按客户端能力缩放、转码后的出站图片
+        self.images = ImageVariants(os.path.join(upload_dir, 'variants'))
+        # 可续传的出站投递：client_key -> DeliverySession，客户端断开 resume_timeout 秒后释放
+        self.deliveries = {}
+        self.replay_buffer_frames = replay_buffer_frames
+        self.replay_buffer_bytes = replay_buffer_bytes
+        self.resume_timeout = resume_timeout
+        # 可选的抓包记录器（FrameRecorder）
+        self.recorder = recorder
+        # 出站调度：超过 fragment_size 的帧分片发送；各优先级类别的发送延迟统计
+        self.fragment_size = fragment_size
+        self.outbound_stats = OutboundStats()
+        # 排空：停止接受新连接和新请求，等待进行中的回复发完后通知客户端重连
+        self.draining = False
+        self.drain_timeout = drain_timeout
+        self._server = None
+        self._release_handle = None
+        self._drain_task = None
+        # 进行中的请求 (client_id, request_id)，收到 MESSAGE_END 时移除；从未回复的请求按数量淘汰
+        self._active_requests = OrderedDict()
+        self._requests_idle = asyncio.Event()
+        self._requests_idle.set()
+
+    @property
+    def address(self) -> tuple:
+        """监听地址，也是 running_servers 的键：(host, port)，监听 Unix 套接字时为 ('unix', 路径)"""
+        return ('unix', self.socket_path) if self.socket_path else (self.host, self.port)
+
+    async def send_frame(self, to: str, frame: dict, request_id: str = None):
+        """
+        向指定客户端发送一帧 JSON 消息。
+        带上请求的 request_id，客户端据此把响应分发给对应的请求，同一连接上可并行多个请求。
+        """
+        if request_id is not None:
+            frame['request_id'] = request_id
+        connection = self.connections.get(to)
+        if connection is None:
+            # 支持续传的客户端暂时断开：帧放入重放缓冲区，重连后补发
+            if to not in self.deliveries:
+                raise KeyError(to)
+            self.encode_frame(to, frame)
+            return
+        # 经出站调度器按优先级发送，大帧分片，避免阻塞控制帧
+        await connection.outbound.send(frame, request_id)
+
+    def encode_frame(self, to: str, frame: dict) -> str:
+        """序列化一帧；支持续传的客户端在此分配序号并放入重放缓冲区"""
+        delivery = self.deliveries.get(to)
+        return delivery.stamp(frame) if delivery else json.dumps(frame)
+
+    async def write(self, connection: ClientConnection, text: str):
+        """由出站调度器调用，实际写出一帧"""
+        await self._send_raw(connection.websocket, connection.client_id, text)
 
-    async def send_text(self, to: str, message: str):
+    async def _send_raw(self, websocket, to: str, text: str):
+        if self.recorder:
+            self.recorder.record('out', to, text)
+        await websocket.send(text)
+
+    def has_client(self, to: str) -> bool:
+        """客户端已连接，或断开后仍可续传"""
+        return to in self.connections or to in self.deliveries
+
+    async def resume(self, websocket, client_id: str, data: dict) -> str:
+        """
+        处理客户端的 resume 握手：改用客户端提供的 client_key 作为客户端ID，
+        并补发 last_seq 之后的帧。返回新的客户端ID
+        """
+        key = data['client_key']
+        connection = self.connections.pop(client_id)
+        connection.client_id = key
+        self.connections[key] = connection
+
+        delivery = self.deliveries.get(key)
+        if delivery is None:
+            delivery = self.deliveries[key] = DeliverySession(self.replay_buffer_frames, self.replay_buffer_bytes)
+        if delivery.expire_handle is not None:
+            delivery.expire_handle.cancel()
+            delivery.expire_handle = None
+
+        replay = delivery.replay_after(data.get('last_seq', 0))
+        # 补发的帧已有序号，按原顺序以控制帧优先级排在所有新帧之前
+        sent = [connection.outbound.put(json.dumps({
+            'type': 'resume_ok',
+            'seq': delivery.seq,
+            'replayed': len(replay or []),
+            'gap': replay is None
+        }), priority=CONTROL)]
+        sent.extend(connection.outbound.put(text, priority=CONTROL) for text in replay or [])
+        await asyncio.gather(*sent)
+        logger.info(f'[MessageServer] 客户端 {key} 续传，补发 {len(replay or [])} 帧')
+        return key
+
+    def _expire_delivery(self, key: str):
+        if key not in self.connections:
+            self.deliveries.pop(key, None)
+            self._release_client(key)
+
+    def _release_client(self, client_id: str):
+        """释放不再续传的客户端的资源"""
+        self.uploads.abandon(client_id)
+        if self.on_client_expired:
+            self.on_client_expired(client_id)
+
+    async def send_text(self, to: str, message: str, request_id: str = None):
         """向指定客户端发送文本消息"""
-        if to in self.client_websockets:
-            websocket = self.client_websockets[to]
+        if self.has_client(to):
             try:
-                await websocket.send(json.dumps({
+                await self.send_frame(to, {
                     'type': 'text',
                     'content': message
-                }))
+                }, request_id)
                 logger.info(f'[MessageServer] 发送文本到 {to}: {message}')
             except Exception as e:
                 logger.info(f'[MessageServer] 发送文本失败: {e}')
         else:
             logger.info(f'[MessageServer] 未找到客户端: {to}')
 
-    async def send_image(self, to: str, image_path: str):
-        """向指定客户端发送图片消息（base64格式）"""
-        if to in self.client_websockets:
-            websocket = self.client_websockets[to]
+    async def send_end(self, to: str, request_id: str = None, **fields):
+        """通知指定客户端本轮回复结束，fields 为附加字段（如 merged_into、dropped）"""
+        self._finish_request(to, request_id)
+        if self.has_client(to):
+            try:
+                await self.send_frame(to, dict(fields, type='MESSAGE_END'), request_id)
+            except Exception as e:
+                logger.info(f'[MessageServer] 发送结束消息失败: {e}')
+        else:
+            logger.info(f'[MessageServer] 未找到客户端: {to}')
+
+    def image_hash(self, image_path: str) -> str:
+        """计算图片内容的 sha256，按 mtime/size 缓存结果"""
+        stat = os.stat(image_path)
+        cached = self._image_hashes.get(image_path)
+        if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+            self._image_hashes.move_to_end(image_path)
+            return cached[2]
+        h = hashlib.sha256()
+        with open(image_path, 'rb') as f:
+            for block in iter(lambda: f.read(65536), b''):
+                h.update(block)
+        digest = h.hexdigest()
+        self._image_hashes[image_path] = (stat.st_mtime, stat.st_size, digest)
+        self._image_hashes.move_to_end(image_path)
+        if len(self._image_hashes) > self.image_hash_cache_size:
+            self._image_hashes.popitem(last=False)
+        return digest
+
+    @staticmethod
+    def image_mime_type(image_path: str) -> str:
+        """根据扩展名推断图片 MIME 类型"""
+        _, ext = os.path.splitext(image_path)
+        ext = ext.lower()[1:]  # 去掉点号
+        if ext == 'jpg':
+            ext = 'jpeg'
+        return f'image/{ext}'
+
+    async def offer_image(self, to: str, image_path: str, request_id: str = None):
+        """
+        通过哈希握手确保客户端持有该图片，返回图片哈希。
+        先发送 image_offer，客户端回复 image_have 时不再传输图片内容；
+        回复 image_need 或超时未回复（旧版客户端）时发送完整的 base64 图片。
+        客户端在 hello 帧中声明了图片能力时，发送按其尺寸和格式缩放、转码后的版本。
+        """
+        image_hash = self.image_hash(image_path)
+        connection = self.connections.get(to)
+        if connection is not None and connection.capabilities is not None:
+            # 缩放/转码后的图片按自身内容哈希，客户端分别缓存不同尺寸的版本
+            variant_path = await self.images.variant_for(image_path, image_hash, connection.capabilities)
+            if variant_path != image_path:
+                image_path = variant_path
+                image_hash = self.image_hash(image_path)
+        mime_type = self.image_mime_type(image_path)
+
+        # 同一图片同时只有一个传输：其余调用等待其完成。传输属于其它请求时再握手一次，
+        # 客户端此时已缓存该图片，回复 have 即把图片关联到本请求，不会再传一遍
+        key = (to, image_hash)
+        while key in self._image_transfers:
+            owner_request_id, transfer = self._image_transfers[key]
+            if await asyncio.shield(transfer) and owner_request_id == request_id:
+                return image_hash
+
+        transfer = asyncio.get_running_loop().create_future()
+        self._image_transfers[key] = (request_id, transfer)
+        succeeded = False
+        try:
+            await self._transfer_image(to, image_path, image_hash, mime_type, request_id)
+            succeeded = True
+        finally:
+            del self._image_transfers[key]
+            transfer.set_result(succeeded)
+        return image_hash
+
+    async def _transfer_image(self, to: str, image_path: str, image_hash: str, mime_type: str, request_id: str):
+        key = (to, image_hash)
+        future = self._pending_offers[key] = asyncio.get_running_loop().create_future()
+        try:
+            await self.send_frame(to, {
+                'type': 'image_offer',
+                'hash': image_hash,
+                'mime_type': mime_type,
+                'size': os.path.getsize(image_path)
+            }, request_id)
+            reply = await asyncio.wait_for(asyncio.shield(future), self.image_offer_timeout)
+        except asyncio.TimeoutError:
+            reply = 'need'
+        finally:
+            if self._pending_offers.get(key) is future:
+                del self._pending_offers[key]
+
+        if reply == 'have':
+            logger.info(f'[MessageServer] 客户端 {to} 已缓存图片 {image_hash[:12]}，跳过传输')
+            return
+
+        # 读取图片文件并转换为base64
+        with open(image_path, 'rb') as f:
+            base64_data = base64.b64encode(f.read()).decode('utf-8')
+
+        await self.send_frame(to, {
+            'type': 'image',
+            'hash': image_hash,
+            'data_url': f'data:{mime_type};base64,{base64_data}'
+        }, request_id)
+
+    def resolve_image_offer(self, client_id: str, data: dict):
+        """处理客户端对 image_offer 的 have/need 回复"""
+        future = self._pending_offers.get((client_id, data.get('hash')))
+        if future is not None and not future.done():
+            future.set_result('have' if data['type'] == 'image_have' else 'need')
+
+    async def send_image(self, to: str, image_path: str, request_id: str = None):
+        """向指定客户端发送图片消息（先哈希握手，仅在客户端未缓存时发送base64）"""
+        if self.has_client(to):
             try:
                 # 检查文件是否存在
                 if not os.path.exists(image_path):
                     logger.info(f'[MessageServer] 图片文件不存在: {image_path}')
                     return
 
-                # 读取图片文件并转换为base64
-                with open(image_path, 'rb') as f:
-                    image_data = f.read()
-                    base64_data = base64.b64encode(image_data).decode('utf-8')
-
-                # 获取图片扩展名
-                _, ext = os.path.splitext(image_path)
-                ext = ext.lower()[1:]  # 去掉点号
-                if ext == 'jpg':
-                    ext = 'jpeg'
-
-                # 构建data URL
-                data_url = f'data:image/{ext};base64,{base64_data}'
-
-                await websocket.send(json.dumps({
-                    'type': 'image',
-                    'data_url': data_url
-                }))
-                print(f'[MessageServer] 发送图片到 {to}: {image_path} (已转换为base64)')
+                await self.offer_image(to, image_path, request_id)
+                print(f'[MessageServer] 发送图片到 {to}: {image_path}')
             except Exception as e:
                 print(f'[MessageServer] 发送图片失败: {e}')
         else:
             print(f'[MessageServer] 未找到客户端: {to}')
 
-    async def register(self, websocket):
-        self.clients.add(websocket)
-        # 暂时使用remote_address作为客户端ID
-        client_id = str(websocket.remote_address)
-        self.client_websockets[client_id] = websocket
-        self.websocket_client = websocket
+    async def call_tools(self, to: str, calls: list, request_id: str = None):
+        """
+        请求客户端执行一批工具调用，calls 为 [{'name': ..., 'arguments': {...}}]。
+        客户端并发执行，按完成顺序逐个产出 (call, result)，result 为
+        {'is_error': bool, 'content': str}。
+        """
+        loop = asyncio.get_running_loop()
+        futures = {}
+        frames = []
+        for call in calls:
+            call_id = call.get('call_id') or uuid.uuid4().hex
+            future = loop.create_future()
+            futures[future] = dict(call, call_id=call_id)
+            self._pending_tool_calls[(to, call_id)] = future
+            frames.append({'call_id': call_id, 'name': call['name'], 'arguments': call.get('arguments', {})})
+        try:
+            await self.send_frame(to, {'type': 'tool_calls', 'calls': frames}, request_id)
+            pending = set(futures)
+            deadline = loop.time() + self.tool_call_timeout
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(deadline - loop.time(), 0), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    break
+                for future in done:
+                    yield futures[future], future.result()
+            for future in pending:
+                yield futures[future], {'is_error': True, 'content': '工具调用超时'}
+        finally:
+            for call in futures.values():
+                self._pending_tool_calls.pop((to, call['call_id']), None)
+
+    def resolve_tool_result(self, client_id: str, data: dict):
+        """处理客户端回复的 tool_result"""
+        future = self._pending_tool_calls.get((client_id, data.get('call_id')))
+        if future is not None and not future.done():
+            future.set_result({'is_error': bool(data.get('is_error')), 'content': data.get('content', '')})
+
+    async def handle_upload(self, client_id: str, data: dict):
+        """
+        处理分块上传帧。分块本身不回复，出错的分块直接丢弃；
+        upload_end 时如果文件不完整，回复已接收的字节数，客户端据此续传
+        """
+        upload_id = data.get('upload_id')
+        try:
+            if data['type'] == 'upload_begin':
+                received = self.uploads.begin(data, client_id)
+                await self.send_frame(client_id, {'type': 'upload_ack', 'upload_id': upload_id, 'received': received})
+            elif data['type'] == 'upload_chunk':
+                try:
+                    self.uploads.chunk(data)
+                except ValueError as e:
+                    logger.info(f'[MessageServer] 丢弃分块 {upload_id}#{data.get("index")}: {e}')
+            else:
+                self.uploads.end(upload_id)
+                await self.send_frame(client_id, {'type': 'upload_done', 'upload_id': upload_id})
+        except Exception as e:
+            logger.info(f'[MessageServer] 分块上传出错 {upload_id}: {e}')
+            await self.send_frame(client_id, {
+                'type': 'upload_ack',
+                'upload_id': upload_id,
+                'received': self.uploads.received(upload_id),
+                'error': str(e)
+            })
+
+    async def register(self, websocket) -> ClientConnection:
+        # 客户端发送 resume 之前暂时使用remote_address作为客户端ID；Unix 套接字连接没有对端地址
+        client_id = str(websocket.remote_address) if websocket.remote_address else uuid.uuid4().hex
+        connection = self.connections[client_id] = ClientConnection(client_id, websocket)
+        connection.outbound = OutboundScheduler(self, connection, self.fragment_size)
+        self._apply_limits(connection)
         print(f'新客户端连接: {websocket.remote_address}, 客户端ID: {client_id}')
+        return connection
 
-    async def unregister(self, websocket):
-        self.clients.remove(websocket)
-        if websocket in self.client_websockets:
-            client_id = self.client_websockets[websocket]
-            del self.client_websockets[client_id]
-            self.websocket_client = None
+    async def unregister(self, connection: ClientConnection):
+        websocket = connection.websocket
+        client_id = connection.client_id
+        connection.outbound.close()
+        if self.connections.get(client_id) is connection:
+            del self.connections[client_id]
             print(f'客户端断开连接: {websocket.remote_address}, 客户端ID: {client_id}')
+            delivery = self.deliveries.get(client_id)
+            if delivery is not None:
+                delivery.expire_handle = asyncio.get_running_loop().call_later(
+                    self.resume_timeout, self._expire_delivery, client_id
+                )
+            else:
+                self._release_client(client_id)
         else:
             print(f'客户端断开连接: {websocket.remote_address}')
-
-
+        # 客户端断开后不会再回复握手，直接按 need 结束等待
+        for key, future in list(self._pending_offers.items()):
+            if key[0] == client_id and not future.done():
+                future.set_result('need')
+        for key, future in list(self._pending_tool_calls.items()):
+            if key[0] == client_id and not future.done():
+                future.set_result({'is_error': True, 'content': '客户端已断开连接'})
 
     async def handle_message(self, websocket):
         """处理WebSocket连接和消息"""
-        await self.register(websocket)
+        connection = await self.register(websocket)
+        client_id = connection.client_id
         try:
             async for message in websocket:
-                logger.info(f'[MessageServer] 收到消息: {message}')
+                if self.recorder:
+                    self.recorder.record('in', client_id, message)
                 # 解析消息
                 data = json.loads(message)
+                if data.get('type') == 'resume':
+                    client_id = await self.resume(websocket, client_id, data)
+                    continue
+                if data.get('type') == 'hello':
+                    connection.capabilities = capability_profile(data.get('capabilities'))
+                    logger.info(f'[MessageServer] 客户端 {client_id} 能力: {connection.capabilities}')
+                    continue
+                if data.get('type') == 'ack':
+                    if client_id in self.deliveries:
+                        self.deliveries[client_id].ack(data.get('seq', 0))
+                    continue
+                # 图片握手回复不是对话消息，不提交给适配器也不回复 MESSAGE_COMMIT
+                if data.get('type') in ('image_have', 'image_need'):
+                    self.resolve_image_offer(client_id, data)
+                    continue
+                if data.get('type') == 'tool_result':
+                    self.resolve_tool_result(client_id, data)
+                    continue
+                if data.get('type') in self.UPLOAD_TYPES:
+                    await self.handle_upload(client_id, data)
+                    continue
+                if data.get('type') in self.CONTROL_TYPES:
+                    data['client_id'] = client_id
+                    if self.on_control:
+                        await self.on_control(data)
+                    continue
+                if self.draining:
+                    # 排空期间不再接受新请求，客户端重连后重新发送
+                    await self.send_frame(client_id, {'type': 'MESSAGE_RETRY'}, data.get('request_id'))
+                    continue
+                logger.info(f'[MessageServer] 收到消息: {message}')
                 # 添加客户端ID到数据中，以便后续1对1回复
-                client_id = self.client_websockets.get(websocket, str(websocket.remote_address))
                 data['client_id'] = client_id
+                self._begin_request(client_id, data.get('request_id'))
                 # 调用回调函数处理消息
                 if self.on_received:
                     await self.on_received(data)
                 # 发送响应
                 response = {'status': 'success', 'type': 'MESSAGE_COMMIT'}
-                await websocket.send(json.dumps(response))
+                await self.send_frame(client_id, response, data.get('request_id'))
         finally:
-            await self.unregister(websocket)
+            await self.unregister(connection)
+
+    def _begin_request(self, client_id: str, request_id: str):
+        self._active_requests[(client_id, request_id)] = None
+        while len(self._active_requests) > 1024:
+            self._active_requests.popitem(last=False)
+        self._requests_idle.clear()
+
+    def _finish_request(self, client_id: str, request_id: str):
+        self._active_requests.pop((client_id, request_id), None)
+        if not self._active_requests:
+            self._requests_idle.set()
+
+    def reconfigure(self, **settings):
+        """
+        热重载不涉及监听的设置（超时、缓冲区、分片大小、帧大小和写缓冲水位、抓包等），
+        已建立的连接立即生效，无需重启服务器
+        """
+        for name, value in settings.items():
+            if name in self.LISTENER_SETTINGS:
+                if getattr(self, name) != value:
+                    logger.info(f'[MessageServer] 设置 {name} 需要重启监听才能生效')
+                continue
+            if name == 'recorder':
+                if self.recorder is not None and self.recorder is not value:
+                    self.recorder.close()
+            elif not hasattr(self, name):
+                raise AttributeError(name)
+            setattr(self, name, value)
+        for delivery in self.deliveries.values():
+            delivery.max_frames = self.replay_buffer_frames
+            delivery.max_bytes = self.replay_buffer_bytes
+        for connection in self.connections.values():
+            self._apply_limits(connection)
+        logger.info(f'[MessageServer] 已热重载设置: {", ".join(settings)}')
 
-    async def start(self):
-        logger.info(f'启动消息服务器在 {self.host}:{self.port}')
-        server = await websockets.serve(
-            self.handle_message, self.host, self.port
+    def _apply_limits(self, connection: ClientConnection):
+        """把当前的帧大小、写缓冲水位和分片大小应用到连接上"""
+        connection.outbound.fragment_size = self.fragment_size
+        websocket = connection.websocket
+        protocol = websocket.protocol
+        # websockets 16 起为 max_message_size，14/15 中为 max_size
+        if hasattr(protocol, 'max_message_size'):
+            protocol.max_message_size = self.max_frame_size
+        else:
+            protocol.max_size = self.max_frame_size
+        if websocket.transport is not None:
+            websocket.transport.set_write_buffer_limits(self.write_limit_high, self.write_limit_low)
+
+    def release(self, grace: float = 5.0):
+        """
+        适配器停止使用本服务器。grace 秒内若有新的适配器实例以相同地址启动则由其接管（adopt），
+        否则开始排空
+        """
+        if self.draining or self._release_handle is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._release_handle = loop.call_later(grace, self._start_drain)
+
+    def adopt(self):
+        """新的适配器实例接管本服务器，取消待执行的排空"""
+        if self._release_handle is not None:
+            self._release_handle.cancel()
+            self._release_handle = None
+
+    def _start_drain(self):
+        self._release_handle = None
+        self._drain_task = asyncio.ensure_future(self.drain())
+
+    async def drain(self, timeout: float = None, retry_after: float = 1.0):
+        """
+        排空服务器：立即停止监听（端口可被新服务器使用），拒绝新请求，
+        最多等待 timeout（默认 drain_timeout）秒让进行中的回复发送完毕，然后通知所有客户端重连并关闭连接。
+        超时仍未完成的请求在 reconnect 帧中列出
+        """
+        if self.draining:
+            return
+        if timeout is None:
+            timeout = self.drain_timeout
+        self.draining = True
+        if running_servers.get(self.address) is self:
+            del running_servers[self.address]
+        logger.info(f'[MessageServer] 开始排空，进行中的请求 {len(self._active_requests)} 个')
+        if self._server is not None:
+            self._server.close(close_connections=False)
+            if self.socket_path:
+                # 立即删除套接字文件，新服务器可以马上在同一路径监听
+                try:
+                    os.unlink(self.socket_path)
+                except FileNotFoundError:
+                    pass
+        try:
+            await asyncio.wait_for(self._requests_idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.info(f'[MessageServer] 排空超时，放弃 {len(self._active_requests)} 个请求')
+
+        abandoned = {}
+        for client_id, request_id in self._active_requests:
+            abandoned.setdefault(client_id, []).append(request_id)
+        for client_id, connection in list(self.connections.items()):
+            try:
+                await self.send_frame(client_id, {
+                    'type': 'reconnect',
+                    'retry_after': retry_after,
+                    'abandoned': abandoned.get(client_id, [])
+                })
+                await connection.websocket.close(1001, 'server draining')
+            except Exception as e:
+                logger.info(f'[MessageServer] 通知客户端 {client_id} 重连失败: {e}')
+        if self._server is not None:
+            await self._server.wait_closed()
+        if self.recorder:
+            self.recorder.close()
+        logger.info('[MessageServer] 排空完成')
+
+    async def start(self, bind_attempts: int = 10):
+        where = self.socket_path or f'{self.host}:{self.port}'
+        logger.info(f'启动消息服务器在 {where}')
+        options = dict(
+            max_size=self.max_frame_size,
+            max_queue=self.max_queue,
+            write_limit=(self.write_limit_high, self.write_limit_low),
+            compression=None,
+            extensions=[ServerPerMessageDeflateFactory(
+                server_max_window_bits=11,
+                client_max_window_bits=11,
+                compress_settings={'memLevel': 4},
+            )] if self.compression else None
         )
-        await server.wait_closed()
+        for attempt in range(1, bind_attempts + 1):
+            try:
+                if self.socket_path:
+                    self._remove_stale_socket()
+                    self._server = await websockets.unix_serve(self.handle_message, self.socket_path, **options)
+                else:
+                    self._server = await websockets.serve(self.handle_message, self.host, self.port, **options)
+                break
+            except OSError as e:
+                # 重新加载插件时旧服务器可能仍占用端口，等待其排空并释放监听
+                if attempt == bind_attempts:
+                    raise
+                logger.info(f'[MessageServer] 监听 {where} 失败（{e}），1 秒后重试')
+                await asyncio.sleep(1)
+        running_servers[self.address] = self
+        await self.wait_closed()
+
+    def _remove_stale_socket(self):
+        """删除进程异常退出后遗留的套接字文件；仍有服务在监听时保留，由 bind 报错重试"""
+        if not os.path.exists(self.socket_path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+        except ConnectionRefusedError:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+        finally:
+            probe.close()
+
+    async def wait_closed(self):
+        """等待服务器关闭（排空完成）"""
+        await self._server.wait_closed()
+        if self._drain_task is not None:
+            await self._drain_task
 
 
 async def main():
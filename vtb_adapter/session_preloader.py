@@ -0,0 +1,102 @@
+import asyncio
+from collections import OrderedDict
+
+from astrbot import logger
+
+
+class SessionPreloader:
+    """
+    根据客户端的 session_open/session_close 预热和释放 AstrBot 会话上下文。
+
+    预热会加载当前对话（不存在时新建）并绑定客户端指定的人格，这些数据库读写在客户端
+    打开会话时完成，而不是在第一条消息的处理路径上；消息提交前等待预热完成，
+    避免与 AstrBot 同时新建对话。用户可能随时通过 AstrBot 指令切换对话或人格，
+    因此回复缓存键和群聊预取使用的对话与人格每次由 current() 重新读取，不使用预热时的结果。
+    预热任务最多保留 max_sessions 个，超出时按 LRU 淘汰。
+    """
+
+    def __init__(self, context_getter, max_sessions: int = 1024):
+        # 插件加载后才能拿到 AstrBot 的 Context，因此保存获取函数而不是对象本身
+        self._context_getter = context_getter
+        self.max_sessions = max_sessions
+        # unified_msg_origin -> 预热任务
+        self._sessions = OrderedDict()
+
+    def open(self, umo: str, persona_id: str = None):
+        """开始预热指定会话，重复调用不会重复加载"""
+        task = self._sessions.get(umo)
+        if task is None:
+            task = self._sessions[umo] = asyncio.create_task(self._warm(umo, persona_id))
+            while len(self._sessions) > self.max_sessions:
+                _, evicted = self._sessions.popitem(last=False)
+                evicted.cancel()
+        self._sessions.move_to_end(umo)
+        return task
+
+    def close(self, umo: str):
+        """释放指定会话的预热上下文"""
+        task = self._sessions.pop(umo, None)
+        if task is not None and not task.done():
+            task.cancel()
+
+    async def wait(self, umo: str):
+        """等待会话预热完成，客户端未发送 session_open 时在此预热"""
+        task = self.open(umo)
+        try:
+            await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+
+    async def current(self, umo: str) -> dict:
+        """
+        读取会话当前的对话与人格：{'umo', 'conversation_id', 'persona_id', 'system_prompt'}。
+        人格取对话上绑定的，未绑定时为默认人格
+        """
+        session = {'umo': umo, 'conversation_id': None, 'persona_id': None, 'system_prompt': ''}
+        context = self._context_getter()
+        if context is None:
+            return session
+        try:
+            conv_mgr = context.conversation_manager
+            cid = await conv_mgr.get_curr_conversation_id(umo)
+            if not cid:
+                return session
+            conversation = await conv_mgr.get_conversation(umo, cid)
+            session['conversation_id'] = cid
+            provider_mgr = getattr(context, 'provider_manager', None)
+            personas = getattr(provider_mgr, 'personas', []) or []
+            persona_id = getattr(conversation, 'persona_id', None)
+            persona = next(
+                (p for p in personas if p.get('name') == persona_id),
+                getattr(provider_mgr, 'selected_default_persona', None),
+            )
+            persona_id = persona.get('name') if persona else persona_id
+            # 默认人格可能只记录了名字，提示词从人格列表中取
+            persona = next((p for p in personas if p.get('name') == persona_id), persona)
+            session['persona_id'] = persona_id
+            session['system_prompt'] = (persona or {}).get('prompt', '')
+        except Exception as e:
+            logger.info(f'[SessionPreloader] 读取会话失败 {umo}: {e}')
+        return session
+
+    async def _warm(self, umo: str, persona_id: str = None):
+        context = self._context_getter()
+        if context is None:
+            logger.info(f'[SessionPreloader] 插件上下文不可用，跳过预热: {umo}')
+            return
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            conv_mgr = context.conversation_manager
+            cid = await conv_mgr.get_curr_conversation_id(umo)
+            if not cid:
+                cid = await conv_mgr.new_conversation(umo)
+            conversation = await conv_mgr.get_conversation(umo, cid)
+            # 客户端指定了人格时绑定到当前对话
+            if persona_id and conversation is not None and conversation.persona_id != persona_id:
+                await conv_mgr.update_conversation_persona_id(umo, persona_id)
+        except Exception as e:
+            logger.info(f'[SessionPreloader] 预热会话失败 {umo}: {e}')
+        logger.info(f'[SessionPreloader] 会话 {umo} 预热完成，耗时 {loop.time() - started:.3f}s')
@@ -0,0 +1,101 @@
+import asyncio
+import functools
+import json
+from collections import OrderedDict
+
+from astrbot import logger
+from astrbot.api.provider import ProviderRequest
+
+
+class SpeculativeTurns:
+    """
+    群聊预取请求（speculative）的对话历史管理。
+
+    客户端在上一位角色说完时就为下一位角色发出请求，期间有人插话时该回复会被丢弃，
+    因此预取的一轮不能直接写入 AstrBot 的对话历史：提交事件时附带自行构造的 ProviderRequest
+    （带上当前历史和人格提示词，但不关联对话），AstrBot 不会保存这一轮；客户端采用回复后
+    发送 speculative_commit，回复完整时再由这里把该轮问答追加到对话历史。
+    未被采用的请求只在内存中保留最近 max_entries 条。
+    """
+
+    def __init__(self, context_getter, max_entries: int = 64):
+        self._context_getter = context_getter
+        self.max_entries = max_entries
+        # request_id -> {'umo', 'cid', 'prompt', 'reply', 'committed'}
+        self._turns = OrderedDict()
+        # unified_msg_origin -> 写入历史的任务，同一会话的下一条消息提交前等待其完成
+        self._writes = {}
+
+    async def prepare(self, event, umo: str, session: dict) -> bool:
+        """为预取请求附带不关联对话的 ProviderRequest，上下文不可用时返回 False（按普通请求处理）"""
+        context = self._context_getter()
+        if context is None or not session.get('conversation_id'):
+            return False
+        try:
+            conversation = await context.conversation_manager.get_conversation(umo, session['conversation_id'])
+            contexts = json.loads(conversation.history or '[]')
+        except Exception as e:
+            logger.info(f'[SpeculativeTurns] 读取对话历史失败，按普通请求处理 {umo}: {e}')
+            return False
+        event.set_extra('provider_request', ProviderRequest(
+            prompt=event.message_str,
+            session_id=event.session_id,
+            image_urls=[],
+            contexts=contexts,
+            system_prompt=session.get('system_prompt') or '',
+            conversation=None,
+        ))
+        event.on_reply = self.on_reply
+        self._turns[event.request_id] = {
+            'umo': umo, 'cid': session['conversation_id'], 'prompt': event.message_str,
+            'reply': None, 'committed': False,
+        }
+        while len(self._turns) > self.max_entries:
+            self._turns.popitem(last=False)
+        return True
+
+    def on_reply(self, request_id: str, text: str):
+        """预取请求的回复发送完毕"""
+        turn = self._turns.get(request_id)
+        if turn is not None:
+            turn['reply'] = text
+            self._save_if_ready(request_id)
+
+    def commit(self, request_id: str):
+        """客户端采用了预取的回复"""
+        turn = self._turns.get(request_id)
+        if turn is not None:
+            turn['committed'] = True
+            self._save_if_ready(request_id)
+
+    async def wait(self, umo: str):
+        """等待该会话尚未完成的历史写入"""
+        task = self._writes.get(umo)
+        if task is not None:
+            await asyncio.shield(task)
+
+    def _save_if_ready(self, request_id: str):
+        turn = self._turns[request_id]
+        if turn['committed'] and turn['reply'] is not None:
+            del self._turns[request_id]
+            umo = turn['umo']
+            # 同一会话的写入按采用顺序依次进行
+            task = self._writes[umo] = asyncio.create_task(self._save(turn, self._writes.get(umo)))
+            task.add_done_callback(functools.partial(self._forget_write, umo))
+
+    def _forget_write(self, umo: str, task: asyncio.Task):
+        if self._writes.get(umo) is task:
+            del self._writes[umo]
+
+    async def _save(self, turn: dict, previous):
+        if previous is not None:
+            await asyncio.shield(previous)
+        context = self._context_getter()
+        try:
+            conv_mgr = context.conversation_manager
+            conversation = await conv_mgr.get_conversation(turn['umo'], turn['cid'])
+            history = json.loads(conversation.history or '[]')
+            history += [{'role': 'user', 'content': turn['prompt']}, {'role': 'assistant', 'content': turn['reply']}]
+            await conv_mgr.update_conversation(turn['umo'], turn['cid'], history=history)
+        except Exception as e:
+            logger.info(f'[SpeculativeTurns] 写入对话历史失败 {turn["umo"]}: {e}')
@@ -0,0 +1,107 @@
+import asyncio
+import uuid
+
+from astrbot import logger
+
+
+class ToolBridge:
+    """
+    把 Open LLM VTuber 客户端上报的本地 MCP 工具注册为 AstrBot 的 LLM 工具。
+
+    LLM 调用这些工具时，通过 MessageServer.call_tools 把调用转发给发起该对话的客户端，
+    由客户端的 ToolExecutor 执行后返回结果。AstrBot 同时发起的多个调用（同一客户端、同一请求）
+    合并为一个 tool_calls 帧，由客户端并发执行，每个调用在其结果返回时即完成。
+    客户端断开且不再续传后，注销它上报的工具。
+    """
+
+    # JSON Schema 类型到 AstrBot 函数参数类型的映射
+    TYPE_MAP = {'string': 'string', 'integer': 'number', 'number': 'number',
+                'boolean': 'boolean', 'array': 'array', 'object': 'object'}
+
+    def __init__(self, context_getter, server_getter):
+        self._context_getter = context_getter
+        self._server_getter = server_getter
+        # 工具名 -> 上报该工具的客户端ID
+        self.tools = {}
+        # (客户端ID, request_id) -> 本轮事件循环中待发送的 [(调用, future)]
+        self._batches = {}
+        self._tasks = set()
+
+    def register(self, client_id: str, tools: list):
+        """注册客户端上报的工具，tools 为 OpenAI function 格式"""
+        context = self._context_getter()
+        if context is None:
+            logger.info('[ToolBridge] 插件上下文不可用，无法注册客户端工具')
+            return
+        for tool in tools:
+            function = tool.get('function', tool)
+            name = function['name']
+            properties = function.get('parameters', {}).get('properties', {})
+            func_args = [
+                {
+                    'type': self.TYPE_MAP.get(spec.get('type'), 'string'),
+                    'name': arg_name,
+                    'description': spec.get('description', ''),
+                }
+                for arg_name, spec in properties.items()
+            ]
+            if name in self.tools:
+                context.unregister_llm_tool(name)
+            context.register_llm_tool(name, func_args, function.get('description', ''), self._make_handler(name))
+            self.tools[name] = client_id
+        logger.info(f'[ToolBridge] 已注册客户端 {client_id} 的工具: {[t.get("function", t)["name"] for t in tools]}')
+
+    def unregister_client(self, client_id: str):
+        """注销客户端上报的工具（被其它客户端重新上报的同名工具除外）"""
+        names = [name for name, owner in self.tools.items() if owner == client_id]
+        if not names:
+            return
+        context = self._context_getter()
+        for name in names:
+            del self.tools[name]
+            if context is not None:
+                context.unregister_llm_tool(name)
+        logger.info(f'[ToolBridge] 已注销客户端 {client_id} 的工具: {names}')
+
+    def _make_handler(self, name: str):
+        async def handler(event, **kwargs):
+            server = self._server_getter()
+            client_id = getattr(event, 'client_id', None)
+            if server is None or client_id not in server.connections:
+                return f'工具 {name} 仅在 Open LLM VTuber 会话中可用'
+            result = await self._call(client_id, getattr(event, 'request_id', None), name, kwargs)
+            if result['is_error']:
+                return f'工具 {name} 执行失败: {result["content"]}'
+            return result['content']
+        return handler
+
+    async def _call(self, client_id: str, request_id: str, name: str, arguments: dict) -> dict:
+        """加入当前批次并等待该调用的结果；批次在本轮事件循环结束时发送"""
+        loop = asyncio.get_running_loop()
+        key = (client_id, request_id)
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = []
+            loop.call_soon(self._flush, key)
+        future = loop.create_future()
+        batch.append(({'call_id': uuid.uuid4().hex, 'name': name, 'arguments': arguments}, future))
+        return await future
+
+    def _flush(self, key: tuple):
+        task = asyncio.create_task(self._run(*key, self._batches.pop(key)))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, client_id: str, request_id: str, batch: list):
+        futures = {call['call_id']: future for call, future in batch}
+        try:
+            async for call, result in self._server_getter().call_tools(
+                client_id, [call for call, _ in batch], request_id
+            ):
+                future = futures[call['call_id']]
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
@@ -0,0 +1,182 @@
+import asyncio
+import base64
+import hashlib
+import mimetypes
+import os
+import re
+import time
+
+from astrbot import logger
+
+# upload_id 必须是小写十六进制的 sha256，既是内容校验也防止拼接出上传目录之外的路径
+_UPLOAD_ID = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadManager:
+    """
+    分块上传的服务端状态。
+
+    客户端用 upload_begin / upload_chunk / upload_end 分块发送大图片和附件，
+    每块按顺序直接追加写入磁盘，不在内存中拼接。upload_id 为整个文件的 sha256。
+    upload_begin 和 upload_end 的回复都带有已接收的字节数，分块出错或连接断开后
+    客户端重新 upload_begin 即可从该位置继续。
+
+    同时进行的上传数和声明的总字节数有上限。连接关闭（不再续传）时删除其未完成的
+    .part 文件；完成的文件被消息引用后 used_ttl 秒删除，始终未被引用的在 completed_ttl 秒后删除。
+    上传目录在第一次上传时才创建。
+    """
+
+    def __init__(self, upload_dir: str = 'temp_uploads', max_upload_bytes: int = 512 * 1024 * 1024,
+                 max_active_uploads: int = 16, max_active_bytes: int = 1024 * 1024 * 1024,
+                 used_ttl: float = 300.0, completed_ttl: float = 600.0, stale_part_age: float = 3600.0):
+        self.upload_dir = upload_dir
+        self.max_upload_bytes = max_upload_bytes
+        self.max_active_uploads = max_active_uploads
+        self.max_active_bytes = max_active_bytes
+        self.used_ttl = used_ttl
+        self.completed_ttl = completed_ttl
+        self.stale_part_age = stale_part_age
+        # upload_id -> {'path', 'size', 'received', 'hasher', 'name', 'mime_type', 'owner'}
+        self._active = {}
+        # upload_id -> [已完成文件路径, 删除定时器]
+        self._completed = {}
+        self._dir_ready = False
+
+    def _prepare_dir(self):
+        """创建上传目录，并删除之前的进程遗留的、长时间未续传的 .part 文件"""
+        if self._dir_ready:
+            return
+        os.makedirs(self.upload_dir, exist_ok=True)
+        self._dir_ready = True
+        now = time.time()
+        for name in os.listdir(self.upload_dir):
+            path = os.path.join(self.upload_dir, name)
+            if name.endswith('.part') and now - os.path.getmtime(path) > self.stale_part_age:
+                os.remove(path)
+
+    @staticmethod
+    def _check_id(upload_id) -> str:
+        if not isinstance(upload_id, str) or not _UPLOAD_ID.match(upload_id):
+            raise ValueError('非法的 upload_id')
+        return upload_id
+
+    def begin(self, data: dict, owner: str = None) -> int:
+        """开始或恢复一次上传，返回服务端已接收的字节数；owner 为发起上传的客户端ID"""
+        upload_id = self._check_id(data['upload_id'])
+        size = data['size']
+        if upload_id in self._completed:
+            return size
+        if not isinstance(size, int) or size < 0 or size > self.max_upload_bytes:
+            raise ValueError(f'文件过大: {size} 字节')
+        state = self._active.get(upload_id)
+        if state is None:
+            if len(self._active) >= self.max_active_uploads:
+                raise ValueError('同时进行的上传过多')
+            if sum(s['size'] for s in self._active.values()) + size > self.max_active_bytes:
+                raise ValueError('进行中的上传总大小超出上限')
+            self._prepare_dir()
+            part_path = os.path.join(self.upload_dir, f'{upload_id}.part')
+            hasher = hashlib.sha256()
+            received = 0
+            # 服务端重启后根据磁盘上已写入的部分恢复状态
+            if os.path.exists(part_path):
+                with open(part_path, 'rb') as f:
+                    for block in iter(lambda: f.read(65536), b''):
+                        hasher.update(block)
+                        received += len(block)
+            state = self._active[upload_id] = {
+                'path': part_path,
+                'size': data['size'],
+                'received': received,
+                'hasher': hasher,
+                'name': data.get('name', upload_id),
+                'mime_type': data.get('mime_type', 'application/octet-stream'),
+                'owner': owner,
+            }
+        else:
+            # 重连后续传，客户端ID可能已改变
+            state['owner'] = owner
+        return state['received']
+
+    def received(self, upload_id: str) -> int:
+        """返回进行中的上传已接收的字节数，未知的上传返回 0"""
+        state = self._active.get(upload_id) if isinstance(upload_id, str) else None
+        return state['received'] if state else 0
+
+    def abandon(self, owner: str):
+        """客户端连接关闭且不再续传：删除其未完成的上传"""
+        for upload_id, state in list(self._active.items()):
+            if state['owner'] == owner:
+                del self._active[upload_id]
+                try:
+                    os.remove(state['path'])
+                except OSError:
+                    pass
+                logger.info(f'[UploadManager] 丢弃未完成的上传: {state["name"]}')
+
+    def chunk(self, data: dict) -> int:
+        """写入一个分块，返回写入后已接收的字节数；顺序或校验不符时抛出 ValueError"""
+        state = self._active.get(self._check_id(data['upload_id']))
+        if state is None:
+            raise ValueError('未知的上传')
+        if data['offset'] != state['received']:
+            raise ValueError(f'分块偏移不连续: 期望 {state["received"]}，收到 {data["offset"]}')
+        chunk = base64.b64decode(data['data'])
+        if hashlib.sha256(chunk).hexdigest() != data['sha256']:
+            raise ValueError(f'分块 {data.get("index")} 校验失败')
+        if state['received'] + len(chunk) > state['size']:
+            raise ValueError('分块超出文件大小')
+        with open(state['path'], 'ab') as f:
+            f.write(chunk)
+        state['hasher'].update(chunk)
+        state['received'] += len(chunk)
+        return state['received']
+
+    def end(self, upload_id: str) -> str:
+        """校验完整文件并完成上传，返回文件路径"""
+        if self._check_id(upload_id) in self._completed:
+            return self._completed[upload_id][0]
+        state = self._active.get(upload_id)
+        if state is None:
+            raise ValueError('未知的上传')
+        if state['received'] < state['size']:
+            raise ValueError(f'文件不完整: 已接收 {state["received"]}/{state["size"]} 字节')
+        if state['hasher'].hexdigest() != upload_id:
+            # 内容损坏时丢弃已写入的数据，让客户端从头重传
+            del self._active[upload_id]
+            os.remove(state['path'])
+            raise ValueError('文件校验失败')
+        ext = mimetypes.guess_extension(state['mime_type']) or os.path.splitext(state['name'])[1]
+        final_path = os.path.join(self.upload_dir, f'{upload_id}{ext}')
+        os.replace(state['path'], final_path)
+        del self._active[upload_id]
+        self._completed[upload_id] = [final_path, None]
+        self._schedule_removal(upload_id, self.completed_ttl)
+        logger.info(f'[UploadManager] 上传完成: {state["name"]} -> {final_path}')
+        return final_path
+
+    def path_for(self, upload_id: str):
+        """
+        返回已完成上传的文件路径并标记为已使用（used_ttl 秒后删除，留给 AstrBot 处理消息），
+        不存在时返回 None
+        """
+        entry = self._completed.get(upload_id) if isinstance(upload_id, str) else None
+        if entry is None:
+            return None
+        self._schedule_removal(upload_id, self.used_ttl)
+        return entry[0]
+
+    def _schedule_removal(self, upload_id: str, delay: float):
+        entry = self._completed[upload_id]
+        if entry[1] is not None:
+            entry[1].cancel()
+        entry[1] = asyncio.get_running_loop().call_later(delay, self._remove_completed, upload_id)
+
+    def _remove_completed(self, upload_id: str):
+        entry = self._completed.pop(upload_id, None)
+        if entry is None:
+            return
+        try:
+            os.remove(entry[0])
+        except OSError:
+            pass
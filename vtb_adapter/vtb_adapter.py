@@ -1,30 +1,89 @@
 import asyncio
 import json
 import base64
+import inspect
 import os
 import uuid
 
 from astrbot.api.platform import Platform, AstrBotMessage, MessageMember, PlatformMetadata, MessageType
 from astrbot.api.event import MessageChain
-from astrbot.api.message_components import Plain, Image, Record # 消息链中的组件，可以根据需要导入
+from astrbot.api.message_components import Plain, Image, Record, File # 消息链中的组件，可以根据需要导入
 from astrbot.core.platform.astr_message_event import MessageSesion, AstrMessageEvent
 from astrbot import logger
 from astrbot.api.platform import register_platform_adapter
-from .server import MessageServer
+from .batcher import ChatBatcher
+from .recorder import FrameRecorder
+from .response_cache import ResponseCache
+from .server import MessageServer, running_servers
+from .session_preloader import SessionPreloader
+from .speculative import SpeculativeTurns
+from .tool_bridge import ToolBridge
 from .vtb_platform_event import VtbPlatformEvent
+
+# 客户端未选择历史记录时发送的会话ID
+DEFAULT_SESSION_ID = 'default_session'
             
 # 注册平台适配器。第一个参数为平台名，第二个为描述。第三个为默认配置。
 @register_platform_adapter("open_llm_vtb", "Open LLM VTB 适配器", default_config_tmpl={
     "server_host": "0.0.0.0",
-    "server_port": 8765
+    "server_port": 8765,
+    # 可选，Unix 套接字路径；与 Open-LLM-VTuber 同机部署时设置，改为监听该套接字（客户端 llm_url 使用 ws+unix://路径）
+    "server_socket_path": "",
+    # 可选，抓包文件路径（.jsonl.gz），用于离线回放复现性能问题
+    "capture_path": "",
+    # 每个连接的资源上限：单帧最大字节数、接收队列深度（帧）、发送缓冲高/低水位（字节）；帧大小和队列深度为 0 表示不限制
+    "max_frame_size": 4194304,
+    "max_queue": 8,
+    "write_limit_high": 65536,
+    "write_limit_low": 16384,
+    # 是否启用 permessage-deflate 压缩；大量空闲连接时关闭可显著降低每连接内存
+    "compression": True,
+    # 超过该字节数的出站帧（如图片）分片发送，分片之间可插入控制帧；0 为不分片
+    "fragment_size": 65536,
+    # 适配器停止（重载配置或插件）后等待新实例接管服务器的秒数，超时后开始排空
+    "reload_grace": 5,
+    # 排空时等待进行中的回复发送完毕的最长秒数
+    "drain_timeout": 30,
+    # 重复提问的回复缓存：过期秒数、最大条目数、相似问题的匹配阈值（0-1，1 为仅精确匹配）
+    "response_cache": False,
+    "response_cache_ttl": 600,
+    "response_cache_size": 512,
+    "response_cache_similarity": 0.9,
+    # 弹幕合并：窗口秒数（0 为不合并）与每轮最多合并的消息数，超出时按优先级和抽样取舍
+    "batch_window": 0,
+    "batch_max_size": 8,
+    # 回复中连续短文本的合并：最长等待秒数（0 为不合并）与字节上限，遇到句末立即发送
+    "text_coalesce_window": 0.05,
+    "text_coalesce_bytes": 4096
 })
 class VtbPlatformAdapter(Platform):
+    # 插件加载时由 main.py 注入 AstrBot 的 Context，用于会话预热
+    star_context = None
 
     def __init__(self, platform_config: dict, platform_settings: dict, event_queue: asyncio.Queue) -> None:
         super().__init__(event_queue)
         self.config = platform_config
         self.settings = platform_settings
         self.server = None
+        self.session_preloader = SessionPreloader(lambda: VtbPlatformAdapter.star_context)
+        self.speculative = SpeculativeTurns(lambda: VtbPlatformAdapter.star_context)
+        self.tool_bridge = ToolBridge(lambda: VtbPlatformAdapter.star_context, lambda: self.server)
+        self.response_cache = None
+        if platform_config.get('response_cache'):
+            self.response_cache = ResponseCache(
+                ttl=platform_config.get('response_cache_ttl', 600),
+                max_entries=platform_config.get('response_cache_size', 512),
+                similarity=platform_config.get('response_cache_similarity', 0.9),
+            )
+        self.batcher = None
+        if platform_config.get('batch_window'):
+            self.batcher = ChatBatcher(
+                self.handle_msg, lambda: self.server,
+                window=platform_config['batch_window'],
+                max_size=platform_config.get('batch_max_size', 8),
+            )
+        # 关闭了回复缓存的会话 (unified_msg_origin)
+        self._uncached_sessions = set()
     
     async def send_by_session(self, session: MessageSesion, message_chain: MessageChain):
         # 实现消息发送逻辑
@@ -53,11 +112,18 @@ class VtbPlatformAdapter(Platform):
                 })
         
         # 发送消息到所有连接的客户端
-        if self.server and self.server.clients:
-            for client in self.server.clients:
+        if self.server and self.server.connections:
+            for client_id, connection in list(self.server.connections.items()):
                 try:
-                    await client.send(json.dumps(message_data))
-                    print(f"[VtbPlatformAdapter] 消息已发送到客户端 {client.remote_address}")
+                    # 本地图片先通过哈希握手同步到客户端，消息链中只携带哈希
+                    for item in message_data['message_chain']:
+                        if item['type'] != 'image' or not item['file']:
+                            continue
+                        image_path = item['file'][8:] if item['file'].startswith('file:///') else item['file']
+                        if os.path.exists(image_path):
+                            item['hash'] = await self.server.offer_image(client_id, image_path)
+                    await self.server.send_frame(client_id, dict(message_data))
+                    print(f"[VtbPlatformAdapter] 消息已发送到客户端 {connection.websocket.remote_address}")
                 except Exception as e:
                     print(f"[VtbPlatformAdapter] 发送消息失败: {e}")
         
@@ -69,6 +135,40 @@ class VtbPlatformAdapter(Platform):
             "Open LLM VTB 适配器",
         )
 
+    def unified_msg_origin(self, session_id: str) -> str:
+        """计算会话在 AstrBot 中的 unified_msg_origin"""
+        return str(MessageSesion(self.meta().name, MessageType.FRIEND_MESSAGE, session_id))
+
+    @staticmethod
+    def session_id_of(data: dict) -> str:
+        """
+        消息或控制帧所属的会话ID。客户端选择了历史记录时使用其历史会话ID，重连后仍能接上同一个对话；
+        未选择时（客户端发送默认的 default_session）按客户端连接区分会话，避免不同客户端共用同一个对话
+        """
+        session_id = data.get('session_id')
+        if not session_id or session_id == DEFAULT_SESSION_ID:
+            return str(data.get('client_id', '1'))
+        return session_id
+
+    async def on_control(self, data: dict):
+        """处理客户端控制帧"""
+        umo = self.unified_msg_origin(self.session_id_of(data))
+        if data['type'] == 'session_open':
+            logger.info(f"[VtbPlatformAdapter] 预热会话 {umo}")
+            self.session_preloader.open(umo, data.get('persona_id'))
+            if data.get('response_cache', True):
+                self._uncached_sessions.discard(umo)
+            else:
+                self._uncached_sessions.add(umo)
+        elif data['type'] == 'session_close':
+            logger.info(f"[VtbPlatformAdapter] 释放会话 {umo}")
+            self.session_preloader.close(umo)
+            self._uncached_sessions.discard(umo)
+        elif data['type'] == 'speculative_commit':
+            self.speculative.commit(data.get('request_id'))
+        elif data['type'] == 'tools_register':
+            self.tool_bridge.register(data['client_id'], data.get('tools', []))
+
     async def run(self):
         """启动适配器和WebSocket服务器"""
         logger.info("[VtbPlatformAdapter] 启动适配器")
@@ -76,17 +176,77 @@ class VtbPlatformAdapter(Platform):
         # 从配置中获取服务器地址和端口
         host = self.config.get("server_host", "0.0.0.0")
         port = self.config.get("server_port", 8765)
+        socket_path = self.config.get("server_socket_path") or None
+        address = ('unix', socket_path) if socket_path else (host, port)
+        where = socket_path or f"{host}:{port}"
         
         async def on_received(data):
             logger.info(data)
             abm = await self.convert_message(data=data) # 转换成 AstrBotMessage
-            await self.handle_msg(abm) 
+            if await self.reply_from_cache(abm):
+                return
+            # 群聊预取请求单独提交，不与弹幕合并
+            if self.batcher and not abm.raw_message.get('speculative'):
+                self.batcher.add(abm)
+            else:
+                await self.handle_msg(abm)
+
+        capture_path = self.config.get("capture_path")
+        settings = self.server_settings()
+
+        # 监听地址未变时接管正在运行的服务器，只热重载其余设置，已有连接和进行中的回复不受影响
+        server = running_servers.get(address)
+        if server is not None and not server.draining:
+            server.adopt()
+            if capture_path != getattr(server.recorder, 'path', None):
+                settings['recorder'] = FrameRecorder(capture_path) if capture_path else None
+            server.reconfigure(**settings)
+            # 已连接的客户端不会重新上报工具，接管上一个适配器实例登记的工具，客户端离开时才能注销
+            self.tool_bridge.tools.update(server.adapter.tool_bridge.tools)
+            server.adapter = self
+            server.on_received = on_received
+            server.on_control = self.on_control
+            server.on_client_expired = self.tool_bridge.unregister_client
+            self.server = server
+            logger.info(f"[VtbPlatformAdapter] 接管运行中的WebSocket服务器 {where}")
+            await server.wait_closed()
+            return
 
         # 初始化并启动WebSocket服务器
-        self.server = MessageServer(host=host, port=port, adapter=self, on_received=on_received)
-        logger.info(f"[VtbPlatformAdapter] 启动WebSocket服务器在 {host}:{port}")
+        recorder = FrameRecorder(capture_path) if capture_path else None
+        self.server = MessageServer(host=host, port=port, adapter=self, on_received=on_received,
+                                    on_control=self.on_control, on_client_expired=self.tool_bridge.unregister_client,
+                                    recorder=recorder, socket_path=socket_path,
+                                    **settings)
+        logger.info(f"[VtbPlatformAdapter] 启动WebSocket服务器在 {where}")
         await self.server.start()
 
+    def server_settings(self) -> dict:
+        """
+        从适配器配置中读取 MessageServer 的可调设置。每一项都会传入，配置中删除的项恢复为
+        MessageServer 的默认值，这样热重载时也能把设置改回默认或改为 0/False
+        """
+        defaults = inspect.signature(MessageServer.__init__).parameters
+        settings = {}
+        for key in ('max_frame_size', 'max_queue', 'write_limit_high', 'write_limit_low',
+                    'fragment_size', 'drain_timeout', 'compression'):
+            value = self.config.get(key)
+            settings[key] = defaults[key].default if value is None else value
+        # websockets 以 None 表示不限制帧大小和队列深度
+        for key in ('max_frame_size', 'max_queue'):
+            if settings[key] == 0:
+                settings[key] = None
+        return settings
+
+    async def terminate(self):
+        """
+        AstrBot 停止适配器时调用。服务器不会立即关闭：新的适配器实例若在 reload_grace 秒内
+        以相同地址启动则直接接管；否则服务器排空，发完进行中的回复后通知客户端重连
+        """
+        if self.server is None or self.server.adapter is not self:
+            return
+        self.server.release(self.config.get('reload_grace', 5))
+
     async def convert_message(self, data: dict) -> AstrBotMessage:
         """将平台消息转换为AstrBotMessage"""
         abm = AstrBotMessage()
@@ -96,8 +256,9 @@ class VtbPlatformAdapter(Platform):
         abm.raw_message = data
         
         abm.self_id = data.get('bot_id', 'vtb_bot')
-        # 使用client_id作为session_id，确保1对1通信
-        abm.session_id = data.get('client_id', data.get('session_id', '1'))
+        # 使用客户端的历史会话ID作为session_id，重连后仍能接上同一个对话并复用预热的上下文；
+        # 回复通过client_id路由，确保1对1通信
+        abm.session_id = self.session_id_of(data)
         abm.message_id = data.get('msg_id', str(asyncio.get_event_loop().time()))
         
         abm.message = []
@@ -105,6 +266,14 @@ class VtbPlatformAdapter(Platform):
             abm.message.append(Plain(text=plain['content']))
         # 处理图片消息
         for image in data['messages']['images']:
+            # 通过分块上传发送的大图片，直接使用服务端已写入磁盘的文件
+            if image.get('upload_id'):
+                file_path = self.server.uploads.path_for(image['upload_id'])
+                if file_path:
+                    abm.message.append(Image(file=file_path))
+                else:
+                    logger.info(f"[VtbPlatformAdapter] 未找到已上传的图片: {image['upload_id']}")
+                continue
             # 获取base64图片数据
             base64_data = image['data']
             if base64_data.startswith('data:'):
@@ -132,19 +301,83 @@ class VtbPlatformAdapter(Platform):
             else:
                 # 如果不是data URL格式，直接使用
                 abm.message.append(Image(file=base64_data))
+        # 处理文件附件
+        for attachment in data['messages'].get('files', []):
+            if attachment.get('upload_id'):
+                file_path = self.server.uploads.path_for(attachment['upload_id'])
+                if not file_path:
+                    logger.info(f"[VtbPlatformAdapter] 未找到已上传的文件: {attachment['upload_id']}")
+                    continue
+            else:
+                encoded = attachment['data']
+                if encoded.startswith('data:'):
+                    encoded = encoded.split(',', 1)[1]
+                os.makedirs('temp_files', exist_ok=True)
+                file_path = os.path.join('temp_files', f"vtb_file_{uuid.uuid4()}_{os.path.basename(attachment['name'])}")
+                with open(file_path, 'wb') as f:
+                    f.write(base64.b64decode(encoded))
+            abm.message.append(File(name=attachment['name'], file=file_path))
 
         return abm
 
 
 
+    async def _cache_key(self, message: AstrBotMessage):
+        """
+        纯文本消息的回复缓存键 (人格, 消息文本)；不可缓存时返回 None。
+        人格取会话当前对话绑定的人格（未绑定时为默认人格），每条消息重新读取，
+        用户切换对话或人格后不会命中切换前的缓存。
+        批处理合并的消息（"昵称: 文本" 的拼接）不缓存
+        """
+        if self.response_cache is None or 'batched' in message.raw_message:
+            return None
+        umo = self.unified_msg_origin(message.session_id)
+        if umo in self._uncached_sessions:
+            return None
+        if not all(isinstance(component, Plain) for component in message.message):
+            return None
+        text = ' '.join(component.text for component in message.message)
+        if not self.response_cache.cacheable(text):
+            return None
+        session = await self.session_preloader.current(umo)
+        return (session['persona_id'], text)
+
+    async def reply_from_cache(self, message: AstrBotMessage) -> bool:
+        """命中回复缓存时直接回放缓存的回复帧，不提交给 AstrBot"""
+        key = await self._cache_key(message)
+        frames = self.response_cache.lookup(*key) if key else None
+        if frames is None:
+            return False
+        client_id = message.raw_message.get('client_id')
+        request_id = message.raw_message.get('request_id')
+        for frame in frames:
+            await self.server.send_frame(client_id, dict(frame), request_id)
+        await self.server.send_end(client_id, request_id)
+        return True
+
     async def handle_msg(self, message: AstrBotMessage):
         """处理消息并提交事件"""
+        # 等待会话预热完成，避免 AstrBot 与预热同时新建对话；以及上一轮预取回复写入历史
+        umo = self.unified_msg_origin(message.session_id)
+        await self.session_preloader.wait(umo)
+        await self.speculative.wait(umo)
         message_event = VtbPlatformEvent(
             message_str=message.message_str,
             message_obj=message,
             platform_meta=self.meta(),
             session_id=message.session_id,
-            server=self.server
+            server=self.server,
+            client_id=message.raw_message.get('client_id'),
+            response_cache=self.response_cache,
+            cache_key=await self._cache_key(message),
+            coalesce_window=self.config.get('text_coalesce_window', 0.05),
+            coalesce_bytes=self.config.get('text_coalesce_bytes', 4096)
         )
+        # 客户端要求流式回复时，覆盖 AstrBot 的全局流式设置（需 AstrBot 支持）
+        if message.raw_message.get('stream') is not None:
+            message_event.set_extra('enable_streaming', bool(message.raw_message['stream']))
+        # 群聊预取的请求在客户端采用之前不写入对话历史
+        if message.raw_message.get('speculative'):
+            await self.speculative.prepare(message_event, umo, await self.session_preloader.current(umo))
         self.commit_event(message_event) # 提交事件到事件队列
         logger.info(f"[VtbPlatformAdapter] 消息事件已提交: {message.session_id}")
\ No newline at end of file
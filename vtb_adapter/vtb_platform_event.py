@@ -6,23 +6,60 @@ from astrbot.core.utils.io import download_image_by_url
 from astrbot.api.event import filter, AstrMessageEvent
 from astrbot.api.provider import ProviderRequest
 from astrbot import logger
+from .coalescer import TextCoalescer
 from .server import MessageServer
 
 class VtbPlatformEvent(AstrMessageEvent):
-    def __init__(self, message_str: str, message_obj: AstrBotMessage, platform_meta: PlatformMetadata, session_id: str,server: MessageServer):
+    def __init__(self, message_str: str, message_obj: AstrBotMessage, platform_meta: PlatformMetadata, session_id: str,server: MessageServer,
+                 client_id: str = None, response_cache=None, cache_key: tuple = None,
+                 coalesce_window: float = 0.05, coalesce_bytes: int = 4096):
         super().__init__(message_str, message_obj, platform_meta, session_id)
         self.server = server
         self.sender_id = session_id  # 存储sender_id以便后续使用
-    
+        self.client_id = client_id or session_id  # 回复发往的客户端连接
+        # 客户端请求ID，随每个回复帧回传，使同一连接上的并发请求（如群聊多角色）互不干扰
+        self.request_id = message_obj.raw_message.get('request_id')
+        # 可缓存的请求：回复发送完毕后以 cache_key (人格, 消息文本) 存入回复缓存
+        self.response_cache = response_cache
+        self.cache_key = cache_key
+        # 连续的短文本合并为一帧发送，句末立即发送
+        self.coalescer = TextCoalescer(server, self.client_id, self.request_id, coalesce_window, coalesce_bytes)
+        # 群聊预取请求：回复发送完毕后以 (request_id, 回复文本) 回调，由 SpeculativeTurns 设置
+        self.on_reply = None
+        self._reply_parts = []
+
     def get_sender_id(self):
-        """返回发送者ID，用于1对1消息发送"""
+        """返回发送者ID"""
         return self.sender_id
         
     async def send(self, message: MessageChain):
+        texts = await self._send_chain(message, [])
+        await self._end_reply(texts)
+        await super().send(message) # 执行父类的 send 方法
+
+    async def send_streaming(self, generator, use_fallback: bool = False):
+        """
+        流式发送：AstrBot 开启流式回复时，LLM 每产生一段增量就作为 text 帧立即转发，
+        全部结束后发送一次 MESSAGE_END，客户端可以在第一个分句到达时就开始合成语音
+        """
+        texts = []
+        async for chain in generator:
+            texts = await self._send_chain(chain, texts)
+        await self._end_reply(texts)
+        await super().send_streaming(generator, use_fallback)
+
+    async def _send_chain(self, message: MessageChain, texts):
+        """发送消息链中的文字和图片，返回已发送的文字列表（含图片时返回 None，不缓存）"""
         for i in message.chain: # 遍历消息链
             if isinstance(i, Plain): # 如果是文字类型的
-                await self.server.send_text(to=self.get_sender_id(), message=i.text)
+                if texts is not None:
+                    texts.append(i.text)
+                if self.on_reply is not None:
+                    self._reply_parts.append(i.text)
+                await self.coalescer.add(i.text)
             elif isinstance(i, Image): # 如果是图片类型的 
+                # 图片文件可能是临时文件，含图片的回复不缓存
+                texts = None
                 img_url = i.file
                 img_path = ""
                 # 处理不同类型的图片路径
@@ -37,8 +74,18 @@ class VtbPlatformEvent(AstrMessageEvent):
                 else:
                     img_path = img_url
 
-                await self.server.send_image(to=self.get_sender_id(), image_path=img_path)
-        await self.server.websocket_client.send(json.dumps({
-            'type': 'MESSAGE_END'
-        }))
-        await super().send(message) # 执行父类的 send 方法
\ No newline at end of file
+                await self.coalescer.flush()
+                await self.server.send_image(to=self.client_id, image_path=img_path, request_id=self.request_id)
+        return texts
+
+    async def _end_reply(self, texts):
+        await self.coalescer.flush()
+        await self.server.send_end(to=self.client_id, request_id=self.request_id)
+        if self.on_reply is not None:
+            self.on_reply(self.request_id, ''.join(self._reply_parts))
+            self.on_reply = None
+        if self.cache_key is not None:
+            if texts:
+                # 流式回复的增量合并为一帧缓存
+                self.response_cache.store(*self.cache_key, [{'type': 'text', 'content': ''.join(texts)}])
+            self.cache_key = None
\ No newline at end of file